@@ -26,7 +26,7 @@ from classes.core.discord.keywords import (
 from classes.core.discord.table import Col, Table, clip
 from config import logger
 from utils.discord import alias_by_prefix, extract_quoted, paginate
-from utils.http import do_get
+from utils.http import do_get, from_columns
 from utils.misc import compose_1arg_fns
 from utils.parse import create_equip_link, int_to_price
 from yarl import URL
@@ -271,20 +271,20 @@ class EquipCog(commands.Cog):
             warning_params = None
             params_ = params.copy()
             opts_ = copy.deepcopy(opts)
-            items = await _fetch_equips(self.bot.api_url, params_)
+            items = await _fetch_equips(self.bot.api_url, params_, opts)
 
             # If no results, allow partial seller
             if len(items) == 0 and params.get("seller"):
                 params_["seller_partial"] = params.get("seller")
                 del params_["seller"]
-                items = await _fetch_equips(self.bot.api_url, params_)
+                items = await _fetch_equips(self.bot.api_url, params_, opts)
                 warning_params = f'Hint: Try using quotes if you are looking for a name containing a space (eg `seller"amy bot"`)'
 
             # If no results, allow partial buyer
             if len(items) == 0 and params.get("buyer"):
                 params_["buyer_partial"] = params.get("buyer")
                 del params_["buyer"]
-                items = await _fetch_equips(self.bot.api_url, params_)
+                items = await _fetch_equips(self.bot.api_url, params_, opts)
                 warning_params = f'Hint: Try using quotes if you are looking for a name containing a space (eg `buyer"amy bot"`)'
 
             # Still no results, return error
@@ -537,22 +537,20 @@ class EquipCog(commands.Cog):
 async def _fetch_equips(
     api_url: URL,
     params: types._Equip.FetchParams,
+    opts: types._Equip.FormatOptions,
 ) -> list[types._Equip.CogEquip]:
-    """Hit search endpoints for equip data
+    """Hit search endpoint for equip data (from both Super and Kedama auctions)
 
-    Rearranges keys in the response to satisfy CogEquip
-    (because the endpoints return slightly different dtos)
+    Items only have the fields that the tables (and the requested links) use.
     """
 
-    ep_super = api_url / "super" / "search_equips"
-    ep_kedama = api_url / "kedama" / "search_equips"
+    ep = api_url / "equips" / "search"
 
     # Search for equip that contains all words
     # so order doesn't matter and partial words are okay
     # eg "lege oak heimd" should match "Legendary Oak Staff of Heimdall"
     name_fragments = re.sub(r"\s", ",", params.get("name", "").strip())
-    ep_super %= dict(name=name_fragments)
-    ep_kedama %= dict(name=name_fragments)
+    ep %= dict(name=name_fragments)
 
     keys: list[str] = [
         "min_date",
@@ -565,31 +563,24 @@ async def _fetch_equips(
     ]
     for k in keys:
         if (v := params.get(k)) is not None:
-            ep_super %= {k: str(v).strip()}
-            ep_kedama %= {k: str(v).strip()}
+            ep %= {k: str(v).strip()}
 
     # Ignore on-going auctions
-    ep_super %= dict(complete="true")
-
-    super_data = await do_get(ep_super, content_type="json")
-    kedama_data = await do_get(ep_kedama, content_type="json")
-
-    # Normalize
-    for x in super_data:
-        x["auction"]["title_short"] = "S" + x["auction"]["title"].zfill(3)
-        x["auction"]["time"] = x["auction"]["end_time"]
-        del x["auction"]["end_time"]
-        x["min_bid"] = x["next_bid"]
-        del x["next_bid"]
-    for x in kedama_data:
-        x["auction"]["title_short"] = "K" + x["auction"]["title_short"].zfill(3)
-        x["auction"]["time"] = x["auction"]["start_time"]
-        del x["auction"]["start_time"]
-        x["min_bid"] = x["start_bid"]
-        del x["start_bid"]
-
-    resp = super_data + kedama_data
-    return resp
+    ep %= dict(complete="true")
+
+    # Skip the fields that aren't shown
+    fields = ["name", "price", "min_bid", "level", "stats", "buyer", "seller", "auction.time", "auction.title_short"]  # fmt: skip
+    if opts.show_equip_link:
+        fields += ["eid", "key", "is_isekai"]
+    if opts.show_thread_link:
+        fields += ["auction.id"]
+    ep %= dict(fields=",".join(fields))
+
+    # Columns of MessagePack are smaller and faster to decode than a list of json objects
+    ep %= dict(format="columns")
+
+    resp = await do_get(ep, content_type="msgpack")
+    return from_columns(resp)
 
 
 def _fmt_price(item: types._Equip.CogEquip) -> str:
@@ -185,13 +185,13 @@ class LotteryCog(commands.Cog):
     async def _lottery_win(self, params: types.FetchParams):
         async def main():
             # Fetch data
-            ep = self.bot.api_url / "lottery" / "search"
+            ep = self.bot.api_url / "lottery" / "user_stats"
             ep %= dict(user=params["name"])  # type: ignore
             if params.get("min_date"):
                 ep %= dict(min_date=str(params.get("min_date")))
             data = await do_get(ep, content_type="json")
 
-            if len(data) == 0:
+            if data["wins"] == 0:
                 msg = "No data found.\n```yaml\nSearch parameters:"
                 debug = params.copy()
                 debug["user"] = params["name"]  # type: ignore
@@ -203,63 +203,25 @@ class LotteryCog(commands.Cog):
 
                 pages = paginate(msg)
                 return pages
-            data.sort(key=lambda x: x["date"], reverse=True)
-
-            # Extract username
-            for item, winner in data[0]["prizes"]:
-                winner = winner or ""
-                if winner.lower() == params["name"].lower():  # type: ignore
-                    user = winner
-                    break
-            else:
-                raise Exception(
-                    f"{params.get('name')} did not win any prizes in lottery {data[0]}"
-                )
 
             # Print
-            item_tbl = create_item_table(data, user).print()
-            stats_tbl = create_stats_table(data, user).print()
+            user = data["user"]
+            item_tbl = create_item_table(data["lotteries"]).print()
+            stats_tbl = create_stats_table(data["stats"]).print()
             msg = f"```css\n@{user}\n\n{stats_tbl}\n\n{item_tbl}\n```"
             pages = paginate(msg)
             return pages
 
-        def create_stats_table(data: list[dict], user: str):
-            # Tally winnings
-            stats = {
-                "Equips": dict(count=0, wins=0),
-                "Core Wins": dict(count=0, wins=0),
-                "Chaos Tokens": dict(count=0, wins=0),
-                "GLTs": dict(count=0, wins=0),
-                "Candies": dict(count=0, wins=0),
+        def create_stats_table(totals: dict[str, dict]):
+            # Categories returned by /lottery/user_stats, in display order
+            labels = {
+                "equips": "Equips",
+                "cores": "Core Wins",
+                "chaos_tokens": "Chaos Tokens",
+                "glts": "GLTs",
+                "candies": "Candies",
             }
-
-            # Keys from the dict above but matching the lottery prize order
-            stat_keys = [
-                "Equips",
-                "Core Wins",
-                "GLTs",
-                "Candies",
-                "Chaos Tokens",
-                "Chaos Tokens",
-            ]
-
-            for lottery in data:
-                for idx, (item, winner) in enumerate(lottery["prizes"]):
-                    winner = winner or ""
-                    if winner == user:
-                        stats[stat_keys[idx]]["wins"] += 1
-
-                        if idx in [0, 1]:
-                            stats[stat_keys[idx]]["count"] += 1
-                        else:
-                            [count, name] = item
-                            stats[stat_keys[idx]]["count"] += count
-
-                        break
-                else:
-                    raise Exception(
-                        f"User {user} did not win any prizes in lottery {lottery}"
-                    )
+            stats = {label: totals[k] for k, label in labels.items()}
 
             # Crate table
             tbl = Table()
@@ -281,15 +243,14 @@ class LotteryCog(commands.Cog):
 
             return tbl
 
-        def create_item_table(data: list[dict], user: str):
+        def create_item_table(data: list[dict]):
             tbl = Table()
 
-            prize_col = Col(header="Prize", stringify=lambda d: fmt_prize(d, user))
-            tbl.add_col(prize_col, data)
+            prize = [x["prize"] for x in data]
+            prize_col = Col(header="Prize", stringify=_fmt_name)
+            tbl.add_col(prize_col, prize)
 
-            grand_prize_col = Col(
-                header="Grand Prize", stringify=lambda d: fmt_grand_prize(d, user)
-            )
+            grand_prize_col = Col(header="Grand Prize", stringify=fmt_grand_prize)
             tbl.add_col(grand_prize_col, data)
 
             ticket = [x["tickets"] for x in data]
@@ -305,25 +266,11 @@ class LotteryCog(commands.Cog):
 
             return tbl
 
-        def fmt_prize(lottery: dict, user: str):
-            prizes = lottery["prizes"]
-            if prizes[0][1] == user:  # type: ignore
-                return _fmt_name(prizes[0][0])
-            else:
-                for prize in prizes[1:]:
-                    winner = prize[1] or ""
-                    if winner == user:  # type: ignore
-                        return _fmt_name(prize[0])
-                else:
-                    raise Exception(
-                        f"User {user} did not win any prizes in lottery {lottery}"
-                    )
-
-        def fmt_grand_prize(lottery: dict, user: str):
-            if lottery["prizes"][0][1] == user:  # type: ignore
+        def fmt_grand_prize(lottery: dict):
+            if lottery["place"] == "1":
                 return "-"
             else:
-                return lottery["prizes"][0][0] or "??????????????????????"
+                return lottery["grand_prize"] or "??????????????????????"
 
         return await main()
 
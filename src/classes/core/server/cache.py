@@ -0,0 +1,154 @@
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable, Optional
+from urllib.parse import parse_qsl
+
+from config import paths
+
+# Params containing a comma separated list of search terms (whose order doesn't matter)
+TERM_LIST_PARAMS = {
+    "name",
+    "seller_partial",
+    "buyer_partial",
+    "user_partial",
+    "equip",
+    "stat",
+}
+
+# Params containing a user name / search terms that are compared case-insensitively
+CASELESS_PARAMS = TERM_LIST_PARAMS | {"seller", "buyer", "user"}
+
+# Params containing a comma separated list whose order doesn't matter (but whose case does)
+UNORDERED_LIST_PARAMS = TERM_LIST_PARAMS | {"fields"}
+
+# Params that don't affect the response body
+IGNORED_PARAMS = {"stream"}
+
+
+class ResultCache:
+    """LRU cache of encoded responses, emptied whenever the db changes
+
+    Changes are detected with PRAGMA data_version, which increments whenever another connection
+    (including one in another process, like the scrapers in the bot) commits to the db.
+    It's only comparable across calls on the same connection, so the cache keeps a dedicated one.
+    """
+
+    # Total size of the cached bodies, in bytes
+    MAX_SIZE = 64 * 1024**2
+
+    # Larger responses (eg a search without filters) aren't cached
+    MAX_ENTRY_SIZE = 4 * 1024**2
+
+    def __init__(self, fp: Path | str):
+        self.fp = fp
+
+        self.hits = 0
+        self.misses = 0
+        self.skips = 0  # responses that were too large / errors
+        self.evictions = 0
+        self.invalidations = 0
+        self.coalesced = 0  # requests that shared a concurrent request's response (see ResponseCache)
+
+        self._entries: OrderedDict[Hashable, tuple[int, object, bytes]] = OrderedDict()
+        self._size = 0
+        self._version: Optional[int] = None
+        self._version_db: Optional[sqlite3.Connection] = None
+
+    def version(self) -> int:
+        """Check the db's data_version, dropping every entry if it changed"""
+
+        if self._version_db is None:
+            self._version_db = sqlite3.connect(self.fp, check_same_thread=False)
+
+        version = self._version_db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self.clear()
+            self._version = version
+
+        return version
+
+    def get(self, key: Hashable, version: int) -> Optional[tuple[object, bytes]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1], entry[2]
+
+    def put(self, key: Hashable, version: int, meta: object, body: bytes) -> None:
+        """Cache a response body (along with whatever's needed to replay it, eg headers)
+
+        Args:
+            version: data_version from before the response was created
+                     (so that a response built while the db changed isn't kept)
+        """
+
+        if len(body) > self.MAX_ENTRY_SIZE or version != self._version:
+            self.skips += 1
+            return
+
+        self._pop(key)
+        self._entries[key] = (version, meta, body)
+        self._size += len(body)
+
+        while self._size > self.MAX_SIZE:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def skip(self) -> None:
+        self.skips += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self) -> dict:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            skips=self.skips,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+            coalesced=self.coalesced,
+            entries=len(self._entries),
+            size=self._size,
+            max_size=self.MAX_SIZE,
+        )
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[2])
+
+
+def normalize_query(query_string: str) -> tuple[tuple[str, str], ...]:
+    """Reduce a query string to a key that's the same for requests with the same results
+
+    eg "name=Oak,leg&stream=true" and "name=LEG, oak" both become (("name", "leg,oak"),)
+    """
+
+    params: dict[str, str] = dict()
+    for k, v in parse_qsl(query_string, keep_blank_values=True):
+        # FastAPI uses the last value of a repeated param
+        params[k] = v.strip()
+
+    for k in IGNORED_PARAMS:
+        params.pop(k, None)
+
+    for k, v in params.items():
+        if k in CASELESS_PARAMS:
+            # Non-ascii letters aren't compared case-insensitively (see _add_partial_match)
+            v = "".join(c.lower() if c.isascii() else c for c in v)
+        if k in UNORDERED_LIST_PARAMS:
+            v = ",".join(sorted(x.strip() for x in v.split(",")))
+        params[k] = v
+
+    return tuple(sorted(params.items()))
+
+
+RESULT_CACHE = ResultCache(paths.DB_FILE)
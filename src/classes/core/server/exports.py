@@ -0,0 +1,350 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Iterator, Literal
+
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+
+from classes.core.server import logger
+from config import paths
+
+EXPORTED_TABLES = ['super_auctions', 'super_equips', 'super_mats', 'super_fails', 'kedama_auctions' ,'kedama_equips', 'kedama_mats', 'kedama_fails_item', 'lottery_weapon', 'lottery_armor']  # fmt: skip
+
+ExportName = Literal["sqlite", "sqlite-file", "json"]
+
+
+class ExportCache:
+    """Export files that are built once per change to the exported tables
+
+    Files are named after the data_generation they were built from (eg sqlite-123.sql),
+    and each one has a gzip'd copy next to it so that nothing is compressed per request.
+    The generation is stored in the db, so builds survive restarts and can be shared between processes.
+    """
+
+    # Builds of older generations that are kept around (for downloads that are still in progress)
+    KEEP = 2
+
+    # Seconds that an older build is kept for after it's replaced, even beyond KEEP
+    #   (a FileResponse only opens the file once it starts sending)
+    PRUNE_AFTER = 60 * 60
+
+    def __init__(self, fp: Path | str, dir: Path):
+        self.fp = fp
+        self.dir = dir
+
+        self._builders: dict[str, tuple[str, Callable[[Path], int]]] = {
+            "sqlite": ("sql", self._build_sqlite),
+            "sqlite-file": ("sqlite", self._build_sqlite_file),
+            "json": ("json", self._build_json),
+        }
+        self._locks = {name: threading.Lock() for name in self._builders}
+
+    def get(self, DB: sqlite3.Connection, name: ExportName) -> tuple[int, Path]:
+        """Get the (uncompressed) export for the current generation, building it if necessary"""
+
+        ext, build = self._builders[name]
+        generation = get_generation(DB)
+
+        fp = self.dir / f"{name}-{generation}.{ext}"
+        if fp.exists():
+            return generation, fp
+
+        with self._locks[name]:
+            # Another thread may have built it in the meantime
+            if fp.exists():
+                return generation, fp
+
+            tmp = self.dir / f"{name}.{os.getpid()}.tmp"
+            logger.info(f"Building {name} export")
+            generation = build(tmp)
+
+            # The build may have seen a newer generation than the one checked above
+            fp = self.dir / f"{name}-{generation}.{ext}"
+            os.replace(_gz_path(tmp), _gz_path(fp))
+            os.replace(tmp, fp)
+
+            self._prune(name, ext)
+            return generation, fp
+
+    def respond(
+        self, request: Request, DB: sqlite3.Connection, name: ExportName
+    ) -> Response:
+        """Serve an export from disk
+
+        Clients that accept gzip get the compressed copy (with Content-Encoding: gzip).
+        Supports conditional (If-None-Match / If-Modified-Since) and Range requests.
+        """
+
+        generation, fp = self.get(DB, name)
+
+        is_gzip = _accepts_gzip(request.headers.get("accept-encoding", ""))
+        if is_gzip:
+            fp = _gz_path(fp)
+
+        headers = {
+            "etag": f'"{name}-{generation}{"-gzip" if is_gzip else ""}"',
+            "vary": "Accept-Encoding",
+            "x-data-generation": str(generation),  # for /export/changes
+        }
+        if is_gzip:
+            headers["content-encoding"] = "gzip"
+
+        if _is_not_modified(request, headers["etag"], fp):
+            return Response(status_code=304, headers=headers)
+
+        media_type = {
+            "sqlite": "text/plain; charset=utf-8",
+            "sqlite-file": "application/vnd.sqlite3",
+            "json": "application/json",
+        }
+        return FileResponse(
+            fp,
+            media_type=media_type[name],
+            headers=headers,
+            filename="db.sqlite" if name == "sqlite-file" else None,
+        )
+
+    def _build_sqlite(self, fp: Path) -> int:
+        """Equivalent to .dump in sqlite3, for the exported tables only"""
+
+        generation, DB_COPY = self._copy_exported_tables()
+        try:
+            with _open_outputs(fp) as write:
+                for line in DB_COPY.iterdump():
+                    write(line.encode() + b"\n")
+        finally:
+            DB_COPY.close()
+
+        return generation
+
+    def _build_sqlite_file(self, fp: Path) -> int:
+        """Compacted db file containing the exported tables only"""
+
+        generation, DB_COPY = self._copy_exported_tables()
+        try:
+            fp.unlink(missing_ok=True)
+            DB_COPY.execute("VACUUM INTO ?", (str(fp),))
+        finally:
+            DB_COPY.close()
+
+        with open(fp, "rb") as file, gzip.open(
+            _gz_path(fp), "wb", compresslevel=6
+        ) as gz_file:
+            shutil.copyfileobj(file, gz_file)
+
+        return generation
+
+    def _copy_exported_tables(self) -> tuple[int, sqlite3.Connection]:
+        """Copy the exported tables (and their indexes) into an in-memory db
+
+        Returns:
+            The generation of the copied data and the in-memory db
+        """
+
+        DB_COPY = sqlite3.connect(":memory:", isolation_level=None)
+        try:
+            DB_COPY.execute("ATTACH DATABASE ? AS src", (str(self.fp),))
+
+            # One transaction so that every table is from the same snapshot
+            DB_COPY.execute("BEGIN")
+            generation = get_generation(DB_COPY, "src")
+
+            schema = DB_COPY.execute(
+                f"""
+                SELECT sql FROM src.sqlite_master
+                WHERE type IN ('table', 'index') AND tbl_name IN ({",".join("?" for _ in EXPORTED_TABLES)}) AND sql IS NOT NULL
+                ORDER BY type = 'index'
+                """,
+                EXPORTED_TABLES,
+            ).fetchall()
+            for (sql,) in schema:
+                DB_COPY.execute(sql)
+            for tbl in EXPORTED_TABLES:
+                DB_COPY.execute(f"INSERT INTO main.{tbl} SELECT * FROM src.{tbl}")
+
+            DB_COPY.execute("COMMIT")
+            DB_COPY.execute("DETACH DATABASE src")
+        except:
+            DB_COPY.close()
+            raise
+
+        return generation, DB_COPY
+
+    def _build_json(self, fp: Path) -> int:
+        """Dump the exported tables as {table_name: [row, ...]}"""
+
+        DB = sqlite3.connect(self.fp, isolation_level=None)
+        DB.row_factory = sqlite3.Row
+        try:
+            # One transaction so that every table is from the same snapshot
+            DB.execute("BEGIN")
+            generation = get_generation(DB)
+
+            with _open_outputs(fp) as write:
+                for idx, tbl in enumerate(EXPORTED_TABLES):
+                    write((b"," if idx else b"{") + orjson.dumps(tbl) + b":[")
+                    for jdx, row in enumerate(DB.execute(f"SELECT * FROM {tbl}")):
+                        write((b"," if jdx else b"") + orjson.dumps(dict(row)))
+                    write(b"]")
+                write(b"}")
+
+            DB.execute("COMMIT")
+        finally:
+            DB.close()
+
+        return generation
+
+    def _prune(self, name: str, ext: str) -> None:
+        """Delete all but the latest few builds, once they've been replaced for PRUNE_AFTER seconds"""
+
+        builds = sorted(
+            self.dir.glob(f"{name}-*.{ext}"),
+            key=lambda fp: int(fp.stem.split("-")[-1]),
+        )
+        for fp, newer in zip(builds[: -(self.KEEP + 1)], builds[1:]):
+            try:
+                replaced_at = newer.stat().st_mtime
+            except FileNotFoundError:
+                # Pruned by another process
+                continue
+            if time.time() - replaced_at < self.PRUNE_AFTER:
+                break
+
+            fp.unlink(missing_ok=True)
+            _gz_path(fp).unlink(missing_ok=True)
+
+
+def get_generation(DB: sqlite3.Connection, schema="main") -> int:
+    return DB.execute(f"SELECT value FROM {schema}.data_generation").fetchone()[0]
+
+
+def iter_changes(fp: Path | str, since: int, chunk_size=64 * 1024) -> Iterator[bytes]:
+    """Stream the changes to the exported tables after the given version, as newline-delimited json
+
+    Each line is one of
+        {"table": ..., "op": "upsert", "row": {col: value, ...}}
+        {"table": ..., "op": "delete", "key": {col: value, ...}}
+    followed by a last line of {"version": ...}, which is the since for the next call.
+    It's only sent after every change, so a response without it was cut off and shouldn't be applied.
+
+    Lines are yielded in chunks of about chunk_size bytes (like server._iter_json), not one by one.
+
+    The stream has its own connection rather than a pooled reader (see get_db),
+    since it can outlive the request (eg a client that disconnects leaves it to be closed by the gc).
+    """
+
+    # Iterated from the threadpool, so possibly from a different thread each time
+    DB = sqlite3.connect(fp, isolation_level=None, check_same_thread=False)
+    DB.row_factory = sqlite3.Row
+    try:
+        DB.execute("PRAGMA query_only = 1")
+
+        # One transaction so that every table is from the same snapshot
+        DB.execute("BEGIN")
+        version = get_generation(DB)
+        buffer = bytearray()
+
+        for tbl in EXPORTED_TABLES:
+            key_cols = [
+                r[0]
+                for r in DB.execute(
+                    "SELECT name FROM pragma_table_info(?) WHERE pk > 0 ORDER BY pk",
+                    (tbl,),
+                )
+            ]
+            join = " AND ".join(
+                f"t.{col} = c.key ->> {idx}" for idx, col in enumerate(key_cols)
+            )
+            rows = DB.execute(
+                f"""
+                SELECT c.key AS change_key, t.rowid IS NULL AS change_deleted, t.*
+                FROM change_log AS c LEFT JOIN {tbl} AS t ON {join}
+                WHERE c.tbl = ? AND c.version > ?
+                ORDER BY c.version
+                """,
+                (tbl, since),
+            )
+
+            for r in rows:
+                if r["change_deleted"]:
+                    key = dict(zip(key_cols, orjson.loads(r["change_key"])))
+                    change = dict(table=tbl, op="delete", key=key)
+                else:
+                    row = {k: r[k] for k in r.keys()[2:]}
+                    change = dict(table=tbl, op="upsert", row=row)
+                buffer += orjson.dumps(change) + b"\n"
+
+                if len(buffer) >= chunk_size:
+                    yield bytes(buffer)
+                    buffer.clear()
+
+        buffer += orjson.dumps(dict(version=version)) + b"\n"
+        DB.execute("COMMIT")
+        yield bytes(buffer)
+    finally:
+        if DB.in_transaction:
+            DB.execute("ROLLBACK")
+        DB.close()
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip (with a q-value above 0, eg not "gzip;q=0")"""
+
+    qs: dict[str, float] = dict()
+    for part in accept_encoding.split(","):
+        coding, *params = [x.strip() for x in part.split(";")]
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qs[coding.lower()] = q
+
+    return qs.get("gzip", qs.get("*", 0.0)) > 0
+
+
+def _gz_path(fp: Path) -> Path:
+    return fp.with_name(fp.name + ".gz")
+
+
+@contextmanager
+def _open_outputs(fp: Path) -> Iterator[Callable[[bytes], None]]:
+    """Write to a file and a gzip'd copy of it at the same time"""
+
+    with open(fp, "wb") as file, gzip.open(
+        _gz_path(fp), "wb", compresslevel=6
+    ) as gz_file:
+
+        def write(data: bytes) -> None:
+            file.write(data)
+            gz_file.write(data)
+
+        yield write
+
+
+def _is_not_modified(request: Request, etag: str, fp: Path) -> bool:
+    if if_none_match := request.headers.get("if-none-match"):
+        return etag in [x.strip() for x in if_none_match.split(",")] or if_none_match.strip() == "*"  # fmt: skip
+
+    if if_modified_since := request.headers.get("if-modified-since"):
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(fp.stat().st_mtime) <= since
+
+    return False
+
+
+EXPORTS = ExportCache(paths.DB_FILE, paths.EXPORT_DIR)
@@ -0,0 +1,97 @@
+from typing import Any, Iterable, Literal, Optional, Sequence
+
+import msgpack
+import orjson
+
+from utils.http import MSGPACK_TYPE
+
+# Search response layouts (the format param)
+#   "json" is a list of items
+#   "columns" sends each field once, with a list of its values (see to_columns)
+Layout = Literal["json", "columns"]
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """Whether a request's Accept header asks for MessagePack (instead of json)"""
+
+    return accept is not None and "msgpack" in accept
+
+
+def to_columns(items: list[dict]) -> dict:
+    """Turn a list of items into a dict of lists, one per field
+
+    Nested objects with the same fields in every item become nested dicts of lists,
+    eg [dict(id=1, auction=dict(id=2)), ...] becomes dict(id=[1, ...], auction=dict(id=[2, ...]))
+    Others (like an equip's stats) stay a list of objects.
+    All items are expected to have the same fields.
+    """
+
+    if not items:
+        return dict()
+
+    columns: dict[str, Any] = dict()
+    for k in items[0]:
+        values = [item[k] for item in items]
+        columns[k] = to_columns(values) if _is_record(values) else values
+    return columns
+
+
+def _is_record(values: list) -> bool:
+    """Whether the values are objects with the same (non-zero) fields"""
+
+    first = values[0]
+    if not isinstance(first, dict) or not first:
+        return False
+    return all(isinstance(v, dict) and v.keys() == first.keys() for v in values)
+
+
+def encode(items: Iterable[bytes], layout: Layout, msgpack_: bool) -> bytes:
+    """Re-encode json items in another layout / as MessagePack"""
+
+    rows = [orjson.loads(x) for x in items]
+    data = to_columns(rows) if layout == "columns" else rows
+    return _dump(data, msgpack_)
+
+
+def encode_values(
+    paths: list[tuple[str, ...]],
+    rows: Iterable[Sequence[Any]],
+    layout: Layout,
+    msgpack_: bool,
+) -> bytes:
+    """Encode items from the values of their fields (the same as encode() would for the built items)
+
+    Args:
+        paths: Field of each value, eg ("auction", "id") for item["auction"]["id"]
+        rows: Values of each item, in the same order as paths
+    """
+
+    data: Any
+    if layout == "columns":
+        rows = list(rows)
+        data = dict()
+        if rows:
+            for idx, path in enumerate(paths):
+                values = [r[idx] for r in rows]
+                _put(data, path, to_columns(values) if _is_record(values) else values)
+    else:
+        data = []
+        for r in rows:
+            item: dict = dict()
+            for path, value in zip(paths, r):
+                _put(item, path, value)
+            data.append(item)
+
+    return _dump(data, msgpack_)
+
+
+def _put(obj: dict, path: tuple[str, ...], value: Any) -> None:
+    for name in path[:-1]:
+        obj = obj.setdefault(name, dict())
+    obj[path[-1]] = value
+
+
+def _dump(data: Any, msgpack_: bool) -> bytes:
+    if msgpack_:
+        return msgpack.packb(data)
+    return orjson.dumps(data)
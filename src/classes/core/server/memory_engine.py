@@ -0,0 +1,318 @@
+"""In-memory copy of an equip search's rows, for answering its filters without a query
+
+Requires numpy, so it's only imported when server_config.toml selects it (see settings.py).
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np
+
+from classes.core.server import logger
+from classes.db import ConnectionManager
+
+# What LIKE and NOCASE fold. Other letters are compared as-is.
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+class _Vocab:
+    """Dictionary-encoded text column
+
+    Each row stores the index of its (distinct) value, so a filter is evaluated once per distinct value
+    and then mapped back to the rows with a single lookup, lut[codes].
+    """
+
+    def __init__(self, values: list[Optional[str]]):
+        index: dict[Optional[str], int] = {}
+        self.codes = np.fromiter(
+            (index.setdefault(v, len(index)) for v in values), np.int32, len(values)
+        )
+
+        self.values = list(index)
+        self.folded = np.array(
+            [(v or "").translate(_ASCII_LOWER) for v in self.values], dtype=np.str_
+        )
+        self.not_null = np.array([v is not None for v in self.values], dtype=bool)
+
+    def contains(self, fragment: str) -> np.ndarray:
+        """Rows matching LIKE '%fragment%'"""
+
+        fragment = fragment.translate(_ASCII_LOWER)
+        if "%" in fragment or "_" in fragment:
+            patt = "".join(
+                ".*" if c == "%" else "." if c == "_" else re.escape(c)
+                for c in fragment
+            )
+            regex = re.compile(patt, re.DOTALL)
+            lut = np.fromiter(
+                (regex.search(v) is not None for v in self.folded.tolist()),
+                bool,
+                len(self.values),
+            )
+        else:
+            lut = np.strings.find(self.folded, fragment) >= 0
+
+        return (lut & self.not_null)[self.codes]
+
+    def equals(self, value: str) -> np.ndarray:
+        """Rows matching = value COLLATE NOCASE"""
+
+        lut = (self.folded == value.translate(_ASCII_LOWER)) & self.not_null
+        return lut[self.codes]
+
+
+@dataclass
+class _Order:
+    perm: np.ndarray  # row indices, in result order
+    sort: Optional[np.ndarray]  # sort values (nan for null)
+    sort_values: Optional[list[Any]]  # the same, as read from the db (for cursors)
+
+
+class EquipSnapshot:
+    """Column arrays of every row of a search, as of some db version
+
+    Filters are evaluated over the whole table as boolean masks, and matches are ordered with
+    a permutation computed at load time, so a search never sorts.
+    Results (including paging) are the same as the query the snapshot was loaded from.
+    """
+
+    def __init__(self, version: int, rows: list[sqlite3.Row], has_complete: bool):
+        """
+        Args:
+            rows: Rows with the columns selected by EquipEngine
+        """
+
+        self.version = version
+        self.size = len(rows)
+
+        self.items: list[bytes] = [r["item"] for r in rows]
+        self.key = np.array([r["page_key"] for r in rows], dtype=np.int64)
+
+        prices = [r["filter_price"] for r in rows]
+        dates = [r["filter_date"] for r in rows]
+        self.price = _float_column(prices)
+        self.date = _float_column(dates)
+        self.complete = (
+            _float_column([r["filter_complete"] for r in rows])
+            if has_complete
+            else None
+        )
+
+        self.name = _Vocab([r["filter_name"] for r in rows])
+        self.buyer = _Vocab([r["filter_buyer"] for r in rows])
+        self.seller = _Vocab([r["filter_seller"] for r in rows])
+
+        self.orders = {
+            None: _Order(np.argsort(-self.key, kind="stable"), None, None),
+            "price": _Order(self._sorted(self.price), self.price, prices),
+            "date": _Order(self._sorted(self.date), self.date, dates),
+        }
+
+    def _sorted(self, sort: np.ndarray) -> np.ndarray:
+        """Row indices sorted by (sort, key) descending, with nulls last"""
+
+        null = np.isnan(sort)
+        return np.lexsort((-self.key, -np.where(null, 0, sort), null))
+
+    def filter(
+        self,
+        name: Optional[str] = None,
+        min_date: Optional[float] = None,
+        max_date: Optional[float] = None,
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        seller: Optional[str] = None,
+        seller_partial: Optional[str] = None,
+        buyer: Optional[str] = None,
+        buyer_partial: Optional[str] = None,
+        complete: Optional[bool] = None,
+    ) -> np.ndarray:
+        """Mask of the rows matching the same filters as _equip_filters (minus the stat filter)"""
+
+        mask = np.ones(self.size, dtype=bool)
+
+        if name is not None:
+            for fragment in name.split(","):
+                mask &= self.name.contains(fragment.strip())
+
+        if min_date is not None:
+            mask &= self.date >= min_date
+        if max_date is not None:
+            mask &= self.date <= max_date
+
+        # Comparisons with nan are false, like comparisons with null
+        if min_price is not None:
+            mask &= self.price >= min_price
+        if max_price is not None:
+            mask &= (self.price <= max_price) | np.isnan(self.price)
+
+        for col, exact, partial in [
+            (self.buyer, buyer, buyer_partial),
+            (self.seller, seller, seller_partial),
+        ]:
+            if exact is not None:
+                mask &= col.equals(exact)
+            elif partial is not None:
+                for fragment in partial.split(","):
+                    mask &= col.contains(fragment.strip())
+
+        if complete is not None:
+            if self.complete is None:
+                raise ValueError("This search has no completion filter")
+            mask &= self.complete == int(complete)
+
+        return mask
+
+    def page(
+        self,
+        mask: np.ndarray,
+        order_by: Optional[str],
+        limit: Optional[int],
+        after: Optional[tuple[Optional[float], int]],
+    ) -> tuple[list[bytes], Optional[tuple[Any, int]]]:
+        """Return the matching (encoded) items in order, and the (sort, key) of the last one if there's a next page
+
+        Args:
+            after: (sort, key) of the last row of the previous page
+        """
+
+        order = self.orders[order_by]
+
+        if after is not None:
+            sort, key = after
+            if order.sort is None:
+                mask = mask & (self.key < key)
+            elif sort is None:
+                mask = mask & np.isnan(order.sort) & (self.key < key)
+            else:
+                mask = mask & (
+                    (order.sort < sort)
+                    | ((order.sort == sort) & (self.key < key))
+                    | np.isnan(order.sort)
+                )
+
+        idxs = order.perm[mask[order.perm]]
+
+        last = None
+        if limit is not None and len(idxs) > limit:
+            idxs = idxs[:limit]
+            idx = int(idxs[-1])
+            sort_value = None if order.sort_values is None else order.sort_values[idx]
+            last = (sort_value, int(self.key[idx]))
+
+        return [self.items[i] for i in idxs.tolist()], last
+
+
+def _float_column(values: list[Any]) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+class EquipEngine:
+    """Keeps an EquipSnapshot in sync with the db
+
+    Changes are detected with PRAGMA data_version (like ResultCache).
+    When the db changes, the snapshot is reloaded in a background thread and
+    current() returns None until it's done, so that callers fall back to querying the db
+    instead of waiting or seeing stale rows.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        query: str,
+        key_col: str,
+        price_col: str,
+        date_col: str,
+        complete_col: Optional[str] = None,
+    ):
+        """
+        Args:
+            query: Search query with {page_cols}, {where} and {order} placeholders, that selects an item column
+            key_col: Unique (integer) column that breaks ties, like the key_col of _search_page
+            price_col: Column that price filters / sorts apply to
+            date_col: Column that date filters / sorts apply to
+            complete_col: Column that the completion filter applies to
+        """
+
+        cols = [
+            "NULL as page_sort",
+            f"{key_col} as page_key",
+            f"{price_col} as filter_price",
+            f"{date_col} as filter_date",
+            f"{complete_col or 'NULL'} as filter_complete",
+            "name as filter_name",
+            "buyer as filter_buyer",
+            "seller as filter_seller",
+        ]
+
+        self.manager = manager
+        self.query = query.format(page_cols=", ".join(cols), where="", order="")
+        self.has_complete = complete_col is not None
+
+        self._snapshot: Optional[EquipSnapshot] = None
+        self._lock = threading.Lock()
+        self._loading: Optional[threading.Thread] = None
+        self._failed_version: Optional[int] = None
+        self._version_db: Optional[sqlite3.Connection] = None
+
+    def version(self) -> int:
+        with self._lock:
+            if self._version_db is None:
+                self._version_db = sqlite3.connect(
+                    self.manager.fp, check_same_thread=False
+                )
+            return self._version_db.execute("PRAGMA data_version").fetchone()[0]
+
+    def current(self) -> Optional[EquipSnapshot]:
+        """The snapshot of the db as it is now, or None if it's being (re)loaded"""
+
+        version = self.version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        with self._lock:
+            if self._loading is None and self._failed_version != version:
+                self._loading = threading.Thread(
+                    target=self._load_in_background, daemon=True
+                )
+                self._loading.start()
+        return None
+
+    def load(self) -> EquipSnapshot:
+        """(Re)load the snapshot now"""
+
+        start = time.perf_counter()
+
+        # Read before the rows, so that a change made while loading triggers another load
+        version = self.version()
+        with self.manager.reader() as DB:
+            rows = DB.execute(self.query).fetchall()
+
+        snapshot = EquipSnapshot(version, rows, self.has_complete)
+        self._snapshot = snapshot
+
+        elapsed = time.perf_counter() - start
+        logger.info(f"Loaded {snapshot.size} equips into memory in {elapsed:.1f}s")
+        return snapshot
+
+    def wait(self) -> None:
+        """Block until a background load (if any) finishes"""
+
+        thread = self._loading
+        if thread is not None:
+            thread.join()
+
+    def _load_in_background(self) -> None:
+        try:
+            self.load()
+        except Exception:
+            logger.exception("Failed to load equips into memory")
+            self._failed_version = self.version()
+        finally:
+            with self._lock:
+                self._loading = None
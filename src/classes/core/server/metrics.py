@@ -0,0 +1,177 @@
+import bisect
+import math
+import threading
+from typing import Iterable
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # fmt: skip
+
+# Bytes (1 KiB to 64 MiB)
+SIZE_BUCKETS = tuple(4**i * 1024 for i in range(9))
+
+
+class Metric:
+    """Base for metrics that are rendered in the Prometheus text format
+
+    Each distinct tuple of label values is a separate series.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def _format_labels(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(str(v))}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = dict()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return super().render() + [
+            f"{self.name}{self._format_labels(k)} {_format_value(v)}" for k, v in values
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Counts of observations per bucket, plus their sum and total count
+
+    Quantiles (eg p50 / p99) are estimated from these by the server scraping them,
+    with histogram_quantile(0.99, rate(<name>_bucket[5m])).
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+        # {labels: ([count per bucket (not cumulative), ..., count above the last bucket], sum)}
+        self._values: dict[tuple, tuple[list[int], float]] = dict()
+
+    def observe(self, *labels, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(labels) or ([0] * (len(self.buckets) + 1), 0.0)  # fmt: skip
+            counts[idx] += 1
+            self._values[labels] = (counts, total + value)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(k, list(counts), total) for k, (counts, total) in self._values.items()]  # fmt: skip
+
+        lines = super().render()
+        for k, counts, total in values:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, math.inf], counts):
+                cumulative += count
+                le = self._format_labels(k, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(k)} {_format_value(total)}")  # fmt: skip
+            lines.append(f"{self.name}_count{self._format_labels(k)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def add(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(line + "\n" for m in self.metrics for line in m.render())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION: Histogram = REGISTRY.add(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time until the last section of the response was sent",
+        ["route", "method", "status"],
+    )
+)
+RESPONSE_SIZE: Histogram = REGISTRY.add(
+    Histogram(
+        "http_response_size_bytes",
+        "Size of the response body (as sent, so after compression)",
+        ["route"],
+        SIZE_BUCKETS,
+    )
+)
+REQUESTS_IN_FLIGHT: Gauge = REGISTRY.add(
+    Gauge("http_requests_in_flight", "Requests that haven't been fully responded to")
+)
+SQL_DURATION: Histogram = REGISTRY.add(
+    Histogram(
+        "sql_duration_seconds",
+        "Time spent in sqlite per request (executing statements and fetching rows)",
+        ["route"],
+    )
+)
+RESULT_CACHE_STATS: Gauge = REGISTRY.add(
+    Gauge(
+        "result_cache",
+        "Counters and size of the search response cache (see /cache/stats)",
+        ["stat"],
+    )
+)
+STATEMENT_CACHE_STATS: Gauge = REGISTRY.add(
+    Gauge(
+        "sql_statement_cache",
+        "Hits / misses of the readers' compiled statement caches (see StatementStats)",
+        ["stat"],
+    )
+)
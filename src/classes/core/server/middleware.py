@@ -1,73 +1,170 @@
+import asyncio
 import time
-from typing import Awaitable, Callable, ClassVar, Optional
+from codecs import getincrementaldecoder
+from typing import ClassVar
 
 from fastapi import Request
-from starlette.concurrency import iterate_in_threadpool
-from starlette.middleware.base import BaseHTTPMiddleware, DispatchFunction
+from starlette.datastructures import Headers
 from starlette.middleware.gzip import GZipMiddleware
-from starlette.responses import StreamingResponse
-from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from classes.core.server import metrics
+from classes.core.server.cache import RESULT_CACHE, ResultCache, normalize_query
+from classes.core.server.formats import accepts_msgpack
+from classes.db import SQL_TIMER, SqlTimer
 from config import logger
 
 logger = logger.bind(tags=["server"])
 
-_CallNext = Callable[[Request], Awaitable[StreamingResponse]]
 
+class RequestLog:
+    """Log request and (the start of) the response"""
 
-class RequestLog(BaseHTTPMiddleware):
-    """Log request and response"""
+    # Max bytes of the response body that are logged
+    SAMPLE_SIZE = 1024
 
-    def __init__(self, app: ASGIApp, dispatch: Optional[DispatchFunction] = None):
-        super().__init__(app, dispatch)
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-    async def dispatch(self, request: Request, call_next: _CallNext):
-        logger.debug(f"{request.method} {request.url}")
-        resp = await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        logger.debug(f"{scope['method']} {Request(scope).url}")
+
+        # Only look at the first section so that streamed responses aren't buffered
+        logged = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal logged
 
-        resp_body = [section async for section in resp.body_iterator]
-        resp.body_iterator = iterate_in_threadpool(iter(resp_body))
+            if message["type"] == "http.response.body" and not logged:
+                body: bytes = message.get("body", b"")
+                if body or not message.get("more_body", False):
+                    logged = True
+                    _log_body(body, self.SAMPLE_SIZE)
 
-        if resp_body:
-            try:
-                resp_data = resp_body[0].decode()  # type: ignore
-                logger.trace(resp_data)
-            except UnicodeDecodeError:
-                size = sum(len(x) for x in resp_body)
-                logger.trace(f"gzip'd response of size {size}")
+            await send(message)
 
-        return resp
+        await self.app(scope, receive, send_wrapper)
 
 
-class ErrorLog(BaseHTTPMiddleware):
+def _log_body(body: bytes, sample_size: int) -> None:
+    try:
+        # Incremental so that a multi-byte char cut off by the sample isn't an error
+        sample = getincrementaldecoder("utf-8")().decode(body[:sample_size])
+        if len(body) > sample_size:
+            sample += f"... (first section of size {len(body)})"
+        logger.trace(sample)
+    except UnicodeDecodeError:
+        logger.trace(f"gzip'd response (first section of size {len(body)})")
+
+
+class ErrorLog:
     """Log Errors"""
 
-    def __init__(self, app: ASGIApp, dispatch: Optional[DispatchFunction] = None):
-        super().__init__(app, dispatch)
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-    async def dispatch(self, request: Request, call_next: _CallNext):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         try:
-            resp = await call_next(request)
-            return resp
+            await self.app(scope, receive, send)
         except:
             logger.exception("")
             raise
 
 
-class PerformanceLog(BaseHTTPMiddleware):
-    """Measure response time"""
+class PerformanceLog:
+    """Measure response time (until the last section of the response is sent)
 
-    def __init__(self, app: ASGIApp, dispatch: Optional[DispatchFunction] = None):
-        super().__init__(app, dispatch)
+    Requests that spend more than SLOW_SQL_MS in sqlite are logged as warnings, with their params.
+    That's the time measured by the Metrics middleware, so this has to be inside of it.
+    """
+
+    SLOW_SQL_MS: ClassVar[float] = 1000
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
 
-    async def dispatch(self, request: Request, call_next: _CallNext):
         start = time.time()
-        resp = await call_next(request)
-        end = time.time()
 
-        elapsed_ms = (end - start) * 1000
-        logger.debug(f"Response took {elapsed_ms:.0f}ms")
-        return resp
+        async def send_wrapper(message: Message) -> None:
+            await send(message)
+
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                elapsed_ms = (time.time() - start) * 1000
+                logger.debug(f"Response took {elapsed_ms:.0f}ms")
+
+                timer = SQL_TIMER.get()
+                if timer is not None and timer.seconds * 1000 > self.SLOW_SQL_MS:
+                    logger.warning(
+                        f"Slow request ({timer.seconds * 1000:.0f}ms in sqlite, {timer.statements} statements):"
+                        f" {scope['method']} {Request(scope).url}"
+                    )
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class Metrics:
+    """Record the latency, response size and sql time of each request (see metrics.py)
+
+    Series are labelled with the route's path template, so unmatched paths (eg 404s) are grouped under "other".
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+        timer = SqlTimer()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        token = SQL_TIMER.set(timer)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            SQL_TIMER.reset(token)
+            metrics.REQUESTS_IN_FLIGHT.dec()
+
+            route = _route_label(scope)
+            elapsed = time.perf_counter() - start
+            metrics.REQUEST_DURATION.observe(route, scope["method"], status, value=elapsed)  # fmt: skip
+            metrics.RESPONSE_SIZE.observe(route, value=size)
+            if timer.statements:
+                metrics.SQL_DURATION.observe(route, value=timer.seconds)
+
+
+def _route_label(scope: Scope) -> str:
+    # Set by the router once a route matches
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+
+    # Cache hits never reach the router
+    if scope["path"] in ResponseCache.endpoints:
+        return scope["path"]
+
+    return "other"
 
 
 class GZipWrapper(GZipMiddleware):
@@ -80,3 +177,141 @@ class GZipWrapper(GZipMiddleware):
             return await super().__call__(scope, receive, send)
         else:
             await self.app(scope, receive, send)
+
+
+class ResponseCache:
+    """Serve repeated requests to specific endpoints from a ResultCache
+
+    Bodies are cached as they're sent, so streamed responses are cached too (if they're small enough).
+
+    Identical requests that arrive while the first one is still running wait for its body
+    instead of running the same query again (and get it even if it's too large for the cache).
+    If the first one fails, they run their own.
+    """
+
+    endpoints: ClassVar[list[str]] = []
+    cache: ClassVar[ResultCache] = RESULT_CACHE
+
+    # Largest body that's shared with concurrent requests
+    MAX_SHARED_SIZE = 32 * 1024**2
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+        # Responses being created, by (cache key, db version)
+        #   resolved to (headers, body) or to None if there's nothing to share
+        self._in_flight: dict[tuple, asyncio.Future] = dict()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or scope["path"] not in self.endpoints
+        ):
+            return await self.app(scope, receive, send)
+
+        cache = self.cache
+        # (the Accept header picks the encoding, see formats.py)
+        accept = Headers(scope=scope).get("accept")
+        key = (
+            scope["path"],
+            normalize_query(scope["query_string"].decode()),
+            accepts_msgpack(accept),
+        )
+        version = cache.version()
+
+        hit = cache.get(key, version)
+        if hit is not None:
+            headers, body = hit
+            return await _replay(send, headers, body, b"hit")
+
+        flight = (key, version)
+        leader = self._in_flight.get(flight)
+        if leader is not None:
+            # Shielded so that this request disconnecting doesn't cancel the other's
+            shared = await asyncio.shield(leader)
+            if shared is not None:
+                cache.coalesced += 1
+                return await _replay(send, *shared, b"coalesced")
+
+            # Run this one too, but don't share it
+            return await self._run(scope, receive, send, key, version, None)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[flight] = future
+        try:
+            await self._run(scope, receive, send, key, version, future)
+        finally:
+            del self._in_flight[flight]
+            if not future.done():
+                future.set_result(None)
+
+    async def _run(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        key: tuple,
+        version: int,
+        future: asyncio.Future | None,
+    ) -> None:
+        """Call the endpoint, caching its response and sharing it with future's waiters"""
+
+        cache = self.cache
+        max_size = max(cache.MAX_ENTRY_SIZE, self.MAX_SHARED_SIZE if future else 0)
+
+        headers: list[tuple[bytes, bytes]] = []
+        chunks: list[bytes] = []
+        size = 0
+        ok = True
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal headers, size, ok
+
+            if message["type"] == "http.response.start":
+                ok = message["status"] == 200
+                headers = [
+                    (k, v)
+                    for k, v in message.get("headers", [])
+                    if k.lower() not in (b"content-length", b"transfer-encoding")
+                ]
+            elif message["type"] == "http.response.body" and ok:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size > max_size:
+                    # Stop buffering
+                    ok = False
+                    chunks.clear()
+                else:
+                    chunks.append(chunk)
+
+                if ok and not message.get("more_body", False):
+                    body = b"".join(chunks)
+                    cache.put(key, version, headers, body)
+                    if future is not None:
+                        future.set_result((headers, body))
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        if not ok:
+            cache.skip()
+
+
+async def _replay(
+    send: Send, headers: list[tuple[bytes, bytes]], body: bytes, source: bytes
+) -> None:
+    """Send a response body created by an earlier request"""
+
+    await send(
+        dict(
+            type="http.response.start",
+            status=200,
+            headers=headers
+            + [
+                (b"content-length", str(len(body)).encode()),
+                (b"x-cache", source),
+            ],
+        )
+    )
+    await send(dict(type="http.response.body", body=body))
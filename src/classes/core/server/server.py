@@ -1,33 +1,239 @@
+import base64
+import binascii
+import heapq
+import itertools
 import json
+import re
 import sqlite3
+import time
+from contextlib import ExitStack, asynccontextmanager
+from dataclasses import dataclass, replace
 from sqlite3 import Connection
-from typing import Optional
+from typing import Annotated, Any, Iterable, Iterator, Literal, Optional, Sequence
 
-from fastapi import Depends, FastAPI, HTTPException
-from fastapi.responses import PlainTextResponse
+import orjson
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.types import Send
 
-from classes.core.server import logger
+from classes.core.server import formats, logger, metrics
 from classes.core.server.middleware import (
     ErrorLog,
     GZipWrapper,
+    Metrics,
     PerformanceLog,
     RequestLog,
+    ResponseCache,
 )
-from classes.db import get_db
-from utils.sql import WhereBuilder
+from classes.core.server.cache import RESULT_CACHE
+from classes.core.server.exports import EXPORTS, iter_changes
+from classes.core.server.settings import SETTINGS
+from classes.db import (
+    DB_MANAGER,
+    STATEMENT_STATS,
+    SqlBudgetExceeded,
+    get_db,
+)
+from utils.sql import Condition, WhereBuilder
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs once per worker, which isn't sent requests until this yields
+    warm_up()
+    yield
+    DB_MANAGER.close()
+
 
-server = FastAPI()
+server = FastAPI(lifespan=lifespan)
 
 # Endpoints with a gzip'd response
-GZipWrapper.endpoints = ["/export/sqlite", "/export/json"]
+#   (the exports aren't here because they're stored pre-compressed)
+GZipWrapper.endpoints = []
 
-# Order matters, topmost are called first
+# Endpoints whose responses are cached until the db changes
+ResponseCache.endpoints = ["/super/search_equips", "/kedama/search_equips", "/equips/search", "/equips/price_stats", "/lottery/search", "/lottery/user_stats"]  # fmt: skip
+
+# Limits on the time spent in sqlite (see settings.py)
+DB_MANAGER.request_budget = SETTINGS.sql_budget
+PerformanceLog.SLOW_SQL_MS = SETTINGS.slow_sql_ms
+
+# Order matters, each one wraps the ones above it (so bottommost are called first)
+server.add_middleware(ResponseCache)
 server.add_middleware(ErrorLog)
 server.add_middleware(GZipWrapper)
 server.add_middleware(PerformanceLog)
 server.add_middleware(RequestLog)
+server.add_middleware(Metrics)
+
+
+@server.exception_handler(SqlBudgetExceeded)
+def on_sql_budget_exceeded(request: Request, exc: SqlBudgetExceeded):
+    logger.warning(f"Aborted a request after {exc.seconds}s in sqlite: {request.url}")
+    return JSONResponse(
+        status_code=400,
+        content=dict(
+            detail=f"Search took longer than {exc.seconds}s, try narrowing it down (eg with longer terms or more filters)"
+        ),
+    )
+
+
+def _json_real(col: str) -> str:
+    """Wrap a REAL column for json_object() so that it's written with enough digits to read back the same value
+
+    (json_object() writes 15 significant digits, which can cut off the fraction of a timestamp)
+    """
+
+    return f"IIF({col} IS NULL OR {col} = CAST(printf('%!.15g', {col}) AS REAL), {col}, json(printf('%!.17g', {col})))"
+
+
+class _Real(str):
+    """A REAL column in a field spec (wrapped with _json_real when the db builds the item)"""
+
+
+class _Json(str):
+    """An expression in a field spec that's already json (like an equip's stats)"""
+
+
+def _select_item(
+    query: str,
+    spec: dict[str, Any],
+    selected: Optional[set[str]] = None,
+    values: bool = False,
+) -> str:
+    """Fill in the {item} placeholder of a search query
+
+    Args:
+        spec: Item fields and their sql expressions (or a dict of them, for a nested object)
+        selected: Fields to include (see _parse_fields), all of them if None
+        values: Whether to select the item's fields as separate columns (see _item_column)
+    """
+
+    return query.format(item=_item_column(spec, selected, values))
+
+
+def _item_column(
+    spec: dict[str, Any], selected: Optional[set[str]] = None, values: bool = False
+) -> str:
+    """Column of a response item (built by the db, see _respond)
+
+    With values, each of the item's fields is a column instead (item_0, item_1, ... see _ItemValues)
+    """
+
+    if values:
+        leaves = _leaves(spec, selected)
+        return ", ".join(
+            f"{expr} as item_{idx}" for idx, (_, expr) in enumerate(leaves)
+        )
+    return f"CAST({_json_object(spec, selected, '')} AS BLOB) as item"
+
+
+def _json_object(
+    spec: dict[str, Any], selected: Optional[set[str]], prefix: str
+) -> str:
+    pairs = []
+    for name, expr, nested in _pick(spec, selected, prefix):
+        if isinstance(expr, dict):
+            expr = _json_object(expr, nested, prefix + name + ".")
+        elif isinstance(expr, _Real):
+            expr = _json_real(expr)
+        pairs.append(f"'{name}', {expr}")
+
+    return f"json_object({', '.join(pairs)})"
+
+
+def _leaves(
+    spec: dict[str, Any], selected: Optional[set[str]] = None, path: tuple = ()
+) -> Iterator[tuple[tuple[str, ...], str]]:
+    """(Path, sql expression) of each selected field that isn't a nested object, in the order _json_object writes them"""
+
+    prefix = "".join(name + "." for name in path)
+    for name, expr, nested in _pick(spec, selected, prefix):
+        if isinstance(expr, dict):
+            yield from _leaves(expr, nested, path + (name,))
+        else:
+            yield path + (name,), expr
+
+
+def _pick(
+    spec: dict[str, Any], selected: Optional[set[str]], prefix: str
+) -> Iterator[tuple[str, Any, Optional[set[str]]]]:
+    """(Name, expression, selected fields of a nested object) of the selected fields of a spec"""
+
+    for name, expr in spec.items():
+        path = prefix + name
+        if isinstance(expr, dict):
+            # Selecting a nested object selects all of its fields
+            nested = None if selected is None or path in selected else selected
+            if nested is not None and not any(x.startswith(path + ".") for x in nested):
+                continue
+            yield name, expr, nested
+        elif selected is None or path in selected:
+            yield name, expr, None
 
-EXPORTED_TABLES = ['super_auctions', 'super_equips', 'super_mats', 'super_fails', 'kedama_auctions' ,'kedama_equips', 'kedama_mats', 'kedama_fails_item', 'lottery_weapon', 'lottery_armor']  # fmt: skip
+
+def _parse_fields(spec: dict[str, Any], fields: Optional[str]) -> Optional[set[str]]:
+    """Parse a comma separated list of fields (eg "name,price,auction.id")"""
+
+    if fields is None:
+        return None
+
+    selected = {x.strip() for x in fields.split(",")} - {""}
+    unknown = selected - set(_field_names(spec))
+    if unknown:
+        raise HTTPException(
+            400, detail=f"Unknown fields ({', '.join(sorted(unknown))})"
+        )
+    if not selected:
+        raise HTTPException(400, detail="No fields selected")
+
+    return selected
+
+
+def _field_names(spec: dict[str, Any], prefix: str = "") -> Iterator[str]:
+    for name, expr in spec.items():
+        yield prefix + name
+        if isinstance(expr, dict):
+            yield from _field_names(expr, prefix + name + ".")
+
+
+def _project(item: dict, selected: set[str], prefix: str = "") -> dict:
+    """Drop the fields of an (already built) item that weren't selected, like _json_object does"""
+
+    result = dict()
+    for name, value in item.items():
+        path = prefix + name
+        if path in selected:
+            result[name] = value
+        elif isinstance(value, dict) and any(
+            x.startswith(path + ".") for x in selected
+        ):
+            result[name] = _project(value, selected, path + ".")
+
+    return result
+
+
+# The db builds each response item (see _respond)
+#   columns are listed explicitly, so a column added to the table has to be added here too
+SUPER_EQUIP_FIELDS: dict[str, Any] = dict(
+    id="se.id", id_auction="se.id_auction", name="se.name", eid="se.eid", key="se.key",
+    is_isekai="se.is_isekai", level="se.level", stats=_Json("json(se.stats)"), price="se.price",
+    bid_link="se.bid_link", next_bid="se.next_bid", buyer="se.buyer", seller="se.seller",
+    auction=dict(
+        id="sa.id", end_time=_Real("sa.end_time"),
+        is_complete=_Real("sa.is_complete"), title="sa.title",
+    ),
+)  # fmt: skip
+
+SUPER_EQUIPS_QUERY = """
+    SELECT
+        {item},
+        {{page_cols}}
+    FROM super_equips as se INNER JOIN super_auctions as sa
+    ON sa.id = se.id_auction
+    {{where}}
+    {{order}}
+    """
 
 
 @server.get("/super/search_equips")
@@ -41,107 +247,209 @@ def get_super_equips(
     seller_partial: Optional[str] = None,
     buyer: Optional[str] = None,
     buyer_partial: Optional[str] = None,
+    stat: Optional[str] = None,
     complete: Optional[bool] = None,
+    order_by: Optional[Literal["price", "date"]] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    count: bool = False,
+    stream: bool = False,
+    fields: Optional[str] = None,
+    format: formats.Layout = "json",
+    accept: Annotated[Optional[str], Header()] = None,
     DB: Connection = Depends(get_db),
 ):
     """Search for items sold at a Super auction
 
     The equip name and user name can be a comma separated list (eg "peerl,oak,heimd" instead of "Peerless Oak Staff of Heimdall")
     """
+    output = _Output.create(stream, format, accept)
+    selected = _parse_fields(SUPER_EQUIP_FIELDS, fields)
 
-    where_builder = WhereBuilder("AND")
+    where_builder = _equip_filters(
+        _EquipCols(date="sa.end_time", price="se.price", rowid="se.rowid", fts="super_equips_fts", equip="'super', se.id_auction, se.id"),
+        name=name,
+        min_date=min_date,
+        max_date=max_date,
+        min_price=min_price,
+        max_price=max_price,
+        seller=seller,
+        seller_partial=seller_partial,
+        buyer=buyer,
+        buyer_partial=buyer_partial,
+        stat=stat,
+    )  # fmt: skip
 
-    # Create name filters
-    #   eg "name=peer,waki" should match "Peerless * Wakizashi of the *"
-    if name is not None:
-        fragments = [x.strip() for x in name.split(",")]
-        for fragment in fragments:
-            where_builder.add("name LIKE ?", f"%{fragment}%")
+    # Create completion filter
+    if complete is not None:
+        where_builder.add("sa.is_complete = ?", int(complete))
 
-    # Create date filters (utc)
-    #   eg "min_date=1546300800" should match items sold on / after Jan 1, 2019
-    if min_date is not None and max_date is not None and max_date < min_date:
-        raise HTTPException(
-            400, detail=f"min_date > max_date ({min_date} > {max_date})"
+    snapshot = _equip_snapshot("super", stat)
+    if snapshot is not None:
+        mask = snapshot.filter(
+            name=name,
+            min_date=min_date,
+            max_date=max_date,
+            min_price=min_price,
+            max_price=max_price,
+            seller=seller,
+            seller_partial=seller_partial,
+            buyer=buyer,
+            buyer_partial=buyer_partial,
+            complete=complete,
         )
-    if min_date is not None:
-        where_builder.add("sa.end_time >= ?", min_date)
-    if max_date is not None:
-        where_builder.add("sa.end_time <= ?", max_date)
+        return _search_snapshot(snapshot, mask, order_by, limit, cursor, count, selected, output)  # fmt: skip
 
-    # Create price filters
-    #   eg "max_price=1000" should match items sold for <=1000c
-    if min_price is not None and max_price is not None and max_price < min_price:
-        raise HTTPException(
-            400, detail=f"min_price > max_price ({min_price} > {max_price})"
+    # Query DB
+    query = _select_item(
+        SUPER_EQUIPS_QUERY, SUPER_EQUIP_FIELDS, selected, output.values
+    )
+    sort_col = dict(price="se.price", date="sa.end_time").get(order_by or "")
+    with DB:
+        if count:
+            return dict(count=_count_rows(DB, query, where_builder))
+
+        rows, next_cursor = _search_page(
+            DB,
+            query,
+            where_builder,
+            sort_col,
+            "se.rowid",
+            order_by,
+            limit,
+            cursor,
+            nullable=order_by == "price",  # dates are never null
         )
-    if min_price is not None:
-        where_builder.add("se.price >= ?", min_price)
-    if max_price is not None:
-        wb = WhereBuilder("OR")
-        wb.add("se.price <= ?", max_price)
-        wb.add("se.price IS NULL", None)
-        where_builder.add_builder(wb)
 
-    # Create buyer filters
-    if buyer is not None:
-        # Exact match
-        where_builder.add("buyer = ?", buyer)
-    elif buyer_partial is not None:
-        # Partial match
-        fragments = [x.strip() for x in buyer_partial.split(",")]
-        for fragment in fragments:
-            where_builder.add("buyer LIKE ?", f"%{fragment}%")
+    items = _items(SUPER_EQUIP_FIELDS, selected, rows, output)
+    return _respond(items, next_cursor, output)
 
-    # Create seller filters
-    if seller is not None:
-        # Exact match
-        where_builder.add("seller = ?", seller)
-    elif seller_partial is not None:
-        # Partial match
-        fragments = [x.strip() for x in seller_partial.split(",")]
-        for fragment in fragments:
-            where_builder.add("seller LIKE ?", f"%{fragment}%")
 
-    # Create completion filter
-    if complete is not None:
-        where_builder.add("sa_is_complete = ?", int(complete))
+KEDAMA_EQUIP_FIELDS: dict[str, Any] = dict(
+    id="equip.id", id_auction="equip.id_auction", name="equip.name", eid="equip.eid", key="equip.key",
+    is_isekai="equip.is_isekai", level="equip.level", stats=_Json("json(equip.stats)"), price="equip.price",
+    start_bid="equip.start_bid", post_index="equip.post_index", buyer="equip.buyer", seller="equip.seller",
+    auction=dict(
+        start_time=_Real("list.start_time"), title="list.title",
+        title_short="list.title_short", id="list.id",
+    ),
+)  # fmt: skip
+
+KEDAMA_EQUIPS_QUERY = """
+    SELECT
+        {item},
+        {{page_cols}}
+    FROM kedama_equips as equip INNER JOIN kedama_auctions as list
+    ON list.id = equip.id_auction
+    {{where}}
+    {{order}}
+    """
+
+
+@server.get("/kedama/search_equips")
+def get_kedama_equips(
+    name: Optional[str] = None,
+    min_date: Optional[float] = None,
+    max_date: Optional[float] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    seller: Optional[str] = None,
+    seller_partial: Optional[str] = None,
+    buyer: Optional[str] = None,
+    buyer_partial: Optional[str] = None,
+    stat: Optional[str] = None,
+    order_by: Optional[Literal["price", "date"]] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    count: bool = False,
+    stream: bool = False,
+    fields: Optional[str] = None,
+    format: formats.Layout = "json",
+    accept: Annotated[Optional[str], Header()] = None,
+    DB: Connection = Depends(get_db),
+):
+    """Search for items sold at a Kedama auction
+
+    The equip name and user name can be a comma separated list (eg "peerl,oak,heimd" instead of "Peerless Oak Staff of Heimdall")
+    """
+    output = _Output.create(stream, format, accept)
+    selected = _parse_fields(KEDAMA_EQUIP_FIELDS, fields)
+
+    where_builder = _equip_filters(
+        _EquipCols(date="list.start_time", price="equip.price", rowid="equip.rowid", fts="kedama_equips_fts", equip="'kedama', equip.id_auction, equip.id"),
+        name=name,
+        min_date=min_date,
+        max_date=max_date,
+        min_price=min_price,
+        max_price=max_price,
+        seller=seller,
+        seller_partial=seller_partial,
+        buyer=buyer,
+        buyer_partial=buyer_partial,
+        stat=stat,
+    )  # fmt: skip
+
+    snapshot = _equip_snapshot("kedama", stat)
+    if snapshot is not None:
+        mask = snapshot.filter(
+            name=name,
+            min_date=min_date,
+            max_date=max_date,
+            min_price=min_price,
+            max_price=max_price,
+            seller=seller,
+            seller_partial=seller_partial,
+            buyer=buyer,
+            buyer_partial=buyer_partial,
+        )
+        return _search_snapshot(snapshot, mask, order_by, limit, cursor, count, selected, output)  # fmt: skip
 
     # Query DB
+    query = _select_item(
+        KEDAMA_EQUIPS_QUERY, KEDAMA_EQUIP_FIELDS, selected, output.values
+    )
+    sort_col = dict(price="equip.price", date="list.start_time").get(order_by or "")
     with DB:
-        where, data = where_builder.print()
-        query = f"""
-            SELECT se.*, sa.end_time as sa_end_time, sa.is_complete as sa_is_complete, sa.title as sa_title, sa.id as sa_id
-            FROM super_equips as se INNER JOIN super_auctions as sa
-            ON sa.id = se.id_auction
-            {where}
-            """
-        logger.trace(f"Search super equips {query} {data}")
-        rows = DB.execute(query, data).fetchall()
-
-    # Massage data structure
-    result = [dict(row) for row in rows]
-    for r in result:
-        # Move joined cols into dict
-        r["auction"] = dict(
-            id=r["sa_id"],
-            end_time=r["sa_end_time"],
-            is_complete=r["sa_is_complete"],
-            title=r["sa_title"],
+        if count:
+            return dict(count=_count_rows(DB, query, where_builder))
+
+        rows, next_cursor = _search_page(
+            DB,
+            query,
+            where_builder,
+            sort_col,
+            "equip.rowid",
+            order_by,
+            limit,
+            cursor,
+            nullable=order_by == "price",  # dates are never null
         )
-        for k in list(r.keys()):
-            if k.startswith("sa_"):
-                del r[k]
 
-        # Stats col contains json
-        r["stats"] = json.loads(r["stats"])
+    items = _items(KEDAMA_EQUIP_FIELDS, selected, rows, output)
+    return _respond(items, next_cursor, output)
 
-    # Return
-    return result
 
+ALL_EQUIP_FIELDS: dict[str, Any] = dict(
+    id="id", name="name", eid="eid", key="key", is_isekai="is_isekai", level="level",
+    stats=_Json("json(stats)"), price="price", min_bid="min_bid", buyer="buyer", seller="seller",
+    auction=dict(
+        id="id_auction", title="auction_title", title_short="auction_title_short",
+        time=_Real("auction_time"), is_complete=_Real("auction_is_complete"),
+    ),
+)  # fmt: skip
 
-@server.get("/kedama/search_equips")
-def get_kedama_equips(
+ALL_EQUIPS_QUERY = """
+    SELECT
+        {item},
+        {{page_cols}}
+    FROM all_equips
+    {{where}}
+    {{order}}
+    """
+
+
+@server.get("/equips/search")
+def get_all_equips(
     name: Optional[str] = None,
     min_date: Optional[float] = None,
     max_date: Optional[float] = None,
@@ -151,21 +459,199 @@ def get_kedama_equips(
     seller_partial: Optional[str] = None,
     buyer: Optional[str] = None,
     buyer_partial: Optional[str] = None,
+    stat: Optional[str] = None,
+    complete: Optional[bool] = None,
+    order_by: Optional[Literal["price", "date"]] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    count: bool = False,
+    stream: bool = False,
+    fields: Optional[str] = None,
+    format: formats.Layout = "json",
+    accept: Annotated[Optional[str], Header()] = None,
     DB: Connection = Depends(get_db),
 ):
-    """Search for items sold at a Kedama auction
+    """Search for items sold at both Super and Kedama auctions
 
-    The equip name and user name can be a comma separated list (eg "peerl,oak,heimd" instead of "Peerless Oak Staff of Heimdall")
+    Accepts the same params as /super/search_equips, but items from both auctions are returned in a common format.
+    """
+    output = _Output.create(stream, format, accept)
+    selected = _parse_fields(ALL_EQUIP_FIELDS, fields)
+
+    where_builder = _equip_filters(
+        _EquipCols(date="auction_time", price="price", rowid="pk", fts="all_equips_fts", equip="source, id_auction, id"),
+        name=name,
+        min_date=min_date,
+        max_date=max_date,
+        min_price=min_price,
+        max_price=max_price,
+        seller=seller,
+        seller_partial=seller_partial,
+        buyer=buyer,
+        buyer_partial=buyer_partial,
+        stat=stat,
+    )  # fmt: skip
+
+    # Create completion filter
+    if complete is not None:
+        where_builder.add("auction_is_complete = ?", int(complete))
+
+    # Query DB
+    query = _select_item(ALL_EQUIPS_QUERY, ALL_EQUIP_FIELDS, selected, output.values)
+    sort_col = dict(price="price", date="auction_time").get(order_by or "")
+    with DB:
+        if count:
+            return dict(count=_count_rows(DB, query, where_builder))
+
+        rows, next_cursor = _search_page(
+            DB,
+            query,
+            where_builder,
+            sort_col,
+            "pk",
+            order_by,
+            limit,
+            cursor,
+            nullable=order_by == "price",  # dates are never null
+        )
+
+    items = _items(ALL_EQUIP_FIELDS, selected, rows, output)
+    return _respond(items, next_cursor, output)
+
+
+@server.get("/equips/price_stats")
+def get_price_stats(
+    name: str,
+    min_date: Optional[float] = None,
+    max_date: Optional[float] = None,
+    DB: Connection = Depends(get_db),
+):
+    """Sold prices of the equips matching name (Super and Kedama), overall and per month
+
+    The name can be a comma separated list, as in /equips/search. Only equips from completed auctions with a price are counted.
+    The dates select whole months (utc), eg a min_date in the middle of May includes all of May.
+
+    Returns count, min, max, median, p25 and p75 overall, the same for each month (oldest first),
+    and the (lowercased) names that were matched.
     """
 
+    if min_date is not None and max_date is not None and max_date < min_date:
+        raise HTTPException(
+            400, detail=f"min_date > max_date ({min_date} > {max_date})"
+        )
+
+    # Read from the rollups (see _add_price_rollups) instead of the equips
+    # Each fragment is a LIKE over every rollup, so short ones are rejected like in the searches
+    fragments = [x.strip() for x in name.split(",")]
+    _check_fragments(dict(name=fragments), narrowed=False)
+
     where_builder = WhereBuilder("AND")
+    for fragment in fragments:
+        where_builder.add("name LIKE ?", f"%{fragment}%")
+    if min_date is not None:
+        where_builder.add("month >= strftime('%Y-%m', ?, 'unixepoch')", min_date)
+    if max_date is not None:
+        where_builder.add("month <= strftime('%Y-%m', ?, 'unixepoch')", max_date)
+
+    where, query_data = where_builder.print()
+    query = f"""
+        SELECT name, month, prices FROM equip_price_rollups
+        {where}
+        ORDER BY month
+        """
+    logger.trace(f"Price stats {query} {query_data}")
+
+    # Each group's prices are already sorted, so they only need to be merged
+    by_month: dict[str, list[list[int]]] = dict()
+    names: set[str] = set()
+    for r in DB.execute(query, query_data):
+        by_month.setdefault(r["month"], []).append(orjson.loads(r["prices"]))
+        names.add(r["name"])
+
+    months = []
+    for month, groups in by_month.items():
+        months.append(dict(month=month, **_price_summary(list(heapq.merge(*groups)))))  # fmt: skip
+
+    groups = [group for gs in by_month.values() for group in gs]
+    return dict(
+        **_price_summary(list(heapq.merge(*groups))),
+        months=months,
+        names=sorted(names),
+    )
+
+
+def _price_summary(prices: list[int]) -> dict:
+    """Count, min, max and quartiles of a sorted list (null if it's empty)"""
+
+    return dict(
+        count=len(prices),
+        min=prices[0] if prices else None,
+        max=prices[-1] if prices else None,
+        median=_percentile(prices, 0.5),
+        p25=_percentile(prices, 0.25),
+        p75=_percentile(prices, 0.75),
+    )
+
+
+def _percentile(values: list[int], q: float) -> float | None:
+    """Linearly interpolated percentile of a sorted list (same as numpy's default)"""
+
+    if not values:
+        return None
+
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+@dataclass
+class _EquipCols:
+    """Names of the (possibly aliased) columns that the equip filters touch"""
+
+    date: str
+    price: str
+    rowid: str  # key of the trigram index
+    fts: str  # trigram index table
+    equip: str  # key of the stats table (source, auction, equip)
+
+
+# Partial match fragments shorter than this (not counting LIKE wildcards) match most rows and can't use the trigram index,
+# so they're only accepted alongside a filter that narrows the search (see _check_fragments)
+MIN_FRAGMENT_LENGTH = 2
+
+# eg "Holy EDB>=50" or "Prof < 30%"
+_STAT_FILTER_PATT = re.compile(
+    r"\s*([^<>=]+?)\s*(>=|<=|=|>|<)\s*([+-]?\d+(?:\.\d+)?)\s*%?\s*"
+)
+
+
+def _equip_filters(
+    cols: _EquipCols,
+    name: Optional[str],
+    min_date: Optional[float],
+    max_date: Optional[float],
+    min_price: Optional[int],
+    max_price: Optional[int],
+    seller: Optional[str],
+    seller_partial: Optional[str],
+    buyer: Optional[str],
+    buyer_partial: Optional[str],
+    stat: Optional[str],
+) -> WhereBuilder:
+    """Create the filters shared by the equip searches"""
+
+    where_builder = WhereBuilder("AND")
+    fts_phrases: list[str] = []  # trigram index lookups
+    fragments_by_param: dict[str, list[str]] = dict()
 
     # Create name filters
     #   eg "name=peer,waki" should match "Peerless * Wakizashi of the *"
     if name is not None:
         fragments = [x.strip() for x in name.split(",")]
+        fragments_by_param["name"] = fragments
         for fragment in fragments:
-            where_builder.add("name LIKE ?", f"%{fragment}%")
+            _add_partial_match(where_builder, fts_phrases, "name", fragment)
 
     # Create date filters (utc)
     #   eg "min_date=1546300800" should match items sold on / after Jan 1, 2019
@@ -174,9 +660,9 @@ def get_kedama_equips(
             400, detail=f"min_date > max_date ({min_date} > {max_date})"
         )
     if min_date is not None:
-        where_builder.add("list.start_time >= ?", min_date)
+        where_builder.add(f"{cols.date} >= ?", min_date)
     if max_date is not None:
-        where_builder.add("list.start_time <= ?", max_date)
+        where_builder.add(f"{cols.date} <= ?", max_date)
 
     # Create price filters
     #   eg "max_price=1000" should match items sold for <=1000c
@@ -185,11 +671,11 @@ def get_kedama_equips(
             400, detail=f"min_price > max_price ({min_price} > {max_price})"
         )
     if min_price is not None:
-        where_builder.add("equip.price >= ?", min_price)
+        where_builder.add(f"{cols.price} >= ?", min_price)
     if max_price is not None:
         wb = WhereBuilder("OR")
-        wb.add("equip.price <= ?", max_price)
-        wb.add("equip.price IS NULL", None)
+        wb.add(f"{cols.price} <= ?", max_price)
+        wb.add(f"{cols.price} IS NULL", None)
         where_builder.add_builder(wb)
 
     # Create buyer filters
@@ -199,8 +685,9 @@ def get_kedama_equips(
     elif buyer_partial is not None:
         # Partial match
         fragments = [x.strip() for x in buyer_partial.split(",")]
+        fragments_by_param["buyer_partial"] = fragments
         for fragment in fragments:
-            where_builder.add("buyer LIKE ?", f"%{fragment}%")
+            _add_partial_match(where_builder, fts_phrases, "buyer", fragment)
 
     # Create seller filters
     if seller is not None:
@@ -209,41 +696,381 @@ def get_kedama_equips(
     elif seller_partial is not None:
         # Partial match
         fragments = [x.strip() for x in seller_partial.split(",")]
+        fragments_by_param["seller_partial"] = fragments
         for fragment in fragments:
-            where_builder.add("seller LIKE ?", f"%{fragment}%")
+            _add_partial_match(where_builder, fts_phrases, "seller", fragment)
 
-    # Query DB
-    with DB:
-        where, data = where_builder.print()
-        query = f"""
-            SELECT 
-                equip.*,
-                list.start_time as list_start_time,
-                list.title as list_title,
-                list.title_short as list_title_short,
-                list.id as list_id
-            FROM kedama_equips as equip INNER JOIN kedama_auctions as list
-            ON list.id = equip.id_auction
-            {where}
-            """
-        logger.trace(f"Search kedama equips {query} {data}")
-        rows = DB.execute(query, data).fetchall()
-
-    # Massage data structure
-    result = [dict(row) for row in rows]
-    for r in result:
-        # Move joined cols into dict
-        r["auction"] = dict()
-        for k in list(r.keys()):
-            if k.startswith("list_"):
-                r["auction"][k.replace("list_", "")] = r[k]
-                del r[k]
-
-        # Stats col contains json
-        r["stats"] = json.loads(r["stats"])
-
-    # Return
-    return result
+    # Create stat filters
+    #   eg "stat=EDB>=50,Prof>=30" should match items with at least 50% EDB and 30% Prof
+    if stat is not None:
+        for comparison in stat.split(","):
+            m = _STAT_FILTER_PATT.fullmatch(comparison)
+            if m is None:
+                raise HTTPException(400, detail=f"Invalid stat filter: {comparison}")
+
+            stat_name, op, value = m.groups()
+            stat_builder = WhereBuilder("AND")
+            stat_builder.add("stat = ?", stat_name)
+            stat_builder.add(f"value {op} ?", float(value))
+            where_builder.add_subquery(
+                f"({cols.equip}) IN (SELECT source, auction, equip FROM equip_stats {{where}})",
+                stat_builder,
+            )
+
+    # All of the lookups are a single MATCH (of column filters, eg 'name : "oak" AND buyer : "amy"')
+    # so that the query is the same statement however many fragments there are
+    if fts_phrases:
+        fts_builder = WhereBuilder("AND", ignore_case=False)
+        fts_builder.add(f"{cols.fts} MATCH ?", " AND ".join(fts_phrases))
+        where_builder.add_subquery(
+            f"{cols.rowid} IN (SELECT rowid FROM {cols.fts} {{where}})", fts_builder
+        )
+
+    narrowed = bool(fts_phrases) or buyer is not None or seller is not None or stat is not None  # fmt: skip
+    _check_fragments(fragments_by_param, narrowed)
+
+    return where_builder
+
+
+def _check_fragments(fragments_by_param: dict[str, list[str]], narrowed: bool) -> None:
+    """Reject fragments shorter than MIN_FRAGMENT_LENGTH, unless the search has another filter that uses an index
+
+    Otherwise each of them would be a LIKE over every row, which matches most of them.
+    (Empty fragments are allowed, they match every row like a search without the param does.)
+    """
+
+    if narrowed:
+        return
+
+    for param, fragments in fragments_by_param.items():
+        for fragment in fragments:
+            size = len(fragment.replace("%", "").replace("_", ""))
+            if fragment and size < MIN_FRAGMENT_LENGTH:
+                raise HTTPException(
+                    400,
+                    detail=f"{param} fragment is too short to search by itself ({fragment!r}, needs at least {MIN_FRAGMENT_LENGTH} characters)",
+                )
+
+
+def _search_page(
+    DB: Connection,
+    query: str,
+    where_builder: WhereBuilder,
+    sort_col: Optional[str],
+    key_col: str,
+    order_by: Optional[str],
+    limit: Optional[int],
+    cursor: Optional[str],
+    nullable: bool = False,
+) -> tuple[Iterable[sqlite3.Row], Optional[str]]:
+    """Run a search, returning (a page of) the matching rows and the cursor for the next page
+
+    Unless a page is requested, the rows are read from the db as they're iterated.
+
+    Rows are sorted by (sort_col, key_col) descending, with nulls last.
+    A page starts after the last row of the previous one rather than at an offset,
+    so fetching a deep page is still an index seek.
+
+    Args:
+        query: Query with {page_cols}, {where} and {order} placeholders
+        sort_col: Column to sort by (or None to sort by key_col alone)
+        key_col: Unique column that breaks ties
+        nullable: Whether sort_col can be null
+    """
+
+    if limit is not None and limit < 1:
+        raise HTTPException(400, detail=f"limit < 1 ({limit})")
+
+    page_cols = f"{sort_col or 'NULL'} as page_sort, {key_col} as page_key"
+
+    def run(
+        cond: Optional[Condition], order: str, limit: Optional[int] = None
+    ) -> sqlite3.Cursor:
+        wb = where_builder
+        if cond is not None:
+            wb = replace(where_builder, fragments=where_builder.fragments + [cond])
+        where, data = wb.print()
+
+        # (bound rather than inlined so that every page size runs the same statement)
+        if limit is not None:
+            order += " LIMIT ?"
+            data.append(limit)
+
+        query_ = query.format(page_cols=page_cols, where=where, order=order)
+        logger.trace(f"Search {query_} {data}")
+        return DB.execute(query_, data)
+
+    if order_by is None and limit is None and cursor is None:
+        return run(None, ""), None
+
+    # Filters for the rows after the cursor
+    # Rows with a null sort value get their own query
+    # because a row value comparison can use an index but an "OR ... IS NULL" can't
+    # (and an "IS NULL" on a NOT NULL column is a full scan)
+    phases: list[Optional[Condition]] = [None]
+    if cursor is not None:
+        sort, key = _decode_cursor(cursor, order_by, _CURSOR_SORT, int)
+        if sort_col is None:
+            phases = [Condition(f"{key_col} < ?", key)]
+        elif sort is None:
+            phases = [Condition(f"{sort_col} IS NULL AND {key_col} < ?", key)]
+        else:
+            phases = [Condition(f"({sort_col}, {key_col}) < (?, ?)", (sort, key))]
+            if nullable:
+                phases.append(Condition(f"{sort_col} IS NULL"))
+
+    order = "ORDER BY " + ", ".join(f"{c} DESC" for c in [sort_col, key_col] if c)
+    if limit is None:
+        # No page to cut, so the rows can be read lazily
+        return itertools.chain.from_iterable(run(c, order) for c in phases), None
+
+    rows: list[sqlite3.Row] = []
+    for cond in phases:
+        if len(rows) > limit:
+            break
+
+        # Fetch an extra row to check for a next page
+        rows.extend(run(cond, order, limit + 1 - len(rows)))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor(order_by, last["page_sort"], last["page_key"])
+
+    return rows, next_cursor
+
+
+def _count_rows(DB: Connection, query: str, where_builder: WhereBuilder) -> int:
+    """Count the rows a search would return without fetching them
+
+    Args:
+        query: Query with {page_cols}, {where} and {order} placeholders
+    """
+
+    where, data = where_builder.print()
+    query = query.format(page_cols="NULL", where=where, order="")
+    return DB.execute(f"SELECT COUNT(*) FROM ({query})", data).fetchone()[0]
+
+
+def _encode_cursor(order_by: Optional[str], *values: Any) -> str:
+    """Create an (opaque) token pointing to the row with the given sort values"""
+
+    text = json.dumps([order_by, *values])
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+# Type of a cursor's sort value (which is null for rows without one)
+_CURSOR_SORT = (int, float, type(None))
+
+
+def _decode_cursor(cursor: str, order_by: Optional[str], *types: Any) -> list[Any]:
+    """Get the values of a token from _encode_cursor
+
+    Args:
+        types: Type (or tuple of types) that each value should have
+    """
+
+    try:
+        cursor_order, *values = json.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(400, detail=f"Invalid cursor ({cursor})")
+
+    if len(values) != len(types):
+        raise HTTPException(400, detail=f"Invalid cursor ({cursor})")
+    for value, type_ in zip(values, types):
+        # (bool is a subclass of int)
+        if not isinstance(value, type_) or isinstance(value, bool):
+            raise HTTPException(400, detail=f"Invalid cursor ({cursor})")
+    if cursor_order != order_by:
+        raise HTTPException(
+            400, detail=f"cursor is for order_by={cursor_order} not {order_by}"
+        )
+
+    return values
+
+
+def _equip_snapshot(source: str, stat: Optional[str]) -> Any:
+    """The in-memory copy of an equip search (see memory_engine.py), or None if the db should be queried instead
+
+    That's when it's disabled, still loading, or when the search has a stat filter (which it doesn't cover).
+    """
+
+    engine = EQUIP_ENGINES.get(source)
+    if engine is None or stat is not None:
+        return None
+    return engine.current()
+
+
+def _search_snapshot(
+    snapshot: Any,
+    mask: Any,
+    order_by: Optional[str],
+    limit: Optional[int],
+    cursor: Optional[str],
+    count: bool,
+    selected: Optional[set[str]],
+    output: "_Output",
+) -> Any:
+    """Return the rows of an in-memory search, like _count_rows / _search_page + _respond do for a query"""
+
+    if count:
+        return dict(count=int(mask.sum()))
+
+    if limit is not None and limit < 1:
+        raise HTTPException(400, detail=f"limit < 1 ({limit})")
+
+    after = None
+    if cursor is not None:
+        sort, key = _decode_cursor(cursor, order_by, _CURSOR_SORT, int)
+        after = (None if sort is None else float(sort), key)
+
+    items, last = snapshot.page(mask, order_by, limit, after)
+    if selected is not None:
+        # (the snapshot has whole items)
+        items = [orjson.dumps(_project(orjson.loads(x), selected)) for x in items]
+    next_cursor = _encode_cursor(order_by, *last) if last else None
+    return _respond(items, next_cursor, output)
+
+
+@dataclass
+class _Output:
+    """How a search's items should be sent"""
+
+    stream: bool
+    layout: formats.Layout
+    msgpack: bool  # (from the Accept header)
+
+    @classmethod
+    def create(cls, stream: bool, format: formats.Layout, accept: Optional[str]):
+        return cls(stream, format, formats.accepts_msgpack(accept))
+
+    @property
+    def values(self) -> bool:
+        """Whether the items are encoded from the values of their fields (see _ItemValues) rather than sent as json"""
+
+        return self.layout != "json" or self.msgpack
+
+
+@dataclass
+class _ItemValues:
+    """Search results as the values of each item's fields (the columns of _item_column with values)
+
+    Formats other than json are encoded from these, since items built by the db would have to be parsed again.
+    """
+
+    fields: list[tuple[tuple[str, ...], str]]  # (see _leaves)
+    rows: Iterable[Sequence[Any]]
+
+    def encode(self, layout: formats.Layout, msgpack_: bool) -> bytes:
+        paths = [path for path, _ in self.fields]
+        json_idxs = [idx for idx, (_, expr) in enumerate(self.fields) if isinstance(expr, _Json)]  # fmt: skip
+
+        def decode(row: Sequence[Any]) -> list[Any]:
+            values = list(row[: len(paths)])
+            for idx in json_idxs:
+                if values[idx] is not None:
+                    values[idx] = orjson.loads(values[idx])
+            return values
+
+        rows = (decode(r) for r in self.rows)
+        return formats.encode_values(paths, rows, layout, msgpack_)
+
+
+def _items(
+    spec: dict[str, Any],
+    selected: Optional[set[str]],
+    rows: Iterable[sqlite3.Row],
+    output: _Output,
+) -> Iterable[bytes] | _ItemValues:
+    """Items of a search's rows (selected with _select_item), for _respond"""
+
+    if output.values:
+        return _ItemValues(list(_leaves(spec, selected)), rows)
+    return (r["item"] for r in rows)
+
+
+def _respond(
+    items: Iterable[bytes] | _ItemValues,
+    next_cursor: Optional[str],
+    output: _Output,
+) -> Response:
+    """Return search results as a json array or as a streamed one (or in the requested format)
+
+    The items are already encoded (mostly by the db, with json_object), so for a json array they're only joined here.
+    Returning a Response also skips FastAPI's jsonable_encoder, which would walk every value of every item.
+    Other formats are built from the whole list of items, so they're never streamed.
+    """
+
+    headers = {"Vary": "Accept"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+
+    if output.values:
+        if isinstance(items, _ItemValues):
+            body = items.encode(output.layout, output.msgpack)
+        else:
+            # (whole items, from an in-memory search)
+            body = formats.encode(items, output.layout, output.msgpack)
+        media_type = formats.MSGPACK_TYPE if output.msgpack else "application/json"
+        return Response(body, media_type=media_type, headers=headers)
+
+    if output.stream:
+        # The first chunk is read now, so that a search that runs out of budget before it still gets a 400
+        chunks = _iter_json(items)
+        first = next(chunks)
+        return _SearchStream(
+            itertools.chain([first], chunks),
+            media_type="application/json",
+            headers=headers,
+        )
+
+    return Response(
+        b"[" + b",".join(items) + b"]", media_type="application/json", headers=headers
+    )
+
+
+class _SearchStream(StreamingResponse):
+    """Streamed search results, which are cut off if the request's sql budget (see get_db) runs out partway
+
+    The status has been sent by then, so instead of a 400 the connection is closed before the end of the body.
+    The client sees an incomplete response rather than a shorter array (and ResponseCache doesn't keep it).
+    """
+
+    async def stream_response(self, send: Send) -> None:
+        try:
+            await super().stream_response(send)
+        except SqlBudgetExceeded as e:
+            logger.warning(f"Cut off a streamed response after {e.seconds}s in sqlite")
+
+
+def _iter_json(items: Iterable[bytes], chunk_size=64 * 1024) -> Iterator[bytes]:
+    """Join encoded items into a json array, a chunk at a time
+
+    Each chunk costs a trip to the threadpool, so items are batched rather than sent one by one.
+    """
+
+    buffer = bytearray(b"[")
+    for idx, item in enumerate(items):
+        if idx > 0:
+            buffer += b","
+        buffer += item
+
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+
+    buffer += b"]"
+    yield bytes(buffer)
+
+
+# In-memory copies of the equip searches, by source (if enabled in server_config.toml)
+EQUIP_ENGINES: dict[str, Any] = dict()
+if SETTINGS.equip_engine == "memory":
+    from classes.core.server.memory_engine import EquipEngine
+
+    EQUIP_ENGINES["super"] = EquipEngine(DB_MANAGER, _select_item(SUPER_EQUIPS_QUERY, SUPER_EQUIP_FIELDS), "se.rowid", "se.price", "sa.end_time", "sa.is_complete")  # fmt: skip
+    EQUIP_ENGINES["kedama"] = EquipEngine(DB_MANAGER, _select_item(KEDAMA_EQUIPS_QUERY, KEDAMA_EQUIP_FIELDS), "equip.rowid", "equip.price", "list.start_time")  # fmt: skip
 
 
 @server.get("/lottery/search")
@@ -253,17 +1080,30 @@ def get_lottery(
     user_partial: Optional[str] = None,
     min_date: Optional[float] = None,
     max_date: Optional[float] = None,
+    order_by: Optional[Literal["date"]] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    count: bool = False,
+    stream: bool = False,
+    fields: Optional[str] = None,
+    format: formats.Layout = "json",
+    accept: Annotated[Optional[str], Header()] = None,
     DB: Connection = Depends(get_db),
 ):
     """Search lottery data
 
     The equip name and user name can be a comma separated list (eg "peerl,oak,heimd" instead of "Peerless Oak Staff of Heimdall")
     """
+    output = _Output.create(stream, format, accept)
+    selected = _parse_fields(_lottery_fields("weapon"), fields)
+
     where_builder = WhereBuilder("AND")
 
     # Filter by item name
+    fragments_by_param: dict[str, list[str]] = dict()
     if equip is not None:
         fragments = [x.strip() for x in equip.split(",")]
+        fragments_by_param["equip"] = fragments
         for fragment in fragments:
             where_builder.add('"1_prize" LIKE ?', f"%{fragment}%")
 
@@ -277,101 +1117,367 @@ def get_lottery(
     if max_date is not None:
         where_builder.add("date <= ?", max_date)
 
-    # Filter by winner name
-    user_cols = ["1_user", "1b_user", "2_user", "3_user", "4_user", "5_user"]
-    if user is not None:
-        wb = WhereBuilder("OR")
-        for col in user_cols:
-            wb.add(f'"{col}" = ?', user)
-        where_builder.add_builder(wb)
-    elif user_partial is not None:
+    # Filter by winner name (any place)
+    #   (exact names are looked up in lottery_results, see run())
+    if user is None and user_partial is not None:
+        # A LIKE can't use an index either way, and scanning the lottery's user columns
+        # is cheaper than scanning every row of lottery_results
+        user_cols = ["1_user", "1b_user", "2_user", "3_user", "4_user", "5_user"]
+        fragments = [x.strip() for x in user_partial.split(",")]
+        fragments_by_param["user_partial"] = fragments
+
         wb = WhereBuilder("OR")
         for col in user_cols:
             wb2 = WhereBuilder("AND")
-            fragments = [x.strip() for x in user_partial.split(",")]
             for fragment in fragments:
                 wb2.add(f'"{col}" LIKE ?', f"%{fragment}%")
             wb.add_builder(wb2)
         where_builder.add_builder(wb)
 
+    # (an exact user is looked up with an index)
+    _check_fragments(fragments_by_param, narrowed=user is not None)
+
+    if limit is not None and limit < 1:
+        raise HTTPException(400, detail=f"limit < 1 ({limit})")
+
+    # Lotteries are sorted by (date, id, type) when paging
+    if limit is not None or cursor is not None:
+        order_by = "date"
+    order = ""
+    order_data: list[Any] = []
+    if order_by is not None:
+        order = "ORDER BY date DESC, id DESC"
+        if limit is not None:
+            # Fetch an extra row to check for a next page
+            #   (bound rather than inlined so that every page size runs the same statement)
+            order += " LIMIT ?"
+            order_data.append(limit + 1)
+
+    def run(type: str, select: str, order: str) -> sqlite3.Cursor:
+        wb = replace(where_builder, fragments=list(where_builder.fragments))
+        if user is not None:
+            results_builder = WhereBuilder("AND")
+            results_builder.add(f"type = '{type}'")
+            results_builder.add("user = ?", user)
+            wb.add_subquery(
+                "id IN (SELECT lottery_id FROM lottery_results {where})",
+                results_builder,
+            )
+        if cursor is not None:
+            date, id, cursor_type = _decode_cursor(
+                cursor, order_by, _CURSOR_SORT, int, str
+            )
+            op = "<=" if type < cursor_type else "<"
+            wb.add(f"(date, id) {op} (?, ?)", (date, id))
+
+        where, query_data = wb.print()
+        if order:
+            query_data.extend(order_data)
+
+        query = f"""
+            SELECT {select} FROM lottery_{type}
+            {where}
+            {order}
+            """
+        logger.trace(f"Search lottery {query} {query_data}")
+        return DB.execute(query, query_data)
+
+    def pairs(type: str, rows: sqlite3.Cursor) -> Iterator[tuple[tuple, sqlite3.Row]]:
+        """(sort key, row) of each lottery"""
+
+        for r in rows:
+            yield (r["date"], r["id"], type), r
+
     # Run query
-    rows = []
+    types = ["weapon", "armor"]
     with DB:
-        for type in ["weapon", "armor"]:
-            where, query_data = where_builder.print()
-            query = f"""
-                SELECT * FROM lottery_{type}
-                {where}
-                """
-            logger.trace(f"Search lottery {query} {query_data}")
-            rs = DB.execute(query, query_data).fetchall()
-            for r in rs:
-                data = dict(r)
-                data["type"] = type
-                rows.append(data)
-
-    # Recombine columns into list of (item, winner)
-    parse = json.loads
-
-    result = []
+        if count:
+            total = sum(run(type, "COUNT(*)", "").fetchone()[0] for type in types)
+            return dict(count=total)
+
+        results = [
+            pairs(type, run(type, _lottery_item(type, selected, output.values), order))
+            for type in types
+        ]
+
+    # Combine the results for each type (in order, if sorted)
+    pairs: Iterable[tuple[tuple, sqlite3.Row]]
+    if order_by is not None:
+        pairs = heapq.merge(*results, key=lambda x: x[0], reverse=True)
+    else:
+        pairs = itertools.chain(*results)
+
+    next_cursor = None
+    if limit is not None:
+        pairs = list(itertools.islice(pairs, limit + 1))
+        if len(pairs) > limit:
+            pairs = pairs[:limit]
+            next_cursor = _encode_cursor(order_by, *pairs[-1][0])
+
+    # (the fields of both types are the same, only the value of lottery.type differs)
+    items = _items(_lottery_fields("weapon"), selected, (r for _, r in pairs), output)
+    return _respond(items, next_cursor, output)
+
+
+def _lottery_item(
+    type: str, selected: Optional[set[str]] = None, values: bool = False
+) -> str:
+    """Columns for a lottery's response item (see _item_column) and its sort key"""
+
+    return f"{_item_column(_lottery_fields(type), selected, values)}, date, id"
+
+
+def _lottery_fields(type: str) -> dict[str, Any]:
+    """Fields of a lottery's response item
+
+    The prizes are recombined into a list of (item, winner)
+    """
+
+    prizes = ", ".join(
+        f'json_array({prize}, "{place}_user")'
+        for place, prize in [
+            ("1", '"1_prize"'),
+            ("1b", '"1b_prize"'),
+            ("2", 'json("2_prize")'),
+            ("3", 'json("3_prize")'),
+            ("4", 'json("4_prize")'),
+            ("5", 'json("5_prize")'),
+        ]
+    )
+    return dict(
+        date=_Real("date"),
+        tickets="tickets",
+        lottery=dict(id="id", type=f"'{type}'"),
+        prizes=_Json(f"json_array({prizes})"),
+    )
+
+
+# Prize categories by place (grand prize, core, then GLTs, candies and chaos tokens)
+LOTTERY_CATEGORIES = {
+    "1": "equips",
+    "1b": "cores",
+    "2": "glts",
+    "3": "candies",
+    "4": "chaos_tokens",
+    "5": "chaos_tokens",
+}
+
+
+@server.get("/lottery/user_stats")
+def get_lottery_user_stats(
+    user: str,
+    min_date: Optional[float] = None,
+    max_date: Optional[float] = None,
+    DB: Connection = Depends(get_db),
+):
+    """Tally the lottery prizes won by a user, and list the lotteries they won (the tables of !lwinner)
+
+    Each lottery counts once, for the best place the user won in it.
+    For each category, count is the number of items won (eg the total Chaos Tokens) and wins is the number of lotteries.
+    The user is returned as spelled in their latest win (null if they've never won).
+    Lotteries are newest first, with the prize the user won (as in /lottery/search) and the grand prize.
+    """
+
+    if min_date is not None and max_date is not None and max_date < min_date:
+        raise HTTPException(
+            400, detail=f"min_date > max_date ({min_date} > {max_date})"
+        )
+
+    user_builder = WhereBuilder("AND")
+    user_builder.add("user = ?", user)
+    user_where, user_data = user_builder.print()
+
+    date_builder = WhereBuilder("AND")
+    if min_date is not None:
+        date_builder.add("date >= ?", min_date)
+    if max_date is not None:
+        date_builder.add("date <= ?", max_date)
+    date_where, date_data = date_builder.print()
+
+    # In sqlite, the bare columns of a MIN() / MAX() aggregate come from the min / max row
+    lotteries = " UNION ALL ".join(
+        f"""
+        SELECT wins.*, date, tickets, "1_prize" AS grand_prize
+        FROM wins JOIN lottery_{type} ON type = '{type}' AND id = lottery_id
+        """
+        for type in ["weapon", "armor"]
+    )
+    query = f"""
+        WITH wins AS (
+            SELECT type, lottery_id, MIN(place) AS place, user, prize_qty, prize_name
+            FROM lottery_results
+            {user_where}
+            GROUP BY type, lottery_id
+        )
+        SELECT * FROM ({lotteries})
+        {date_where}
+        ORDER BY date DESC, lottery_id DESC, type DESC
+        """
+    logger.trace(f"Lottery user stats {query} {user_data + date_data}")
+    rows = DB.execute(query, user_data + date_data).fetchall()
+
+    stats = {
+        category: dict(count=0, wins=0) for category in LOTTERY_CATEGORIES.values()
+    }
     for r in rows:
-        result.append(
+        category = stats[LOTTERY_CATEGORIES[r["place"]]]
+        category["count"] += r["prize_qty"]
+        category["wins"] += 1
+
+    return dict(
+        user=rows[0]["user"] if rows else None,
+        wins=len(rows),
+        stats=stats,
+        lotteries=[
             dict(
                 date=r["date"],
                 tickets=r["tickets"],
-                lottery=dict(id=r["id"], type=r["type"]),
-                prizes=[
-                    [r["1_prize"], r["1_user"]],
-                    [r["1b_prize"], r["1b_user"]],
-                    [parse(r["2_prize"]), r["2_user"]],
-                    [parse(r["3_prize"]), r["3_user"]],
-                    [parse(r["4_prize"]), r["4_user"]],
-                    [parse(r["5_prize"]), r["5_user"]],
-                ],
-            ),
-        )
+                lottery=dict(id=r["lottery_id"], type=r["type"]),
+                place=r["place"],
+                # (the equip / core, or [quantity, item] like the other places of /lottery/search)
+                prize=(
+                    r["prize_name"]
+                    if r["place"] in ["1", "1b"]
+                    else [r["prize_qty"], r["prize_name"]]
+                ),
+                grand_prize=r["grand_prize"],
+            )
+            for r in rows
+        ],
+    )
 
-    return result
 
+def _add_partial_match(
+    where_builder: WhereBuilder, fts_phrases: list[str], col: str, fragment: str
+) -> None:
+    """Filter for rows where col contains fragment (case-insensitive)
 
-@server.get("/export/sqlite", response_class=PlainTextResponse)
-def export_sqlite(DB: Connection = Depends(get_db)):
-    """Equivalent to .dump in sqlite3"""
+    The trigram index is used whenever a phrase match is guaranteed to give the same results as LIKE '%fragment%'.
+    It doesn't for fragments shorter than 3 chars, ones containing LIKE wildcards,
+    or ones with non-ascii letters (the index folds their case but LIKE doesn't).
+    """
 
-    DB_COPY = sqlite3.connect(":memory:")
-    DB.backup(DB_COPY)
+    use_fts = (
+        len(fragment) >= 3
+        and "%" not in fragment
+        and "_" not in fragment
+        and all(c.isascii() or c.lower() == c.upper() for c in fragment)
+    )
 
-    with DB_COPY:
-        # Delete unnecessary tables
-        tables = DB_COPY.execute(
-            'SELECT name FROM sqlite_master WHERE type = "table"'
-        ).fetchall()
-        tables = [x[0] for x in tables]
+    if use_fts:
+        phrase = '"' + fragment.replace('"', '""') + '"'
+        fts_phrases.append(f"{col} : {phrase}")
+    else:
+        where_builder.add(f"{col} LIKE ?", f"%{fragment}%")
 
-        for tbl in tables:
-            if tbl not in EXPORTED_TABLES:
-                DB_COPY.execute(f"DROP TABLE {tbl}")
 
-    # Export
-    resp = "\n".join(DB_COPY.iterdump())
-    return resp
+@server.get("/cache/stats")
+def get_cache_stats():
+    """Hit / miss counters of the search response cache (for sizing it)"""
+
+    return RESULT_CACHE.stats()
+
+
+@server.get("/metrics")
+def get_metrics():
+    """Request latency / size / sql time per route, in the Prometheus text format
+
+    With several workers (see run_server.py), each one reports its own.
+    """
+
+    for k, v in RESULT_CACHE.stats().items():
+        metrics.RESULT_CACHE_STATS.set(k, value=v)
+    for k, v in STATEMENT_STATS.stats().items():
+        metrics.STATEMENT_CACHE_STATS.set(k, value=v)
+
+    return PlainTextResponse(
+        metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@server.get("/export/sqlite")
+def export_sqlite(request: Request, DB: Connection = Depends(get_db)):
+    """Equivalent to .dump in sqlite3 (for the EXPORTED_TABLES)
+
+    The dump is only rebuilt when the data changes. It's served from disk, gzip'd if the client accepts it.
+    """
+
+    return EXPORTS.respond(request, DB, "sqlite")
+
+
+@server.get("/export/sqlite-file")
+def export_sqlite_file(request: Request, DB: Connection = Depends(get_db)):
+    """Compacted copy of the db (for the EXPORTED_TABLES), built with VACUUM INTO
+
+    Faster to download and load than /export/sqlite. It's rebuilt / served the same way.
+    """
+
+    return EXPORTS.respond(request, DB, "sqlite-file")
+
+
+@server.get("/export/changes")
+def export_changes(since: int = 0):
+    """Rows of the EXPORTED_TABLES that were inserted / updated / deleted after a version
+
+    For keeping a copy of the db in sync (see tools/mirror.py) without downloading all of it again.
+    The exports' X-Data-Generation header is the version they're from.
+    Changes are streamed as newline-delimited json, see iter_changes() for the format.
+    """
+
+    return StreamingResponse(
+        iter_changes(DB_MANAGER.fp, since), media_type="application/x-ndjson"
+    )
 
 
 @server.get("/export/json")
-def export_json(DB: Connection = Depends(get_db)):
-    """Dump DB as JSON"""
-    resp = dict()
+def export_json(request: Request, DB: Connection = Depends(get_db)):
+    """Dump DB as JSON (rebuilt / served like /export/sqlite)"""
 
-    with DB:
-        for tbl in EXPORTED_TABLES:
-            resp[tbl] = [dict(x) for x in DB.execute(f"SELECT * FROM {tbl}").fetchall()]
+    return EXPORTS.respond(request, DB, "json")
+
+
+# Readers that each worker opens before it's sent requests
+WARM_UP_READERS = 8
+
+# Run on each of those readers, so that their statements are compiled and the pages they read are cached
+WARM_UP_SEARCHES = [
+    (get_super_equips, dict(name="oak", order_by="date", limit=50)),
+    (get_kedama_equips, dict(name="oak", order_by="date", limit=50)),
+    (get_all_equips, dict(name="oak", order_by="date", limit=50)),
+    (get_lottery, dict(equip="oak", order_by="date", limit=50)),
+]
+
+
+def warm_up() -> None:
+    """Load / open everything that the first requests of a worker would otherwise wait on
 
-    return resp
+    That's the in-memory equip searches (if enabled) and a few readers (plus their page cache).
+    A failure is only logged, since the worker can still answer requests without these.
+    """
+
+    start = time.perf_counter()
+
+    for engine in EQUIP_ENGINES.values():
+        try:
+            engine.load()
+        except Exception:
+            logger.exception("Failed to load equips into memory")
+
+    try:
+        # Held at once so that they're all opened (instead of the same one being reused)
+        with ExitStack() as stack:
+            readers = [stack.enter_context(DB_MANAGER.reader()) for _ in range(WARM_UP_READERS)]  # fmt: skip
+            for DB in readers:
+                for endpoint, params in WARM_UP_SEARCHES:
+                    endpoint(**params, DB=DB)
+    except Exception:
+        logger.exception("Failed to warm up the db connections")
+
+    logger.info(f"Warmed up in {time.perf_counter() - start:.1f}s")
 
 
 if __name__ == "__main__":
-    import uvicorn
+    # Same as run_server.py (supervised workers, or --reload for development)
+    from run_server import main
 
-    uvicorn.run(
-        "classes.core.server.server:server", host="0.0.0.0", port=4545, reload=True
-    )
+    main()
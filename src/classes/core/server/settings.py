@@ -0,0 +1,50 @@
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Literal
+
+from config import paths
+from utils.misc import load_toml
+
+
+@dataclass
+class ServerSettings:
+    """Options read from server_config.toml (see server_config_example.toml)"""
+
+    equip_engine: Literal["sqlite", "memory"] = "sqlite"
+
+    # Seconds that a request's queries can run for before they're aborted (0 for no limit)
+    sql_budget: float = 10.0
+
+    # Requests that spend more than this many milliseconds in sqlite are logged (with their params)
+    slow_sql_ms: float = 1000.0
+
+    # Server processes started by run_server.py (each with its own connections and caches)
+    workers: int = 1
+
+
+def load_settings(fp: Path = paths.SERVER_CONFIG) -> ServerSettings:
+    """Read the server config, falling back to the defaults if there isn't one"""
+
+    if not fp.exists():
+        return ServerSettings()
+
+    data = load_toml(fp).value
+    known = {f.name for f in fields(ServerSettings)}
+    unknown = set(data) - known
+    if unknown:
+        raise Exception(f"Unknown keys in {fp}: {sorted(unknown)}")
+
+    settings = ServerSettings(**data)
+    if settings.equip_engine not in ["sqlite", "memory"]:
+        raise Exception(f"Invalid equip_engine in {fp}: {settings.equip_engine}")
+    if not isinstance(settings.workers, int) or settings.workers < 1:
+        raise Exception(f"Invalid workers in {fp}: {settings.workers}")
+    for name in ["sql_budget", "slow_sql_ms"]:
+        value = getattr(settings, name)
+        if not isinstance(value, (int, float)) or value < 0:
+            raise Exception(f"Invalid {name} in {fp}: {value}")
+
+    return settings
+
+
+SETTINGS = load_settings()
@@ -1,4 +1,17 @@
-from .tables import create_tables, get_db
+from .connection import (
+    DB_MANAGER,
+    SQL_TIMER,
+    STATEMENT_STATS,
+    ConnectionManager,
+    SqlBudgetExceeded,
+    SqlTimer,
+    get_db,
+    sql_budget,
+)
+from .migrations import migrate
+from .rollups import refresh_price_rollups
+from .tables import create_tables
 
-create_tables()
-DB = get_db()
+DB = DB_MANAGER.writer
+create_tables(DB)
+migrate(DB)
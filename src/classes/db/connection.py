@@ -0,0 +1,314 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator, Optional
+
+from config import paths
+
+
+class SqlTimer:
+    """Time spent in sqlite by the readers, for one request (see SQL_TIMER)"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.statements = 0
+
+
+# While set, readers add the time spent executing statements / fetching rows to it.
+# Context vars are copied to the threadpool workers that run sync endpoints / dependencies,
+# so the timer set by a middleware sees every query made for that request.
+SQL_TIMER: ContextVar[SqlTimer | None] = ContextVar("SQL_TIMER", default=None)
+
+
+class StatementStats:
+    """Hits / misses of the readers' statement caches (see STATEMENT_STATS)
+
+    sqlite3 doesn't expose its cache of compiled statements, so each reader keeps a copy of its keys
+    (an LRU of sql strings, of the same size) and counts whether a statement would've been found in it.
+    A miss means the statement was compiled again, which is a sign of queries whose text varies
+    (eg inlined values) or of a cache that's too small for the number of distinct queries.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses)
+
+
+STATEMENT_STATS = StatementStats()
+
+
+class _SqlBudget:
+    """Time that a connection's statements can still run for (see sql_budget)
+
+    Only the time spent inside execute / fetch calls is charged, so a caller that's slow to consume
+    the rows (eg a stream to a slow client) doesn't use up the budget.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.spent = 0.0
+        self.exceeded = False
+
+        # Start of the execute / fetch call in progress, if any
+        self.since: Optional[float] = None
+
+    def check(self) -> bool:
+        since = self.since
+        if (
+            since is not None
+            and self.spent + time.perf_counter() - since > self.seconds
+        ):
+            self.exceeded = True
+        return self.exceeded
+
+
+class _TimedCursor(sqlite3.Cursor):
+    timer: Optional[SqlTimer]
+    budget: Optional[_SqlBudget]
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        budget = self.budget
+        if budget is not None:
+            budget.since = start
+
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            # Converted here rather than only in sql_budget, since the rows of a stream are read after the endpoint returns
+            if budget is not None and budget.exceeded:
+                raise SqlBudgetExceeded(budget.seconds) from e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.timer is not None:
+                self.timer.seconds += elapsed
+            if budget is not None:
+                budget.spent += elapsed
+                budget.since = None
+
+    def execute(self, *args):
+        if self.timer is not None:
+            self.timer.statements += 1
+        return self._timed(super().execute, *args)
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(super().fetchall)
+
+    def __next__(self):
+        return self._timed(super().__next__)
+
+
+class _TimedConnection(sqlite3.Connection):
+    """Connection whose execute() is timed while SQL_TIMER / a budget is set (and counted in STATEMENT_STATS)
+
+    Only execute() is covered (not executemany / executescript), since that's all the readers use.
+    Timing each row adds roughly a microsecond per row, so it's skipped when there's no timer or budget.
+    """
+
+    budget: Optional[_SqlBudget] = None
+
+    def __init__(self, *args, cached_statements: int = 128, **kwargs):
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+
+        # Keys of the statement cache, in LRU order
+        self._statements: OrderedDict[str, None] = OrderedDict()
+        self._cached_statements = cached_statements
+
+    def execute(self, *args):
+        self._count_statement(args[0])
+
+        timer = SQL_TIMER.get()
+        if timer is None and self.budget is None:
+            return super().execute(*args)
+
+        cursor = self.cursor(_TimedCursor)
+        cursor.timer = timer
+        cursor.budget = self.budget
+        return cursor.execute(*args)
+
+    def _count_statement(self, sql: str) -> None:
+        # Same eviction as sqlite3's cache (least recently used)
+        keys = self._statements
+        hit = sql in keys
+        if hit:
+            keys.move_to_end(sql)
+        else:
+            keys[sql] = None
+            if len(keys) > self._cached_statements:
+                keys.popitem(last=False)
+
+        STATEMENT_STATS.record(hit)
+
+
+class SqlBudgetExceeded(Exception):
+    """A request's queries ran for longer than its budget (see sql_budget)"""
+
+    def __init__(self, seconds: float):
+        super().__init__(f"Queries ran for longer than {seconds}s")
+        self.seconds = seconds
+
+
+# How often (in sqlite VM instructions) sql_budget checks the time
+#   roughly every 0.1ms, which costs a few percent of a query's time at most
+BUDGET_CHECK_INTERVAL = 1000
+
+
+@contextmanager
+def sql_budget(DB: sqlite3.Connection, seconds: Optional[float]) -> Iterator[None]:
+    """Abort the statements run on DB once they've spent seconds in sqlite (if seconds isn't 0 / None)
+
+    DB must be a reader (see ConnectionManager.reader), since the time is counted by its cursors.
+    A statement that's interrupted raises an OperationalError, which is re-raised as SqlBudgetExceeded.
+    """
+
+    if not seconds:
+        yield
+        return
+
+    if not isinstance(DB, _TimedConnection):
+        raise TypeError(f"Expected a reader, got {type(DB)}")
+
+    budget = _SqlBudget(seconds)
+    DB.budget = budget
+    DB.set_progress_handler(budget.check, BUDGET_CHECK_INTERVAL)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if budget.exceeded:
+            raise SqlBudgetExceeded(seconds) from e
+        raise
+    finally:
+        DB.set_progress_handler(None, 0)
+        DB.budget = None
+
+
+class ConnectionManager:
+    """Hands out sqlite connections
+
+    Readers are pooled and reused across requests instead of being opened per request.
+    WAL mode lets them run alongside the single writer connection (used by the scrapers).
+
+    The pool is a checkout / return pool rather than a threading.local because FastAPI
+    resolves a dependency and runs a sync endpoint on (potentially) different threadpool workers.
+    """
+
+    # Readers kept open after being returned. Beyond this, extra readers are closed on return.
+    # Matches the default size of the threadpool that sync endpoints run in.
+    MAX_IDLE_READERS = 40
+
+    # sqlite3's per-connection LRU of compiled statements (python's default is 128)
+    CACHED_STATEMENTS = 512
+
+    # Page cache per connection, in KiB (negative values are KiB for PRAGMA cache_size)
+    CACHE_SIZE_KB = 16 * 1024
+
+    # Memory-map the db file so reads skip the read() syscall + copy
+    MMAP_SIZE = 256 * 1024**2
+
+    def __init__(self, fp: Path | str):
+        self.fp = fp
+
+        # Seconds that the queries of a request (see get_db) can run for
+        self.request_budget: Optional[float] = None
+
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writer: sqlite3.Connection | None = None
+
+    @property
+    def writer(self) -> sqlite3.Connection:
+        """The (only) connection that should write to the db"""
+
+        with self._lock:
+            if self._writer is None:
+                self._writer = self._connect()
+                self._writer.execute("PRAGMA journal_mode = WAL")
+                self._writer.execute("PRAGMA synchronous = NORMAL")
+            return self._writer
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection"""
+
+        with self._lock:
+            DB = self._idle.pop() if self._idle else None
+        if DB is None:
+            DB = self._connect_reader()
+
+        try:
+            yield DB
+        finally:
+            self._release(DB)
+
+    def close(self) -> None:
+        with self._lock:
+            for DB in self._idle:
+                DB.close()
+            self._idle.clear()
+
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _connect(self, factory=sqlite3.Connection) -> sqlite3.Connection:
+        DB = sqlite3.connect(
+            self.fp,
+            cached_statements=self.CACHED_STATEMENTS,
+            check_same_thread=False,
+            factory=factory,
+        )
+        DB.row_factory = sqlite3.Row
+        return DB
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        DB = self._connect(_TimedConnection)
+        DB.execute("PRAGMA query_only = 1")
+        DB.execute(f"PRAGMA cache_size = -{self.CACHE_SIZE_KB}")
+        DB.execute(f"PRAGMA mmap_size = {self.MMAP_SIZE}")
+        return DB
+
+    def _release(self, DB: sqlite3.Connection) -> None:
+        # Don't hand out a connection that's still inside a transaction
+        if DB.in_transaction:
+            DB.rollback()
+
+        with self._lock:
+            if len(self._idle) < self.MAX_IDLE_READERS:
+                self._idle.append(DB)
+                return
+        DB.close()
+
+
+DB_MANAGER = ConnectionManager(paths.DB_FILE)
+
+
+def get_db() -> Iterator[sqlite3.Connection]:
+    """FastAPI dependency that lends a read-only connection to a request (with a time budget)"""
+
+    with DB_MANAGER.reader() as DB:
+        with sql_budget(DB, DB_MANAGER.request_budget):
+            yield DB
@@ -0,0 +1,704 @@
+import json
+import sqlite3
+from typing import Callable
+
+from classes.db.rollups import refresh_price_rollups
+from config import logger
+from utils.parse import parse_lottery_prizes, parse_stats
+
+
+def migrate(DB: sqlite3.Connection) -> None:
+    """Apply any migrations that haven't been run on this db yet
+
+    Each migration runs in its own transaction along with the version bump,
+    so a failed migration leaves the db at the previous version.
+    """
+
+    DB.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version     INTEGER     NOT NULL
+        ) STRICT;
+        """
+    )
+
+    applied = False
+    for version, fn in enumerate(MIGRATIONS, start=1):
+        # IMMEDIATE so that concurrent processes don't both apply the same migration
+        DB.execute("BEGIN IMMEDIATE")
+        try:
+            if get_version(DB) >= version:
+                DB.rollback()
+                continue
+
+            logger.info(f"Applying db migration {version}: {fn.__name__}")
+            fn(DB)
+            DB.execute("DELETE FROM schema_version")
+            DB.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            DB.commit()
+            applied = True
+        except:
+            DB.rollback()
+            raise
+
+    # Refresh the planner's statistics so that it knows which indexes are selective
+    # (without them, a sorted search may scan the whole equip table instead of walking the date index)
+    if applied:
+        DB.execute("PRAGMA analysis_limit = 1000")
+        DB.execute("ANALYZE")
+        DB.commit()
+
+
+def get_version(DB: sqlite3.Connection) -> int:
+    row = DB.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def _add_search_indexes(DB: sqlite3.Connection) -> None:
+    """Index the columns that the search endpoints filter / join on
+
+    User columns are compared with COLLATE NOCASE, so their indexes need to be too
+    (otherwise sqlite won't use them).
+    """
+
+    # Super
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_super_equips_id_auction ON super_equips (id_auction)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_super_equips_price ON super_equips (price)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_super_equips_buyer ON super_equips (buyer COLLATE NOCASE)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_super_equips_seller ON super_equips (seller COLLATE NOCASE)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_super_auctions_end_time ON super_auctions (end_time)"
+    )
+
+    # Kedama
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_kedama_equips_id_auction ON kedama_equips (id_auction)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_kedama_equips_price ON kedama_equips (price)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_kedama_equips_buyer ON kedama_equips (buyer COLLATE NOCASE)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_kedama_equips_seller ON kedama_equips (seller COLLATE NOCASE)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_kedama_auctions_start_time ON kedama_auctions (start_time)"
+    )
+
+
+def _add_equip_fts(DB: sqlite3.Connection) -> None:
+    """Trigram indexes for the substring (LIKE '%frag%') searches on equip / user names
+
+    These are external-content tables (the text isn't duplicated) keyed by the equip's rowid,
+    and triggers keep them in sync with the equip tables.
+    """
+
+    for table in ["super_equips", "kedama_equips"]:
+        fts = f"{table}_fts"
+
+        DB.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5 (
+                name, buyer, seller,
+                content={table}, content_rowid=rowid, tokenize=trigram
+            );
+            """
+        )
+
+        # The scrapers INSERT OR REPLACE, and the implicit delete of a REPLACE doesn't fire delete triggers.
+        # So drop the index entry of any row that's about to be replaced.
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_before_insert BEFORE INSERT ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, name, buyer, seller)
+                SELECT 'delete', rowid, name, buyer, seller FROM {table}
+                WHERE id = NEW.id AND id_auction = NEW.id_auction;
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_after_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, name, buyer, seller)
+                VALUES (NEW.rowid, NEW.name, NEW.buyer, NEW.seller);
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_after_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, name, buyer, seller)
+                VALUES ('delete', OLD.rowid, OLD.name, OLD.buyer, OLD.seller);
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_after_update AFTER UPDATE OF name, buyer, seller ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, name, buyer, seller)
+                VALUES ('delete', OLD.rowid, OLD.name, OLD.buyer, OLD.seller);
+                INSERT INTO {fts} (rowid, name, buyer, seller)
+                VALUES (NEW.rowid, NEW.name, NEW.buyer, NEW.seller);
+            END;
+            """
+        )
+
+        # Index existing rows
+        DB.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def _add_all_equips(DB: sqlite3.Connection) -> None:
+    """Materialized union of the super / kedama equips (joined with their auction)
+
+    Rows are shaped like what the discord bot displays (CogEquip),
+    so /equips/search can merge, filter, and sort both sources in one query.
+    Triggers on the source tables keep it up to date as the scrapers write.
+    """
+
+    DB.execute(
+        """
+        CREATE TABLE IF NOT EXISTS all_equips (
+            pk                      INTEGER,
+
+            source                  TEXT        NOT NULL,   -- 'super' | 'kedama'
+            id                      TEXT        NOT NULL,
+            id_auction              TEXT        NOT NULL,
+
+            name                    TEXT        NOT NULL,
+            eid                     INTEGER     NOT NULL,
+            key                     TEXT        NOT NULL,
+            is_isekai               INTEGER     NOT NULL,
+            level                   INTEGER,
+            stats                   TEXT        NOT NULL,   --json list
+
+            price                   INTEGER,
+            min_bid                 INTEGER,                -- super's next_bid / kedama's start_bid
+            buyer                   TEXT,
+            seller                  TEXT,
+
+            auction_title           TEXT        NOT NULL,
+            auction_title_short     TEXT        NOT NULL,   -- eg S456 / K123
+            auction_time            REAL        NOT NULL,   -- super's end_time / kedama's start_time
+            auction_is_complete     REAL,
+
+            PRIMARY KEY (pk),
+            UNIQUE (source, id_auction, id)
+        ) STRICT;
+        """
+    )
+
+    # Queries that produce all_equips rows from the source tables, given a WHERE clause
+    #   (super stores '{}' for equips without stats)
+    # fmt: off
+    select_super = """
+        SELECT
+            'super', se.id, se.id_auction,
+            se.name, se.eid, se.key, se.is_isekai, se.level,
+            CASE WHEN se.stats = '{{}}' THEN '[]' ELSE se.stats END,
+            se.price, se.next_bid, se.buyer, se.seller,
+            sa.title, 'S' || CASE WHEN length(sa.title) < 3 THEN substr('000' || sa.title, -3) ELSE sa.title END,
+            sa.end_time, sa.is_complete
+        FROM super_equips AS se INNER JOIN super_auctions AS sa
+        ON sa.id = se.id_auction
+        WHERE {where}
+    """
+    select_kedama = """
+        SELECT
+            'kedama', ke.id, ke.id_auction,
+            ke.name, ke.eid, ke.key, ke.is_isekai, ke.level,
+            CASE WHEN ke.stats = '{{}}' THEN '[]' ELSE ke.stats END,
+            ke.price, ke.start_bid, ke.buyer, ke.seller,
+            ka.title, 'K' || CASE WHEN length(ka.title_short) < 3 THEN substr('000' || ka.title_short, -3) ELSE ka.title_short END,
+            ka.start_time, ka.is_complete
+        FROM kedama_equips AS ke INNER JOIN kedama_auctions AS ka
+        ON ka.id = ke.id_auction
+        WHERE {where}
+    """
+    insert = """
+        INSERT INTO all_equips (
+            source, id, id_auction,
+            name, eid, key, is_isekai, level, stats,
+            price, min_bid, buyer, seller,
+            auction_title, auction_title_short, auction_time, auction_is_complete
+        )
+    """
+    # fmt: on
+
+    for source, select, equips, auctions, alias in [
+        ("super", select_super, "super_equips", "super_auctions", "se"),
+        ("kedama", select_kedama, "kedama_equips", "kedama_auctions", "ke"),
+    ]:
+        # Rows are always deleted then re-inserted. A REPLACE wouldn't fire all_equips' own delete trigger.
+        delete_equip = f"""
+            DELETE FROM all_equips
+            WHERE source = '{source}' AND id_auction = {{row}}.id_auction AND id = {{row}}.id;
+        """
+        delete_auction = f"""
+            DELETE FROM all_equips
+            WHERE source = '{source}' AND id_auction = {{row}}.id;
+        """
+
+        # Equip changes
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS all_equips_{equips}_insert AFTER INSERT ON {equips} BEGIN
+                {delete_equip.format(row="NEW")}
+                {insert}
+                {select.format(where=f"{alias}.id = NEW.id AND {alias}.id_auction = NEW.id_auction")};
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS all_equips_{equips}_update AFTER UPDATE ON {equips} BEGIN
+                {delete_equip.format(row="OLD")}
+                {insert}
+                {select.format(where=f"{alias}.id = NEW.id AND {alias}.id_auction = NEW.id_auction")};
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS all_equips_{equips}_delete AFTER DELETE ON {equips} BEGIN
+                {delete_equip.format(row="OLD")}
+            END;
+            """
+        )
+
+        # Auction changes (last_fetch_time is irrelevant and updated often)
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS all_equips_{auctions}_insert AFTER INSERT ON {auctions} BEGIN
+                {delete_auction.format(row="NEW")}
+                {insert}
+                {select.format(where=f"{alias}.id_auction = NEW.id")};
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS all_equips_{auctions}_update
+            AFTER UPDATE OF {"title, end_time" if source == "super" else "title, title_short, start_time"}, is_complete ON {auctions} BEGIN
+                {delete_auction.format(row="OLD")}
+                {insert}
+                {select.format(where=f"{alias}.id_auction = NEW.id")};
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS all_equips_{auctions}_delete AFTER DELETE ON {auctions} BEGIN
+                {delete_auction.format(row="OLD")}
+            END;
+            """
+        )
+
+        # Backfill
+        DB.execute(insert + select.format(where="1"))
+
+    # Indexes for the filters in /equips/search
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_all_equips_auction_time ON all_equips (auction_time)"
+    )
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_all_equips_price ON all_equips (price)")
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_all_equips_buyer ON all_equips (buyer COLLATE NOCASE)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_all_equips_seller ON all_equips (seller COLLATE NOCASE)"
+    )
+
+    # Trigram index, same as for the source tables
+    DB.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS all_equips_fts USING fts5 (
+            name, buyer, seller,
+            content=all_equips, content_rowid=pk, tokenize=trigram
+        );
+        """
+    )
+    DB.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS all_equips_fts_after_insert AFTER INSERT ON all_equips BEGIN
+            INSERT INTO all_equips_fts (rowid, name, buyer, seller)
+            VALUES (NEW.pk, NEW.name, NEW.buyer, NEW.seller);
+        END;
+        """
+    )
+    DB.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS all_equips_fts_after_delete AFTER DELETE ON all_equips BEGIN
+            INSERT INTO all_equips_fts (all_equips_fts, rowid, name, buyer, seller)
+            VALUES ('delete', OLD.pk, OLD.name, OLD.buyer, OLD.seller);
+        END;
+        """
+    )
+    DB.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS all_equips_fts_after_update AFTER UPDATE OF name, buyer, seller ON all_equips BEGIN
+            INSERT INTO all_equips_fts (all_equips_fts, rowid, name, buyer, seller)
+            VALUES ('delete', OLD.pk, OLD.name, OLD.buyer, OLD.seller);
+            INSERT INTO all_equips_fts (rowid, name, buyer, seller)
+            VALUES (NEW.pk, NEW.name, NEW.buyer, NEW.seller);
+        END;
+        """
+    )
+    DB.execute("INSERT INTO all_equips_fts (all_equips_fts) VALUES ('rebuild')")
+
+
+def _add_equip_stats(DB: sqlite3.Connection) -> None:
+    """Numeric equip stats (eg "Holy EDB 73%" -> ("Holy EDB", 73.0)), one row per stat
+
+    The scrapers parse and insert these along with the equips (see parse_stats).
+    Triggers only remove the stats of equips that are deleted / replaced.
+    """
+
+    DB.execute(
+        """
+        CREATE TABLE IF NOT EXISTS equip_stats (
+            source      TEXT        NOT NULL,   -- 'super' | 'kedama'
+            auction     TEXT        NOT NULL,
+            equip       TEXT        NOT NULL,
+
+            stat        TEXT        NOT NULL,
+            value       REAL        NOT NULL
+        ) STRICT;
+        """
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_equip_stats_stat ON equip_stats (stat COLLATE NOCASE, value)"
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_equip_stats_equip ON equip_stats (source, auction, equip)"
+    )
+
+    for source in ["super", "kedama"]:
+        table = f"{source}_equips"
+        delete = f"""
+            DELETE FROM equip_stats
+            WHERE source = '{source}' AND auction = {{row}}.id_auction AND equip = {{row}}.id;
+        """
+
+        # As with the trigram index, a REPLACE doesn't fire delete triggers
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS equip_stats_{table}_before_insert BEFORE INSERT ON {table} BEGIN
+                {delete.format(row="NEW")}
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS equip_stats_{table}_after_delete AFTER DELETE ON {table} BEGIN
+                {delete.format(row="OLD")}
+            END;
+            """
+        )
+
+        # Backfill (super stores '{}' for equips without stats)
+        rows = DB.execute(f"SELECT id_auction, id, stats FROM {table}")
+        DB.executemany(
+            "INSERT INTO equip_stats (source, auction, equip, stat, value) VALUES (?, ?, ?, ?, ?)",
+            (
+                (source, auction, equip, stat, value)
+                for auction, equip, stats in rows
+                for stat, value in parse_stats(json.loads(stats) or [])
+            ),
+        )
+
+
+def _add_data_generation(DB: sqlite3.Connection) -> None:
+    """Counter that's bumped by any change to the exported tables
+
+    Exports are rebuilt only when it changes (see ExportCache).
+    Unlike PRAGMA data_version, it's persistent and the same for every connection / process.
+    """
+
+    DB.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_generation (
+            value       INTEGER     NOT NULL
+        ) STRICT;
+        """
+    )
+    DB.execute("INSERT INTO data_generation (value) SELECT 1 WHERE NOT EXISTS (SELECT 1 FROM data_generation)")  # fmt: skip
+
+    # Tables in the exports at the time of this migration
+    # fmt: off
+    tables = ['super_auctions', 'super_equips', 'super_mats', 'super_fails', 'kedama_auctions' ,'kedama_equips', 'kedama_mats', 'kedama_fails_item', 'lottery_weapon', 'lottery_armor']
+    # fmt: on
+
+    # Only updates to these columns count (last_fetch_time is irrelevant and updated often)
+    update_of = dict(
+        super_auctions="id, title, end_time, is_complete",
+        kedama_auctions="id, title_short, title, start_time, is_complete",
+    )
+
+    for table in tables:
+        for event in ["INSERT", "UPDATE", "DELETE"]:
+            on = event
+            if event == "UPDATE" and table in update_of:
+                on = f"UPDATE OF {update_of[table]}"
+
+            DB.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS data_generation_{table}_{event.lower()} AFTER {on} ON {table} BEGIN
+                    UPDATE data_generation SET value = value + 1;
+                END;
+                """
+            )
+
+
+def _add_change_log(DB: sqlite3.Connection) -> None:
+    """Log of the exported rows that changed, for mirrors that only want what's new
+
+    Each change to an exported row bumps data_generation and records the new value as the row's version.
+    Only the latest change to each row is kept. If the row no longer exists, it was deleted.
+    """
+
+    DB.execute(
+        """
+        CREATE TABLE IF NOT EXISTS change_log (
+            version     INTEGER     NOT NULL,   -- data_generation at the time of the change
+            tbl         TEXT        NOT NULL,
+            key         TEXT        NOT NULL,   -- json list of the row's primary key
+
+            PRIMARY KEY (version),
+            UNIQUE (tbl, key)
+        ) STRICT;
+        """
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_change_log_tbl_version ON change_log (tbl, version)"
+    )
+
+    # Tables in the exports at the time of this migration (and their primary keys)
+    keys = dict(
+        super_auctions=["id"],
+        super_equips=["id", "id_auction"],
+        super_mats=["id", "id_auction"],
+        super_fails=["id", "id_auction"],
+        kedama_auctions=["id"],
+        kedama_equips=["id", "id_auction"],
+        kedama_mats=["id", "id_auction"],
+        kedama_fails_item=["id", "id_auction"],
+        lottery_weapon=["id"],
+        lottery_armor=["id"],
+    )
+    for table, cols in keys.items():
+        old = _log_change(table, cols, "OLD")
+        new = _log_change(table, cols, "NEW")
+
+        # Replaces the triggers that only bumped the generation
+        for event, body in [("INSERT", new), ("UPDATE", old + new), ("DELETE", old)]:
+            DB.execute(
+                f"DROP TRIGGER IF EXISTS data_generation_{table}_{event.lower()}"
+            )
+            DB.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS change_log_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+                    {body}
+                END;
+                """
+            )
+
+        # Backfill, so that changes since version 0 are the whole table
+        DB.execute(
+            f"""
+            INSERT INTO change_log (version, tbl, key)
+            SELECT (SELECT value FROM data_generation) + row_number() OVER (), '{table}', json_array({", ".join(cols)})
+            FROM {table}
+            """
+        )
+        DB.execute(
+            "UPDATE data_generation SET value = (SELECT MAX(version) FROM change_log) WHERE EXISTS (SELECT 1 FROM change_log)"
+        )
+
+
+def _log_change(table: str, key_cols: list[str], row: str) -> str:
+    """Trigger body that records a change to the OLD / NEW row in change_log"""
+
+    return f"""
+        UPDATE data_generation SET value = value + 1;
+        INSERT OR REPLACE INTO change_log (version, tbl, key)
+        SELECT value, '{table}', json_array({", ".join(f"{row}.{c}" for c in key_cols)}) FROM data_generation;
+    """
+
+
+def _add_lottery_results(DB: sqlite3.Connection) -> None:
+    """Lottery winners, one row per (lottery, place) instead of six user / prize columns per lottery
+
+    Searching by user is then one index lookup instead of an OR across the user columns.
+    As with equip_stats, the scraper inserts these along with the lottery (see parse_lottery_prizes)
+    and triggers only remove the results of lotteries that are deleted / replaced.
+    """
+
+    DB.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lottery_results (
+            type        TEXT        NOT NULL,   -- 'weapon' | 'armor'
+            lottery_id  INTEGER     NOT NULL,
+            place       TEXT        NOT NULL,   -- '1' | '1b' | '2' | ... | '5'
+
+            user        TEXT        NOT NULL,
+            prize_qty   INTEGER     NOT NULL,
+            prize_name  TEXT,                   -- NULL if the equip is no longer available
+
+            PRIMARY KEY (type, lottery_id, place)
+        ) STRICT;
+        """
+    )
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_lottery_results_user ON lottery_results (user COLLATE NOCASE, type, lottery_id)"
+    )
+
+    for type in ["weapon", "armor"]:
+        table = f"lottery_{type}"
+        delete = f"""
+            DELETE FROM lottery_results WHERE type = '{type}' AND lottery_id = {{row}}.id;
+        """
+
+        # A REPLACE doesn't fire delete triggers
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS lottery_results_{table}_before_insert BEFORE INSERT ON {table} BEGIN
+                {delete.format(row="NEW")}
+            END;
+            """
+        )
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS lottery_results_{table}_after_delete AFTER DELETE ON {table} BEGIN
+                {delete.format(row="OLD")}
+            END;
+            """
+        )
+
+        # For date filters and sorting (the id is implicitly part of the index)
+        DB.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_date ON {table} (date)")
+
+        # Backfill
+        rows = DB.execute(f"SELECT * FROM {table}")
+        DB.executemany(
+            "INSERT INTO lottery_results (type, lottery_id, place, user, prize_qty, prize_name) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (type, row["id"], *result)
+                for row in rows
+                for result in parse_lottery_prizes(row)
+            ),
+        )
+
+
+def _add_price_rollups(DB: sqlite3.Connection) -> None:
+    """Sold prices per (equip name, month), for /equips/price_stats
+
+    Names are compared case-insensitively (lower(name)). Only equips from completed auctions with a price are counted.
+    Each group stores its sorted prices, so percentiles over several groups are still exact.
+
+    Triggers on all_equips only mark the groups that changed, refresh_price_rollups() then recomputes them.
+    """
+
+    DB.execute(
+        """
+        CREATE TABLE IF NOT EXISTS equip_price_rollups (
+            name        TEXT        NOT NULL,   -- lower(name)
+            month       TEXT        NOT NULL,   -- YYYY-MM (utc) of the auction time
+
+            count       INTEGER     NOT NULL,
+            min         INTEGER     NOT NULL,
+            max         INTEGER     NOT NULL,
+            prices      TEXT        NOT NULL,   -- json list, sorted
+
+            PRIMARY KEY (name, month)
+        ) STRICT;
+        """
+    )
+    DB.execute(
+        """
+        CREATE TABLE IF NOT EXISTS equip_price_rollups_dirty (
+            name        TEXT        NOT NULL,
+            month       TEXT        NOT NULL,
+
+            PRIMARY KEY (name, month)
+        ) STRICT, WITHOUT ROWID;
+        """
+    )
+
+    # For refresh_price_rollups (a month is a range of auction times)
+    DB.execute(
+        "CREATE INDEX IF NOT EXISTS idx_all_equips_lower_name ON all_equips (lower(name), auction_time)"
+    )
+
+    # all_equips rows are always deleted then re-inserted (never updated)
+    for event, row in [("INSERT", "NEW"), ("DELETE", "OLD")]:
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS equip_price_rollups_all_equips_{event.lower()} AFTER {event} ON all_equips
+            WHEN {row}.price IS NOT NULL AND {row}.auction_is_complete = 1 BEGIN
+                INSERT OR IGNORE INTO equip_price_rollups_dirty (name, month)
+                VALUES (lower({row}.name), strftime('%Y-%m', {row}.auction_time, 'unixepoch'));
+            END;
+            """
+        )
+
+    # Backfill
+    DB.execute(
+        """
+        INSERT OR IGNORE INTO equip_price_rollups_dirty (name, month)
+        SELECT lower(name), strftime('%Y-%m', auction_time, 'unixepoch') FROM all_equips
+        WHERE price IS NOT NULL AND auction_is_complete = 1
+        """
+    )
+    refresh_price_rollups(DB)
+
+
+def _ignore_fetch_times(DB: sqlite3.Connection) -> None:
+    """Don't log changes to the auctions' last_fetch_time
+
+    It's set each time an auction is fetched, which logged the auction as changed (see _add_change_log)
+    and so bumped data_generation, making mirrors re-download it and the exports rebuild.
+    Now only updates that change one of the other columns are logged.
+    """
+
+    for table, cols in [
+        ("super_auctions", ["id", "title", "end_time", "is_complete"]),
+        (
+            "kedama_auctions",
+            ["id", "title_short", "title", "start_time", "is_complete"],
+        ),
+    ]:
+        changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in cols)
+        DB.execute(f"DROP TRIGGER IF EXISTS change_log_{table}_update")
+        DB.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS change_log_{table}_update
+            AFTER UPDATE OF {", ".join(cols)} ON {table} WHEN {changed} BEGIN
+                {_log_change(table, ["id"], "OLD")}
+                {_log_change(table, ["id"], "NEW")}
+            END;
+            """
+        )
+
+
+# Append-only. The index of each migration (+1) is its schema version.
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _add_search_indexes,
+    _add_equip_fts,
+    _add_all_equips,
+    _add_equip_stats,
+    _add_data_generation,
+    _add_change_log,
+    _add_lottery_results,
+    _add_price_rollups,
+    _ignore_fetch_times,
+]
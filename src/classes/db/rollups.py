@@ -0,0 +1,39 @@
+import json
+import sqlite3
+
+
+def refresh_price_rollups(DB: sqlite3.Connection) -> None:
+    """Recompute the price rollups of the (name, month) groups that changed since the last refresh
+
+    Changes to all_equips mark their group in equip_price_rollups_dirty (see _add_price_rollups),
+    so this only reads the equips of those groups. The scrapers call it after each auction.
+    """
+
+    dirty = DB.execute("SELECT name, month FROM equip_price_rollups_dirty").fetchall()
+    for name, month in dirty:
+        rows = DB.execute(
+            """
+            SELECT price FROM all_equips
+            WHERE lower(name) = ?
+                AND auction_time >= unixepoch(? || '-01') AND auction_time < unixepoch(? || '-01', '+1 month')
+                AND price IS NOT NULL AND auction_is_complete = 1
+            """,
+            (name, month, month),
+        )
+        prices = sorted(r[0] for r in rows)
+
+        if prices:
+            DB.execute(
+                """
+                INSERT OR REPLACE INTO equip_price_rollups (name, month, count, min, max, prices)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (name, month, len(prices), prices[0], prices[-1], json.dumps(prices)),
+            )
+        else:
+            DB.execute(
+                "DELETE FROM equip_price_rollups WHERE name = ? AND month = ?",
+                (name, month),
+            )
+
+    DB.execute("DELETE FROM equip_price_rollups_dirty")
@@ -1,17 +1,7 @@
 import sqlite3
 
-from config import paths
-
-
-def get_db() -> sqlite3.Connection:
-    DB = sqlite3.connect(paths.DATA_DIR / "db.sqlite")
-    DB.row_factory = sqlite3.Row
-    return DB
-
-
-def create_tables():
-    DB = get_db()
 
+def create_tables(DB: sqlite3.Connection):
     # Super
     with DB:
         DB.execute(
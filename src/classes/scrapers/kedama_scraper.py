@@ -7,12 +7,12 @@ from typing import Any, Literal, Optional, Type
 
 from aiohttp import ClientSession
 from bs4 import BeautifulSoup, Tag
-from classes.db import DB
+from classes.db import DB, refresh_price_rollups
 from config import logger, paths
 from utils.http import create_session, do_get, do_post
 from utils.json_cache import JsonCache
 from utils.misc import load_toml, split_lst
-from utils.parse import parse_equip_link, parse_post_date, price_to_int
+from utils.parse import parse_equip_link, parse_post_date, parse_stats, price_to_int
 from utils.rate_limit import rate_limit
 from yarl import URL
 
@@ -112,6 +112,15 @@ class KedamaScraper:
                     data["equips"],
                 )
 
+                DB.executemany(
+                    """
+                    INSERT INTO equip_stats
+                    (source, auction, equip, stat, value)
+                    VALUES ('kedama', :auction, :equip, :stat, :value)
+                    """,
+                    data["stats"],
+                )
+
                 DB.executemany(
                     """
                     INSERT INTO kedama_fails_item
@@ -121,6 +130,9 @@ class KedamaScraper:
                     data["fails"],
                 )
 
+                # Includes the groups of the purged equips
+                refresh_price_rollups(DB)
+
         async def fetch(url: URL) -> BeautifulSoup:
             """Fetch auction thread"""
             key = str(url)
@@ -134,7 +146,8 @@ class KedamaScraper:
                 # Update db
                 with DB:
                     DB.execute(
-                        "UPDATE kedama_auctions SET last_fetch_time = ?", (time.time(),)
+                        "UPDATE kedama_auctions SET last_fetch_time = ? WHERE id = ?",
+                        (time.time(), url.query["showtopic"]),
                     )
 
             html = cls.html_cache[key]
@@ -214,6 +227,7 @@ class KedamaScraper:
         Returns a dict with the following keys:
             mats:       list[dict] with keys matching DB table
             equips:     list[dict] with keys matching DB table
+            stats:      list[dict] with keys matching DB table (equip_stats), for the equips
             fails:      dict with the following keys: [id, id_auction, summary]
         """
 
@@ -245,7 +259,9 @@ class KedamaScraper:
             for post in item_posts:
                 rows.extend(post.content)
 
-            item_data: dict[str, list[dict]] = dict(mats=[], equips=[], fails=[])
+            item_data: dict[str, list[dict]] = dict(
+                mats=[], equips=[], stats=[], fails=[]
+            )
             for r in rows:
                 text = "".join(str(x) for x in r).strip()
                 if m := ITEM_CODE_PATT.match(text):
@@ -275,6 +291,18 @@ class KedamaScraper:
                             )
                         )
 
+            # Parse the numeric stats of each equip
+            for equip in item_data["equips"]:
+                for stat, value in parse_stats(json.loads(equip["stats"])):
+                    item_data["stats"].append(
+                        dict(
+                            equip=equip["id"],
+                            auction=auction_id,
+                            stat=stat,
+                            value=value,
+                        )
+                    )
+
             return item_data
 
         def parse_row(auction_id: str, line: list[_StrWithHref]) -> tuple[dict, bool]:
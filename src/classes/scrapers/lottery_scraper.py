@@ -13,6 +13,7 @@ from utils.http import create_session, do_get
 from utils.json_cache import JsonCache
 from utils.rate_limit import rate_limit
 from utils.misc import load_toml
+from utils.parse import parse_lottery_prizes
 
 logger = logger.bind(tags=["lottery"])
 
@@ -88,6 +89,16 @@ class LotteryScraper:
                                 """,
                                 data,
                             )
+                            DB.executemany(
+                                f"""
+                                INSERT INTO lottery_results (type, lottery_id, place, user, prize_qty, prize_name)
+                                VALUES ('{type}', ?, ?, ?, ?, ?)
+                                """,
+                                [
+                                    (index, *result)
+                                    for result in parse_lottery_prizes(data)
+                                ],
+                            )
             finally:
                 await session.close()
 
@@ -6,11 +6,11 @@ from datetime import datetime
 
 import bs4
 from bs4 import BeautifulSoup, Tag
-from classes.db import DB
+from classes.db import DB, refresh_price_rollups
 from config import logger, paths
 from utils.http import do_get
 from utils.json_cache import JsonCache
-from utils.parse import parse_equip_link, price_to_int
+from utils.parse import parse_equip_link, parse_stats, price_to_int
 from utils.rate_limit import rate_limit
 from yarl import URL
 
@@ -198,6 +198,18 @@ class SuperScraper:
                             """,
                             item,
                         )
+                        DB.executemany(
+                            """
+                            INSERT INTO equip_stats
+                            (source, auction, equip, stat, value) VALUES ('super', ?, ?, ?, ?)
+                            """,
+                            [
+                                (item["id_auction"], item["id"], stat, value)
+                                for stat, value in parse_stats(
+                                    json.loads(item["stats"]) or []
+                                )
+                            ],
+                        )
                     else:
                         DB.execute(
                             """
@@ -222,6 +234,10 @@ class SuperScraper:
                         (is_complete, auction_id),
                     )
 
+            # Prices only count once the auction is complete
+            with DB:
+                refresh_price_rollups(DB)
+
         async def fetch(id: str, allow_cached=False) -> BeautifulSoup:
             path = f"itemlist{id}"
 
@@ -237,8 +253,9 @@ class SuperScraper:
                         """
                         UPDATE super_auctions SET
                             last_fetch_time = ?
+                        WHERE id = ?
                         """,
-                        (time.time(),),
+                        (time.time(), id),
                     )
 
             html = cls.html_cache[path]
@@ -9,11 +9,15 @@ DATA_DIR = SRC_DIR / "data"
 CACHE_DIR = DATA_DIR / "cache"
 LOG_DIR = DATA_DIR / "logs"
 PERMS_DIR = DATA_DIR / "perms"
+EXPORT_DIR = DATA_DIR / "exports"
+
+DB_FILE = DATA_DIR / "db.sqlite"
 
 SECRETS_FILE = CONFIG_DIR / "secrets.toml"
 DISCORD_CONFIG = CONFIG_DIR / "discord_config.toml"
+SERVER_CONFIG = CONFIG_DIR / "server_config.toml"  # optional
 
-for dir in [CONFIG_DIR, DATA_DIR, CACHE_DIR, LOG_DIR, PERMS_DIR]:
+for dir in [CONFIG_DIR, DATA_DIR, CACHE_DIR, LOG_DIR, PERMS_DIR, EXPORT_DIR]:
     if not dir.exists():
         dir.mkdir(parents=True, exist_ok=True)
 
@@ -1,6 +1,56 @@
-if __name__ == "__main__":
-    import uvicorn
+"""Start the API server
+
+By default this runs the number of worker processes set in server_config.toml (see server_config_example.toml).
+Each worker is warmed up (see server.warm_up) before it's sent requests.
+While it's running, signals to this (parent) process manage the workers:
+    SIGHUP: replace the workers one at a time, eg after an update
+    SIGTTIN / SIGTTOU: add / remove a worker
+    SIGINT / SIGTERM: stop, after the requests in progress finish
+
+For development, --reload runs a single process that restarts when the code changes.
+"""
+
+import argparse
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from classes.core.server.settings import SETTINGS
+
+APP = "classes.core.server.server:server"
+
+# Seconds that a new worker can take to warm up
+#   (during a restart, the old worker is only stopped after its replacement is ready)
+WORKER_STARTUP_TIMEOUT = 120
 
-    uvicorn.run(
-        "classes.core.server.server:server", host="0.0.0.0", port=4545, reload=True
+# Seconds that requests in progress have to finish when stopping
+SHUTDOWN_TIMEOUT = 30
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=4545)
+    parser.add_argument("--workers", type=int, default=SETTINGS.workers)
+    parser.add_argument("--reload", action="store_true")
+    args = parser.parse_args()
+
+    if args.reload:
+        uvicorn.run(APP, host=args.host, port=args.port, reload=True)
+        return
+
+    config = uvicorn.Config(
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_worker_healthcheck=WORKER_STARTUP_TIMEOUT,
+        timeout_graceful_shutdown=SHUTDOWN_TIMEOUT,
     )
+
+    # Supervised even with one worker (unlike uvicorn.run), so that it can be restarted the same way
+    Multiprocess(config, sockets=[config.bind_socket()]).run()
+
+
+if __name__ == "__main__":
+    main()
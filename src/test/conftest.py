@@ -0,0 +1,108 @@
+from typing import Any
+
+import orjson
+import pytest
+from fastapi import Response
+
+from classes.db import ConnectionManager, create_tables, migrate
+
+NAMES = [
+    "Legendary Oak Staff of Heimdall",
+    "Peerless Ethereal Shade Breastplate of the Shadowdancer",
+    'Rusty "Quoted" Axe',
+    "100% Ethereal Rapier",
+    "Under_Score Katana",
+]
+USERS = ["Amy", "앤 마이어", "ÉLÉONORE", "sickentide", None]
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """Empty, fully migrated db"""
+
+    manager = ConnectionManager(tmp_path / "db.sqlite")
+    create_tables(manager.writer)
+    migrate(manager.writer)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def populated(manager: ConnectionManager):
+    """An equip for each of NAMES and USERS, in super and kedama"""
+
+    with manager.writer as DB:
+        DB.execute(
+            "INSERT INTO super_auctions (id, title, end_time, is_complete) VALUES ('1', '1', 0, 1)"
+        )
+        DB.execute(
+            "INSERT INTO kedama_auctions (id, title_short, title, start_time) VALUES ('1', '1', '1', 0)"
+        )
+
+        for idx, name in enumerate(NAMES):
+            for jdx, user in enumerate(USERS):
+                row = dict(
+                    id=f"Eq{idx}{jdx}",
+                    name=name,
+                    buyer=user,
+                    seller=USERS[-jdx - 1] or "Amy",
+                )
+                DB.execute(
+                    """
+                    INSERT INTO super_equips (id, id_auction, name, eid, key, is_isekai, stats, next_bid, buyer, seller)
+                    VALUES (:id, '1', :name, 0, '', 0, '[]', 0, :buyer, :seller)
+                    """,
+                    row,
+                )
+                DB.execute(
+                    """
+                    INSERT INTO kedama_equips (id, id_auction, name, eid, key, is_isekai, stats, buyer, seller)
+                    VALUES (:id, '1', :name, 0, '', 0, '[]', :buyer, :seller)
+                    """,
+                    row,
+                )
+
+    return manager
+
+
+@pytest.fixture
+def priced(populated):
+    """populated, with a second auction and some duplicate / null prices"""
+
+    with populated.writer as DB:
+        DB.execute(
+            "INSERT INTO super_auctions (id, title, end_time, is_complete) VALUES ('2', '2', 10, 1)"
+        )
+        DB.execute(
+            "INSERT INTO kedama_auctions (id, title_short, title, start_time) VALUES ('2', '2', '2', 10)"
+        )
+        for table in ["super_equips", "kedama_equips"]:
+            # Duplicate and null prices / dates to check the tie-breaking
+            DB.execute(
+                f"UPDATE {table} SET price = IIF(rowid % 4 = 0, NULL, rowid % 3)"
+            )
+            DB.execute(f"UPDATE {table} SET id_auction = '2' WHERE rowid % 2 = 0")
+
+    return populated
+
+
+def search(endpoint, DB, **params) -> Any:
+    """Run a search and parse its response"""
+
+    result = endpoint(**params, DB=DB)
+    if isinstance(result, Response):
+        return orjson.loads(result.body)
+    return result  # eg a count
+
+
+def walk_pages(endpoint, DB, **params) -> list:
+    """Fetch every page of a search"""
+
+    items = []
+    cursor = None
+    while True:
+        response = endpoint(**params, cursor=cursor, DB=DB)
+        items.extend(orjson.loads(response.body))
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return items
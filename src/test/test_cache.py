@@ -0,0 +1,198 @@
+import asyncio
+
+import pytest
+from starlette.types import Receive, Scope, Send
+
+from classes.core.server.cache import ResultCache, normalize_query
+from classes.core.server.middleware import ResponseCache
+from classes.db import ConnectionManager
+
+
+@pytest.fixture
+def cache(manager: ConnectionManager):
+    return ResultCache(manager.fp)
+
+
+def write(manager: ConnectionManager):
+    with manager.writer as DB:
+        DB.execute(
+            "INSERT INTO super_auctions (id, title, end_time) VALUES (?, '1', 0)",
+            (str(DB.execute("SELECT COUNT(*) FROM super_auctions").fetchone()[0]),),
+        )
+
+
+def test_normalize_query():
+    same = [
+        "name=leg,oak&min_price=10",
+        "min_price=10&name=oak,leg",
+        "name=Oak, LEG&min_price=10&stream=true",
+        "name=x&name=oak,leg&min_price=10",
+    ]
+    assert len({normalize_query(q) for q in same}) == 1
+
+    different = [
+        "name=leg,oak",
+        "name=leg,oak,",
+        "name=leg",
+        "buyer=éléo",
+        "buyer=ÉLÉO",
+        "buyer_partial=leg,oak",
+        "name=leg,oak&count=true",
+        "fields=name",
+        "fields=Name",
+    ]
+    assert len({normalize_query(q) for q in different}) == len(different)
+
+    assert normalize_query("fields=name,price") == normalize_query("fields=price, name")
+
+
+def test_cache_follows_db(manager: ConnectionManager, cache: ResultCache):
+    version = cache.version()
+    cache.put("a", version, None, b"1")
+    assert cache.get("a", cache.version()) == (None, b"1")
+
+    # Any commit from another connection empties the cache
+    write(manager)
+    assert cache.get("a", cache.version()) is None
+
+    # Responses built before the change aren't kept
+    cache.put("a", version, None, b"1")
+    assert cache.get("a", cache.version()) is None
+
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_cache_is_lru(cache: ResultCache):
+    cache.MAX_SIZE = 10
+    cache.MAX_ENTRY_SIZE = 5
+    version = cache.version()
+
+    for key in "abc":
+        cache.put(key, version, None, b"1234")
+    cache.get("b", version)
+    cache.put("d", version, None, b"1234")
+    cache.put("e", version, None, b"123456")
+
+    assert [k for k in "abcde" if cache.get(k, version)] == ["b", "d"]
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["skips"] == 1
+    assert cache.stats()["size"] == 8
+
+
+def get(app, query: str = "", accept: str = "") -> tuple[int, dict, bytes]:
+    return asyncio.run(request(app, query, accept))
+
+
+async def request(app, query: str = "", accept: str = "") -> tuple[int, dict, bytes]:
+    messages = []
+
+    async def receive():
+        return dict(type="http.request", body=b"", more_body=False)
+
+    async def send(message):
+        messages.append(message)
+
+    headers = [(b"accept", accept.encode())] if accept else []
+    scope = dict(type="http", method="GET", path="/search", query_string=query.encode(), headers=headers)  # fmt: skip
+    await app(scope, receive, send)
+
+    start = messages[0]
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+class Endpoint:
+    """Streams its call count"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.calls += 1
+        status = 400 if b"bad" in scope["query_string"] else 200
+        headers = [(b"content-type", b"application/json"), (b"x-next-cursor", b"c")]
+        await send(dict(type="http.response.start", status=status, headers=headers))
+        for chunk in [b"[", str(self.calls).encode(), b"]"]:
+            await send(dict(type="http.response.body", body=chunk, more_body=True))
+        await send(dict(type="http.response.body", body=b"", more_body=False))
+
+
+@pytest.fixture
+def app(monkeypatch, cache: ResultCache):
+    monkeypatch.setattr(ResponseCache, "endpoints", ["/search"])
+    monkeypatch.setattr(ResponseCache, "cache", cache)
+
+    endpoint = Endpoint()
+    return endpoint, ResponseCache(endpoint)
+
+
+def test_middleware_caches(manager: ConnectionManager, app):
+    endpoint, middleware = app
+
+    assert get(middleware, "name=oak") == (200, {b"content-type": b"application/json", b"x-next-cursor": b"c"}, b"[1]")  # fmt: skip
+    status, headers, body = get(middleware, "name=OAK&stream=true")
+    assert (status, body) == (200, b"[1]")
+    assert headers[b"x-cache"] == b"hit"
+    assert headers[b"x-next-cursor"] == b"c"
+    assert headers[b"content-length"] == b"3"
+
+    assert get(middleware, "name=leg")[2] == b"[2]"
+    assert get(middleware, "name=leg")[2] == b"[2]"
+
+    write(manager)
+    assert get(middleware, "name=oak")[2] == b"[3]"
+    assert endpoint.calls == 3
+
+    # Responses in another encoding
+    assert get(middleware, "name=oak", "application/msgpack")[2] == b"[4]"
+    assert get(middleware, "name=oak", "application/msgpack")[2] == b"[4]"
+    assert get(middleware, "name=oak", "application/json")[2] == b"[3]"
+    assert endpoint.calls == 4
+
+
+def test_middleware_skips(cache: ResultCache, app):
+    endpoint, middleware = app
+
+    # Errors
+    assert get(middleware, "bad")[0] == 400
+    assert get(middleware, "bad")[0] == 400
+
+    # Large responses
+    cache.MAX_ENTRY_SIZE = 2
+    assert get(middleware, "name=oak")[2] == b"[3]"
+    assert get(middleware, "name=oak")[2] == b"[4]"
+
+    assert endpoint.calls == 4
+    assert cache.stats()["skips"] == 4
+
+
+def test_middleware_coalesces(cache: ResultCache, app):
+    endpoint, middleware = app
+    cache.MAX_ENTRY_SIZE = 2  # not needed to share a response
+
+    async def run(queries: list[str]) -> list[tuple[int, dict, bytes]]:
+        # Hold the first requests until the rest arrive
+        release = asyncio.Event()
+
+        async def slow_endpoint(scope: Scope, receive: Receive, send: Send):
+            await release.wait()
+            await endpoint(scope, receive, send)
+
+        middleware.app = slow_endpoint
+        tasks = [asyncio.create_task(request(middleware, q)) for q in queries]
+        await asyncio.sleep(0.01)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run(["name=oak", "name=OAK", "name=leg", "name=oak&stream=true"]))  # fmt: skip
+    assert [r[2] for r in results] == [b"[1]", b"[1]", b"[2]", b"[1]"]
+    assert [r[1].get(b"x-cache") for r in results] == [None, b"coalesced", None, b"coalesced"]  # fmt: skip
+    assert endpoint.calls == 2
+    assert cache.stats()["coalesced"] == 2
+
+    # Errors aren't shared
+    results = asyncio.run(run(["bad", "bad"]))
+    assert [r[0] for r in results] == [400, 400]
+    assert endpoint.calls == 4
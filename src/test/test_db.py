@@ -0,0 +1,122 @@
+import sqlite3
+import time
+
+import pytest
+
+from classes.db import (
+    STATEMENT_STATS,
+    ConnectionManager,
+    SqlBudgetExceeded,
+    migrate,
+    sql_budget,
+)
+from classes.db import connection
+from classes.db.migrations import MIGRATIONS, get_version
+
+
+def test_writer_uses_wal(manager: ConnectionManager):
+    mode = manager.writer.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_readers_are_read_only(manager: ConnectionManager):
+    with manager.reader() as DB:
+        with pytest.raises(sqlite3.OperationalError):
+            DB.execute("DELETE FROM super_equips")
+
+
+def test_readers_are_reused(manager: ConnectionManager):
+    with manager.reader() as first:
+        pass
+    with manager.reader() as second:
+        pass
+    assert first is second
+
+    # Concurrent borrowers get different connections
+    with manager.reader() as first:
+        with manager.reader() as second:
+            assert first is not second
+
+
+def test_statement_stats(manager: ConnectionManager, monkeypatch):
+    monkeypatch.setattr(ConnectionManager, "CACHED_STATEMENTS", 2)
+    queries = ["SELECT 1", "SELECT 2", "SELECT 1", "SELECT 3", "SELECT 2", "SELECT 2"]
+
+    with manager.reader() as DB:
+        before = STATEMENT_STATS.stats()
+        for query in queries:
+            DB.execute(query)
+        after = STATEMENT_STATS.stats()
+
+    # "SELECT 2" was the least recently used when "SELECT 3" was added
+    assert after["hits"] - before["hits"] == 2
+    assert after["misses"] - before["misses"] == 4
+
+
+COUNT_QUERY = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n LIMIT 1000000) SELECT COUNT(*) FROM n"  # fmt: skip
+
+
+def test_sql_budget(manager: ConnectionManager):
+    with manager.reader() as DB:
+        with pytest.raises(SqlBudgetExceeded):
+            with sql_budget(DB, 0.001):
+                DB.execute(COUNT_QUERY).fetchone()
+
+        # Other errors pass through
+        with pytest.raises(sqlite3.OperationalError):
+            with sql_budget(DB, 10):
+                DB.execute("SELECT * FROM nothing")
+
+        # And the budget only applies inside of it
+        with sql_budget(DB, None):
+            assert DB.execute(COUNT_QUERY).fetchone()[0] == 1_000_000
+        assert DB.execute(COUNT_QUERY).fetchone()[0] == 1_000_000
+
+
+def test_sql_budget_slow_consumer(manager: ConnectionManager):
+    # Only the time spent in sqlite counts, not the time between rows
+    with manager.reader() as DB:
+        with sql_budget(DB, 0.05):
+            rows = DB.execute("WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n LIMIT 10) SELECT x FROM n")  # fmt: skip
+            values = []
+            for r in rows:
+                time.sleep(0.01)
+                values.append(r[0])
+        assert values == list(range(1, 11))
+
+        # And the budget is cleared afterwards
+        assert DB.budget is None
+
+
+def test_get_db_budget(manager: ConnectionManager, monkeypatch):
+    monkeypatch.setattr(connection, "DB_MANAGER", manager)
+    monkeypatch.setattr(manager, "request_budget", 0.001)
+
+    # What FastAPI does with an error raised by the endpoint
+    dependency = connection.get_db()
+    DB = next(dependency)
+    with pytest.raises(SqlBudgetExceeded) as e:
+        DB.execute(COUNT_QUERY).fetchone()
+    with pytest.raises(SqlBudgetExceeded):
+        dependency.throw(e.value)
+
+
+def test_readers_see_writes(manager: ConnectionManager):
+    with manager.reader() as DB:
+        assert DB.execute("SELECT COUNT(*) FROM super_auctions").fetchone()[0] == 0
+
+    with manager.writer as DB:
+        DB.execute(
+            "INSERT INTO super_auctions (id, title, end_time) VALUES ('1', '1', 0)"
+        )
+
+    with manager.reader() as DB:
+        assert DB.execute("SELECT COUNT(*) FROM super_auctions").fetchone()[0] == 1
+
+
+def test_migrations_are_applied_once(manager: ConnectionManager):
+    assert get_version(manager.writer) == len(MIGRATIONS)
+
+    # Re-running is a no-op
+    migrate(manager.writer)
+    assert get_version(manager.writer) == len(MIGRATIONS)
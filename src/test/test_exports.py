@@ -0,0 +1,362 @@
+import asyncio
+import gc
+import gzip
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+import pytest
+from fastapi import Request
+
+from classes.core.server.exports import EXPORTED_TABLES, ExportCache, iter_changes
+from classes.db import ConnectionManager
+from tools.mirror import apply_changes, get_version
+
+
+@pytest.fixture
+def exports(manager: ConnectionManager, tmp_path):
+    with manager.writer as DB:
+        for idx in range(3):
+            DB.execute(
+                "INSERT INTO super_auctions (id, title, end_time) VALUES (?, ?, 0)",
+                (str(idx), f"'quoted' {idx}"),
+            )
+        DB.execute(
+            """
+            INSERT INTO super_equips (id, id_auction, name, eid, key, is_isekai, stats, next_bid, buyer, seller)
+            VALUES ('Eq1', '1', 'Legendary Oak Staff', 0, '', 0, '["EDB 50%"]', 0, NULL, '앤 마이어')
+            """
+        )
+
+    dir = tmp_path / "exports"
+    dir.mkdir()
+    return ExportCache(manager.fp, dir)
+
+
+def test_sqlite_export(manager: ConnectionManager, exports: ExportCache):
+    with manager.reader() as DB:
+        _, fp = exports.get(DB, "sqlite")
+
+    script = fp.read_text()
+    assert gzip.decompress((fp.parent / (fp.name + ".gz")).read_bytes()).decode() == script  # fmt: skip
+
+    # Only the exported tables are restored, with the same rows
+    restored = sqlite3.connect(":memory:")
+    restored.executescript(script)
+    tables = restored.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    assert sorted(r[0] for r in tables) == sorted(EXPORTED_TABLES)
+
+    with manager.reader() as DB:
+        for tbl in EXPORTED_TABLES:
+            expected = DB.execute(f"SELECT * FROM {tbl}").fetchall()
+            result = restored.execute(f"SELECT * FROM {tbl}").fetchall()
+            assert result == [tuple(r) for r in expected]
+
+
+def test_sqlite_file_export(manager: ConnectionManager, exports: ExportCache):
+    with manager.reader() as DB:
+        _, fp = exports.get(DB, "sqlite-file")
+        _, dump_fp = exports.get(DB, "sqlite")
+
+    # Same as the text dump, but compacted and opened directly
+    restored = sqlite3.connect(fp)
+    assert restored.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert restored.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert "\n".join(restored.iterdump()) + "\n" == dump_fp.read_text()
+
+    gz_fp = fp.parent / (fp.name + ".gz")
+    assert gzip.decompress(gz_fp.read_bytes()) == fp.read_bytes()
+
+
+def test_json_export(manager: ConnectionManager, exports: ExportCache):
+    with manager.reader() as DB:
+        _, fp = exports.get(DB, "json")
+
+        expected = {
+            tbl: [dict(r) for r in DB.execute(f"SELECT * FROM {tbl}")]
+            for tbl in EXPORTED_TABLES
+        }
+        assert orjson.loads(fp.read_bytes()) == expected
+
+
+def test_exports_follow_generation(manager: ConnectionManager, exports: ExportCache):
+    exports.KEEP = 1
+    exports.PRUNE_AFTER = 0
+
+    with manager.reader() as DB:
+        generation, fp = exports.get(DB, "sqlite")
+        assert exports.get(DB, "sqlite") == (generation, fp)
+
+    mtime = fp.stat().st_mtime_ns
+    builds = [fp]
+
+    # Changes to the non-exported tables don't matter
+    with manager.writer as DB:
+        DB.execute(
+            "INSERT INTO discord_watch_more (channel, user, pages, last_visible) VALUES (1, 1, '[]', 0)"
+        )
+    with manager.reader() as DB:
+        assert exports.get(DB, "sqlite") == (generation, fp)
+    assert fp.stat().st_mtime_ns == mtime
+
+    for sql in [
+        "INSERT INTO super_auctions (id, title, end_time) VALUES ('9', '9', 0)",
+        "UPDATE super_equips SET price = 1",
+        "DELETE FROM super_auctions WHERE id = '9'",
+    ]:
+        with manager.writer as DB:
+            DB.execute(sql)
+        with manager.reader() as DB:
+            new_generation, fp = exports.get(DB, "sqlite")
+        assert new_generation > generation
+        generation = new_generation
+        builds.append(fp)
+
+    assert sorted(exports.dir.iterdir()) == sorted(
+        [*builds[-2:], *(fp.parent / (fp.name + ".gz") for fp in builds[-2:])]
+    )
+
+
+def test_recent_builds_are_kept(manager: ConnectionManager, exports: ExportCache):
+    exports.KEEP = 0
+
+    with manager.reader() as DB:
+        _, old = exports.get(DB, "sqlite")
+    with manager.writer as DB:
+        DB.execute("UPDATE super_equips SET price = 1")
+    with manager.reader() as DB:
+        _, new = exports.get(DB, "sqlite")
+
+    # A download of the old build may still be starting
+    assert old.exists() and new.exists()
+
+    exports.PRUNE_AFTER = 0
+    with manager.writer as DB:
+        DB.execute("UPDATE super_equips SET price = 2")
+    with manager.reader() as DB:
+        _, newest = exports.get(DB, "sqlite")
+    assert sorted(exports.dir.glob("*.sql")) == [newest]
+
+
+def call(exports: ExportCache, manager: ConnectionManager, headers: dict):
+    """Serve the sqlite export, returning (status, headers, body)"""
+
+    messages = []
+
+    async def receive():
+        return dict(type="http.request", body=b"", more_body=False)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = dict(
+        type="http",
+        method="GET",
+        path="/export/sqlite",
+        asgi=dict(spec_version="2.4"),  # so it doesn't wait for a disconnect
+        headers=[(k.encode(), v.encode()) for k, v in headers.items()],
+    )
+    with manager.reader() as DB:
+        response = exports.respond(Request(scope), DB, "sqlite")
+    asyncio.run(response(scope, receive, send))
+
+    start = messages[0]
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], {k.decode(): v.decode() for k, v in start["headers"]}, body
+
+
+def test_fetch_times_dont_rebuild(manager: ConnectionManager, exports: ExportCache):
+    with manager.reader() as DB:
+        built = exports.get(DB, "sqlite")
+
+    with manager.writer as DB:
+        DB.execute("UPDATE super_auctions SET last_fetch_time = 1")
+    with manager.reader() as DB:
+        assert exports.get(DB, "sqlite") == built
+
+
+def test_export_responses(manager: ConnectionManager, exports: ExportCache):
+    status, headers, body = call(exports, manager, dict())
+    assert status == 200
+    assert "content-encoding" not in headers
+    assert body.startswith(b"BEGIN TRANSACTION;")
+    etag = headers["etag"]
+
+    # Pre-compressed
+    status, headers, gz_body = call(exports, manager, {"accept-encoding": "gzip, br"})
+    assert headers["content-encoding"] == "gzip"
+    assert headers["etag"] != etag
+    assert gzip.decompress(gz_body) == body
+
+    for accept in ["gzip;q=0.5", "*", "br, GZIP ; q=1"]:
+        assert "content-encoding" in call(exports, manager, {"accept-encoding": accept})[1]  # fmt: skip
+    for accept in ["gzip;q=0", "br", "*;q=0", "*, gzip;q=0", "identity"]:
+        status, headers, plain = call(exports, manager, {"accept-encoding": accept})
+        assert "content-encoding" not in headers
+        assert plain == body
+
+    # Ranges
+    status, headers, part = call(exports, manager, dict(range="bytes=6-16"))
+    assert status == 206
+    assert part == body[6:17]
+
+    # Conditional
+    assert call(exports, manager, {"if-none-match": etag})[0] == 304
+    assert call(exports, manager, {"if-none-match": '"x", ' + etag})[0] == 304
+    assert call(exports, manager, {"if-modified-since": headers["last-modified"]})[0] == 304  # fmt: skip
+    assert call(exports, manager, {"if-none-match": '"x"'})[0] == 200
+
+    with manager.writer as DB:
+        DB.execute("UPDATE super_equips SET price = 1")
+    assert call(exports, manager, {"if-none-match": etag})[0] == 200
+
+
+def get_changes(manager: ConnectionManager, since: int) -> list[dict]:
+    return [
+        orjson.loads(line)
+        for line in b"".join(iter_changes(manager.fp, since, chunk_size=1)).splitlines()
+    ]
+
+
+def test_changes(manager: ConnectionManager, exports: ExportCache):
+    with manager.reader() as DB:
+        generation = DB.execute("SELECT value FROM data_generation").fetchone()[0]
+
+    # Everything
+    changes = get_changes(manager, 0)
+    assert changes[-1] == dict(version=generation)
+    assert len(changes) == 4 + 1
+    assert all(x["op"] == "upsert" for x in changes[:-1])
+
+    # Nothing
+    assert get_changes(manager, generation) == [dict(version=generation)]
+
+    with manager.writer as DB:
+        DB.execute("UPDATE super_auctions SET is_complete = 1 WHERE id = '0'")
+        DB.execute("UPDATE super_auctions SET is_complete = 0 WHERE id = '0'")
+        DB.execute("UPDATE super_auctions SET id = '5' WHERE id = '2'")
+        DB.execute("DELETE FROM super_equips")
+
+    changes = get_changes(manager, generation)
+    assert changes[-1]["version"] > generation
+    assert sorted(changes[:-1], key=str) == sorted(
+        [
+            dict(table="super_auctions", op="upsert", row=dict(id="0", title="'quoted' 0", end_time=0.0, is_complete=0.0, last_fetch_time=None)),
+            dict(table="super_auctions", op="delete", key=dict(id="2")),
+            dict(table="super_auctions", op="upsert", row=dict(id="5", title="'quoted' 2", end_time=0.0, is_complete=None, last_fetch_time=None)),
+            dict(table="super_equips", op="delete", key=dict(id="Eq1", id_auction="1")),
+        ],
+        key=str,
+    )  # fmt: skip
+
+
+def test_fetch_times_are_not_changes(manager: ConnectionManager, exports: ExportCache):
+    with manager.writer as DB:
+        DB.execute(
+            "INSERT INTO kedama_auctions (id, title_short, title, start_time) VALUES ('1', '1', '1', 0)"
+        )
+    with manager.reader() as DB:
+        generation = DB.execute("SELECT value FROM data_generation").fetchone()[0]
+
+    # Updates that don't change anything but last_fetch_time
+    for sql in [
+        "UPDATE super_auctions SET last_fetch_time = 1",
+        "UPDATE kedama_auctions SET last_fetch_time = 1",
+        "UPDATE super_auctions SET is_complete = is_complete, last_fetch_time = 2",
+    ]:
+        with manager.writer as DB:
+            DB.execute(sql)
+    assert get_changes(manager, generation) == [dict(version=generation)]
+
+    with manager.writer as DB:
+        DB.execute("UPDATE super_auctions SET is_complete = 1, last_fetch_time = 3 WHERE id = '1'")  # fmt: skip
+        DB.execute("UPDATE kedama_auctions SET title = '2'")
+    changes = get_changes(manager, generation)
+    assert changes[-1]["version"] > generation
+    assert [(x["table"], x["row"]["id"]) for x in changes[:-1]] == [
+        ("super_auctions", "1"),
+        ("kedama_auctions", "1"),
+    ]
+
+
+def test_abandoned_changes(manager: ConnectionManager, exports: ExportCache):
+    # eg a client that disconnects partway, leaving the stream to be closed later (from another thread)
+    for close in [lambda x: x.close(), lambda x: gc.collect()]:
+        changes = iter_changes(manager.fp, 0, chunk_size=1)
+        with ThreadPoolExecutor(1) as pool:
+            pool.submit(next, changes).result()
+        close(changes)
+        del changes
+
+    # Writes aren't held up by it
+    with manager.writer as DB:
+        DB.execute("UPDATE super_equips SET price = 1")
+    assert get_changes(manager, 0)[-1]["version"] > 0
+
+
+def test_mirror(manager: ConnectionManager, exports: ExportCache, tmp_path):
+    def dump(DB: sqlite3.Connection) -> dict:
+        return {
+            tbl: sorted(tuple(r) for r in DB.execute(f"SELECT * FROM {tbl}"))
+            for tbl in EXPORTED_TABLES
+        }
+
+    with manager.reader() as DB:
+        generation, fp = exports.get(DB, "sqlite-file")
+
+    shutil.copy(fp, tmp_path / "mirror.sqlite")
+    mirror = sqlite3.connect(tmp_path / "mirror.sqlite")
+    assert get_version(mirror) is None
+    with mirror:
+        mirror.execute("INSERT INTO mirror_version (version) VALUES (?)", (generation,))
+
+    for sql in [
+        "INSERT INTO super_auctions (id, title, end_time) VALUES ('9', '9', 0)",
+        "UPDATE super_equips SET price = 1, id_auction = '9'",
+        "INSERT INTO lottery_weapon (id, date, tickets, \"1_user\", \"1b_prize\", \"2_prize\", \"2_user\", \"3_prize\", \"3_user\", \"4_prize\", \"4_user\", \"5_prize\", \"5_user\") VALUES (1, 0, 0, '', '', '', '', '', '', '', '', '', '')",
+        "DELETE FROM super_auctions WHERE id = '0'",
+    ]:
+        with manager.writer as DB:
+            DB.execute(sql)
+
+        with manager.reader() as DB:
+            lines = b"".join(iter_changes(manager.fp, get_version(mirror))).splitlines()  # type: ignore
+            version = apply_changes(mirror, lines)
+            assert (
+                version == DB.execute("SELECT value FROM data_generation").fetchone()[0]
+            )
+            assert dump(mirror) == dump(DB)
+
+
+def test_mirror_truncated(manager: ConnectionManager, exports: ExportCache, tmp_path):
+    with manager.reader() as DB:
+        generation, fp = exports.get(DB, "sqlite-file")
+
+    shutil.copy(fp, tmp_path / "mirror.sqlite")
+    mirror = sqlite3.connect(tmp_path / "mirror.sqlite")
+    with mirror:
+        get_version(mirror)
+        mirror.execute("INSERT INTO mirror_version (version) VALUES (?)", (generation,))
+
+    with manager.writer as DB:
+        DB.execute("UPDATE super_equips SET price = 1")
+        DB.execute("DELETE FROM super_auctions WHERE id = '0'")
+    body = b"".join(iter_changes(manager.fp, generation))
+    lines = body.splitlines()
+
+    def is_unchanged() -> bool:
+        return (
+            get_version(mirror) == generation
+            and mirror.execute("SELECT COUNT(*) FROM super_auctions WHERE id = '0'").fetchone()[0] == 1
+            and mirror.execute("SELECT COUNT(*) FROM super_equips WHERE price = 1").fetchone()[0] == 0
+        )  # fmt: skip
+
+    # Cut off between lines, and partway through one
+    for truncated in [lines[:-1], lines[:1], body[: len(body) // 2].splitlines()]:
+        with pytest.raises(Exception):
+            apply_changes(mirror, truncated)
+        assert is_unchanged()
+
+    apply_changes(mirror, lines)
+    assert not is_unchanged()
@@ -40,3 +40,13 @@ def test_parsing():
 
         expected = {**data.asdict(), "id_auction": auction_id}
         assert result == expected
+
+
+def test_parsing_stats():
+    thread = to_thread(CASES["equips"][0:1] + CASES["equips"][3:4])
+    result = KedamaScraper._parse_thread("0", thread)["stats"]
+
+    assert result == [
+        dict(equip="Eq01", auction="0", stat="EDB", value=100.0),
+        dict(equip="Eq01", auction="0", stat="MDB", value=50.0),
+    ]
@@ -0,0 +1,173 @@
+import pytest
+from fastapi import HTTPException
+
+from classes.core.server import server
+from classes.core.server.memory_engine import EquipEngine
+from classes.core.server.server import (
+    KEDAMA_EQUIP_FIELDS,
+    KEDAMA_EQUIPS_QUERY,
+    SUPER_EQUIP_FIELDS,
+    SUPER_EQUIPS_QUERY,
+    _select_item,
+    get_kedama_equips,
+    get_super_equips,
+)
+from classes.db import ConnectionManager
+from test.conftest import search, walk_pages
+
+
+def engines(manager: ConnectionManager) -> dict[str, EquipEngine]:
+    return dict(
+        super=EquipEngine(manager, _select_item(SUPER_EQUIPS_QUERY, SUPER_EQUIP_FIELDS), "se.rowid", "se.price", "sa.end_time", "sa.is_complete"),
+        kedama=EquipEngine(manager, _select_item(KEDAMA_EQUIPS_QUERY, KEDAMA_EQUIP_FIELDS), "equip.rowid", "equip.price", "list.start_time"),
+    )  # fmt: skip
+
+
+@pytest.fixture
+def loaded(priced, monkeypatch):
+    result = engines(priced)
+    for engine in result.values():
+        engine.load()
+        assert engine.current() is not None
+
+    monkeypatch.setattr(server, "EQUIP_ENGINES", result)
+    return priced, result
+
+
+def compare(monkeypatch, endpoint, DB, **params):
+    """Run a search against the db and against the in-memory copy"""
+
+    with monkeypatch.context() as m:
+        m.setattr(server, "EQUIP_ENGINES", dict())
+        expected = walk_pages(endpoint, DB, **params)
+    result = walk_pages(endpoint, DB, **params)
+    return expected, result
+
+
+# fmt: off
+PARAMS = [
+    dict(),
+    dict(name="oak"),
+    dict(name="OAK,heimd"),
+    dict(name="oak,e"),
+    dict(name="100%"),
+    dict(name="under_"),
+    dict(name="r%p_er"),
+    dict(name='"quoted"'),
+    dict(name=""),
+    dict(buyer="amy"),
+    dict(buyer="éléonore"),
+    dict(buyer="ÉLÉONORE"),
+    dict(buyer_partial="마이"),
+    dict(name="oak", buyer_partial="é"),
+    dict(name="eth", buyer_partial="É,l"),
+    dict(buyer_partial=""),
+    dict(seller="SICKENTIDE"),
+    dict(seller_partial="am,ck"),
+    dict(min_price=1),
+    dict(max_price=1),
+    dict(min_price=1, max_price=1),
+    dict(min_date=5),
+    dict(max_date=5),
+    dict(name="oak", buyer_partial="a", max_price=1, min_date=0),
+]
+# fmt: on
+
+
+@pytest.mark.parametrize("params", PARAMS)
+@pytest.mark.parametrize("endpoint", [get_super_equips, get_kedama_equips])
+def test_matches_sql(loaded, monkeypatch, endpoint, params: dict):
+    manager, engines = loaded
+    with manager.reader() as DB:
+        # Sorted, so that the (unordered) db results are comparable
+        for order_by in ["price", "date"]:
+            for limit in [None, 1, 3]:
+                expected, result = compare(monkeypatch, endpoint, DB, **params, order_by=order_by, limit=limit)  # fmt: skip
+                assert result == expected
+
+        with monkeypatch.context() as m:
+            m.setattr(server, "EQUIP_ENGINES", dict())
+            expected = search(endpoint, DB, **params, count=True)
+        assert search(endpoint, DB, **params, count=True) == expected
+
+
+@pytest.mark.parametrize("fields", ["name", "price,auction.id", "auction,stats"])
+def test_fields(loaded, monkeypatch, fields: str):
+    manager, engines = loaded
+    with manager.reader() as DB:
+        for endpoint in [get_super_equips, get_kedama_equips]:
+            expected, result = compare(monkeypatch, endpoint, DB, fields=fields, order_by="price", limit=2)  # fmt: skip
+            assert result == expected
+
+
+def test_complete_filter(loaded, monkeypatch):
+    manager, engines = loaded
+    with manager.writer as DB:
+        DB.execute("UPDATE super_auctions SET is_complete = 0 WHERE id = '2'")
+    engines["super"].load()
+
+    with manager.reader() as DB:
+        for complete in [True, False]:
+            expected, result = compare(monkeypatch, get_super_equips, DB, complete=complete, order_by="date")  # fmt: skip
+            assert result == expected
+            assert len(result) > 0
+
+
+def test_unordered_pages(loaded, monkeypatch):
+    manager, engines = loaded
+    with manager.reader() as DB:
+        expected, result = compare(monkeypatch, get_super_equips, DB, limit=2)
+        assert result == expected
+
+
+def test_invalid_page(loaded):
+    manager, engines = loaded
+    with manager.reader() as DB:
+        for params in [
+            dict(limit=0),
+            dict(cursor="abc"),
+            dict(cursor=server._encode_cursor("price", "abc", 1), order_by="price"),
+        ]:
+            with pytest.raises(HTTPException) as e:
+                search(get_super_equips, DB, **params)
+            assert e.value.status_code == 400
+
+
+def test_follows_db(priced, monkeypatch):
+    engine = engines(priced)["super"]
+    monkeypatch.setattr(server, "EQUIP_ENGINES", dict(super=engine))
+
+    # Searches go to the db while it's loading
+    assert engine.current() is None
+    engine.wait()
+    snapshot = engine.current()
+    assert snapshot is not None
+
+    with priced.writer as DB:
+        DB.execute("UPDATE super_equips SET name = 'Shiny Zweihander' WHERE rowid = 1")
+
+    assert engine.current() is None
+    with priced.reader() as DB:
+        assert len(search(get_super_equips, DB, name="zwei")) == 1
+
+    engine.wait()
+    assert engine.current() is not snapshot
+    with priced.reader() as DB:
+        assert len(search(get_super_equips, DB, name="zwei")) == 1
+
+
+def test_warm_up(priced, monkeypatch, tmp_path):
+    result = engines(priced)
+    monkeypatch.setattr(server, "EQUIP_ENGINES", result)
+    monkeypatch.setattr(server, "DB_MANAGER", priced)
+
+    server.warm_up()
+    for engine in result.values():
+        assert engine.current() is not None
+    assert len(priced._idle) == server.WARM_UP_READERS
+
+    # A worker still starts if this fails
+    empty = ConnectionManager(tmp_path / "empty.sqlite")
+    monkeypatch.setattr(server, "EQUIP_ENGINES", engines(empty))
+    monkeypatch.setattr(server, "DB_MANAGER", empty)
+    server.warm_up()
@@ -0,0 +1,120 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from starlette.types import Receive, Scope, Send
+
+from classes.core.server import metrics
+from classes.core.server.metrics import Counter, Histogram, Registry
+from classes.core.server.middleware import Metrics
+from classes.db import SQL_TIMER, ConnectionManager, SqlTimer
+
+
+def test_render():
+    registry = Registry()
+    counter = registry.add(Counter("requests", "Requests", ["route"]))
+    hist = registry.add(Histogram("latency", "Latency", ["route"], [0.1, 1]))
+
+    counter.inc('/a"b')
+    counter.inc('/a"b', amount=2)
+    for value in [0.05, 0.1, 0.5, 3]:
+        hist.observe("/x", value=value)
+
+    assert registry.render() == "\n".join(
+        [
+            "# HELP requests Requests",
+            "# TYPE requests counter",
+            'requests{route="/a\\"b"} 3',
+            "# HELP latency Latency",
+            "# TYPE latency histogram",
+            'latency_bucket{route="/x",le="0.1"} 2',
+            'latency_bucket{route="/x",le="1"} 3',
+            'latency_bucket{route="/x",le="+Inf"} 4',
+            'latency_sum{route="/x"} 3.65',
+            'latency_count{route="/x"} 4',
+            "",
+        ]
+    )
+
+
+def test_sql_timer(manager: ConnectionManager):
+    with manager.reader() as DB:
+        DB.execute("SELECT 1").fetchall()
+
+        timer = SqlTimer()
+        token = SQL_TIMER.set(timer)
+        try:
+            rows = DB.execute("WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n LIMIT 1000) SELECT x FROM n")  # fmt: skip
+            assert sum(r["x"] for r in rows) == 500500
+            DB.execute("SELECT 1").fetchone()
+        finally:
+            SQL_TIMER.reset(token)
+
+        DB.execute("SELECT 1").fetchall()
+
+    assert timer.statements == 2
+    assert timer.seconds > 0
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    for name in ["REQUEST_DURATION", "RESPONSE_SIZE", "SQL_DURATION"]:
+        old = getattr(metrics, name)
+        monkeypatch.setattr(
+            metrics, name, Histogram(old.name, old.help, old.labels, old.buckets)
+        )
+    return metrics
+
+
+def run(app, path: str) -> None:
+    async def receive():
+        return dict(type="http.request", body=b"", more_body=False)
+
+    async def send(message):
+        pass
+
+    scope = dict(type="http", method="GET", path=path, headers=[])
+    asyncio.run(app(scope, receive, send))
+
+
+def test_metrics_middleware(manager: ConnectionManager, fresh_metrics):
+    async def app(scope: Scope, receive: Receive, send: Send):
+        if scope["path"] == "/missing":
+            await send(dict(type="http.response.start", status=404, headers=[]))
+            await send(dict(type="http.response.body", body=b"x"))
+            return
+
+        # What the router does
+        scope["route"] = SimpleNamespace(path="/items/{id}")
+
+        def query():
+            with manager.reader() as DB:
+                return DB.execute("SELECT 1").fetchone()[0]
+
+        assert await asyncio.to_thread(query) == 1
+        assert metrics.REQUESTS_IN_FLIGHT._values[()] == 1
+
+        await send(dict(type="http.response.start", status=200, headers=[]))
+        await send(dict(type="http.response.body", body=b"a" * 2000, more_body=True))
+        await send(dict(type="http.response.body", body=b"", more_body=False))
+
+    run(Metrics(app), "/items/1")
+    run(Metrics(app), "/items/2")
+    run(Metrics(app), "/missing")
+
+    assert metrics.REQUESTS_IN_FLIGHT._values[()] == 0
+
+    durations = fresh_metrics.REQUEST_DURATION._values
+    assert {k: sum(v[0]) for k, v in durations.items()} == {
+        ("/items/{id}", "GET", 200): 2,
+        ("other", "GET", 404): 1,
+    }
+
+    sizes = fresh_metrics.RESPONSE_SIZE._values
+    assert sizes[("/items/{id}",)][1] == 4000
+    assert sizes[("other",)][1] == 1
+
+    # Only requests that ran a query
+    sql = fresh_metrics.SQL_DURATION._values
+    assert list(sql) == [("/items/{id}",)]
+    assert sum(sql[("/items/{id}",)][0]) == 2
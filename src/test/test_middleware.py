@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+from starlette.types import Receive, Scope, Send
+
+from classes.core.server.middleware import ErrorLog, PerformanceLog, RequestLog
+from classes.db import SQL_TIMER, SqlTimer
+from config import logger
+
+
+@pytest.fixture
+def logs():
+    messages: list[str] = []
+    id = logger.add(lambda m: messages.append(m.record["message"]), level="TRACE")
+    yield messages
+    logger.remove(id)
+
+
+def run(app, events: list) -> None:
+    """Request app, recording the messages it sends in events"""
+
+    async def receive():
+        return dict(type="http.request", body=b"", more_body=False)
+
+    async def send(message):
+        events.append(("sent", message.get("body")))
+
+    scope = dict(
+        type="http",
+        method="GET",
+        scheme="http",
+        server=("testserver", 80),
+        path="/search",
+        query_string=b"name=oak",
+        headers=[],
+    )
+    asyncio.run(app(scope, receive, send))
+
+
+def streamer(chunks: list[bytes], events: list):
+    async def app(scope: Scope, receive: Receive, send: Send):
+        await send(dict(type="http.response.start", status=200, headers=[]))
+        for chunk in chunks:
+            events.append(("produced", chunk))
+            await send(dict(type="http.response.body", body=chunk, more_body=True))
+        await send(dict(type="http.response.body", body=b"", more_body=False))
+
+    return app
+
+
+def test_middleware_streams(logs: list[str]):
+    chunks = [b"a" * 2000, b"b", b"c"]
+    events = []
+    run(RequestLog(PerformanceLog(ErrorLog(streamer(chunks, events)))), events)
+
+    # Each section is passed on before the next one is produced
+    assert events == [
+        ("sent", None),
+        *[e for c in chunks for e in [("produced", c), ("sent", c)]],
+        ("sent", b""),
+    ]
+
+    assert logs[0] == "GET http://testserver/search?name=oak"
+    assert logs[1] == "a" * 1024 + "... (first section of size 2000)"
+    assert logs[2].startswith("Response took ")
+    assert len(logs) == 3
+
+
+@pytest.mark.parametrize(
+    "chunks, expected",
+    [
+        ([b"", "앤".encode() * 400], "앤" * 341 + "... (first section of size 1200)"),
+        ([b"\x1f\x8b\x08\x00"], "gzip'd response (first section of size 4)"),
+        ([], ""),
+    ],
+)
+def test_request_log_samples(logs: list[str], chunks: list[bytes], expected: str):
+    run(RequestLog(streamer(chunks, [])), [])
+    assert logs[1:] == [expected]
+
+
+def test_error_log(logs: list[str]):
+    async def app(scope: Scope, receive: Receive, send: Send):
+        raise ValueError("oops")
+
+    with pytest.raises(ValueError):
+        run(ErrorLog(app), [])
+    assert len(logs) == 1
+
+
+def test_slow_sql_log(logs: list[str], monkeypatch):
+    monkeypatch.setattr(PerformanceLog, "SLOW_SQL_MS", 1000)
+
+    def app(sql_seconds: float):
+        inner = streamer([b"a"], [])
+
+        async def wrapper(scope: Scope, receive: Receive, send: Send):
+            # What the Metrics middleware (and the readers) do
+            timer = SqlTimer()
+            timer.seconds = sql_seconds
+            timer.statements = 3
+            token = SQL_TIMER.set(timer)
+            try:
+                await PerformanceLog(inner)(scope, receive, send)
+            finally:
+                SQL_TIMER.reset(token)
+
+        return wrapper
+
+    run(app(0.5), [])
+    assert not any(x.startswith("Slow request") for x in logs)
+
+    run(app(1.5), [])
+    assert (
+        logs[-1]
+        == "Slow request (1500ms in sqlite, 3 statements): GET http://testserver/search?name=oak"
+    )
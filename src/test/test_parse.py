@@ -0,0 +1,36 @@
+import pytest
+
+from utils.parse import parse_lottery_prizes, parse_stats
+
+
+@pytest.mark.parametrize(
+    "stats, expected",
+    [
+        (["EDB 100%", "MDB 50%"], [("EDB", 100.0), ("MDB", 50.0)]),
+        (["Holy EDB 73%", " Prof  41 % "], [("Holy EDB", 73.0), ("Prof", 41.0)]),
+        (["Burden -2.5", "Interference +1"], [("Burden", -2.5), ("Interference", 1.0)]),
+        (["Soulbound", "", "50%", "EDB 50%%", "EDB"], []),
+        ([], []),
+    ],
+)
+def test_parse_stats(stats: list[str], expected: list[tuple[str, float]]):
+    assert parse_stats(stats) == expected
+
+
+def test_parse_lottery_prizes():
+    row = {
+        "1_prize": None, "1_user": "Amy",
+        "1b_prize": "Equip Core", "1b_user": None,
+        "2_prize": '[10, "Chaos Tokens"]', "2_user": "앤 마이어",
+        "3_prize": '[1, "Golden Lottery Ticket"]', "3_user": "Amy",
+        "4_prize": '[5, "Chaos Tokens"]', "4_user": "sickentide",
+        "5_prize": '[50, "Caffeinated Candy"]', "5_user": "",
+    }  # fmt: skip
+
+    assert parse_lottery_prizes(row) == [
+        ("1", "Amy", 1, None),
+        ("2", "앤 마이어", 10, "Chaos Tokens"),
+        ("3", "Amy", 1, "Golden Lottery Ticket"),
+        ("4", "sickentide", 5, "Chaos Tokens"),
+        ("5", "", 50, "Caffeinated Candy"),
+    ]
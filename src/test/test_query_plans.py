@@ -0,0 +1,131 @@
+"""Check that the search endpoints' queries are served by indexes
+
+Each case runs an endpoint, captures the SELECTs it sends, and checks the EXPLAIN QUERY PLAN output
+(so that a query change that silently falls back to a full table scan fails here).
+"""
+
+from typing import Callable
+
+import pytest
+
+from classes.core.server.server import (
+    get_all_equips,
+    get_kedama_equips,
+    get_lottery,
+    _encode_cursor,
+    get_super_equips,
+)
+from classes.db import ConnectionManager
+
+
+def query_plan(manager: ConnectionManager, endpoint: Callable, **params) -> list[str]:
+    with manager.reader() as DB:
+        queries: list[str] = []
+        DB.set_trace_callback(queries.append)
+        try:
+            endpoint(**params, DB=DB)
+        finally:
+            DB.set_trace_callback(None)
+
+        plan = []
+        for q in queries:
+            # Skip the statements fts5 runs on its shadow tables
+            if "'main'." in q:
+                continue
+            if q.lstrip().upper().startswith("SELECT"):
+                rows = DB.execute("EXPLAIN QUERY PLAN " + q).fetchall()
+                plan.extend(r["detail"] for r in rows)
+        return plan
+
+
+# fmt: off
+CASES = [
+    (get_super_equips, dict(buyer="Amy"), "idx_super_equips_buyer"),
+    (get_super_equips, dict(seller="Amy"), "idx_super_equips_seller"),
+    (get_super_equips, dict(name="oa", seller="Amy"), "idx_super_equips_seller"),
+    (get_super_equips, dict(min_date=1.6e9), "idx_super_auctions_end_time"),
+    (get_super_equips, dict(min_date=1.6e9, max_date=1.7e9), "idx_super_auctions_end_time"),
+    (get_super_equips, dict(min_date=1.6e9), "idx_super_equips_id_auction"),
+    (get_super_equips, dict(min_price=100_000), "idx_super_equips_price"),
+    (get_super_equips, dict(max_price=100_000), "idx_super_equips_price"),
+    (get_kedama_equips, dict(buyer="Amy"), "idx_kedama_equips_buyer"),
+    (get_kedama_equips, dict(seller="Amy"), "idx_kedama_equips_seller"),
+    (get_kedama_equips, dict(name="oa", seller="Amy"), "idx_kedama_equips_seller"),
+    (get_kedama_equips, dict(min_date=1.6e9), "idx_kedama_auctions_start_time"),
+    (get_kedama_equips, dict(min_date=1.6e9, max_date=1.7e9), "idx_kedama_auctions_start_time"),
+    (get_kedama_equips, dict(min_date=1.6e9), "idx_kedama_equips_id_auction"),
+    (get_kedama_equips, dict(min_price=100_000), "idx_kedama_equips_price"),
+    (get_kedama_equips, dict(max_price=100_000), "idx_kedama_equips_price"),
+    (get_all_equips, dict(buyer="Amy"), "idx_all_equips_buyer"),
+    (get_all_equips, dict(seller="Amy"), "idx_all_equips_seller"),
+    (get_all_equips, dict(min_date=1.6e9), "idx_all_equips_auction_time"),
+    (get_all_equips, dict(min_price=100_000), "idx_all_equips_price"),
+    (get_super_equips, dict(stat="EDB>=50"), "idx_equip_stats_stat"),
+    (get_kedama_equips, dict(stat="EDB>=50"), "idx_equip_stats_stat"),
+    (get_all_equips, dict(stat="EDB>=50"), "idx_equip_stats_stat"),
+    (get_lottery, dict(user="Amy"), "idx_lottery_results_user"),
+    (get_lottery, dict(user="Amy", min_date=1.6e9), "idx_lottery_results_user"),
+    (get_lottery, dict(min_date=1.6e9), "idx_lottery_weapon_date"),
+    (get_lottery, dict(min_date=1.6e9), "idx_lottery_armor_date"),
+]
+
+# Later pages should seek to the cursor rather than scan the earlier pages
+CASES += [
+    (endpoint, dict(order_by=order_by, limit=10, cursor=_encode_cursor(order_by, value, 100)), index)
+    for endpoint, order_by, value, index in [
+        (get_super_equips, "price", 1000, "idx_super_equips_price"),
+        (get_super_equips, "date", 1.6e9, "idx_super_auctions_end_time"),
+        (get_super_equips, "price", None, "idx_super_equips_price"),
+        (get_kedama_equips, "price", 1000, "idx_kedama_equips_price"),
+        (get_kedama_equips, "date", 1.6e9, "idx_kedama_auctions_start_time"),
+        (get_all_equips, "price", 1000, "idx_all_equips_price"),
+        (get_all_equips, "date", 1.6e9, "idx_all_equips_auction_time"),
+    ]
+]
+CASES += [
+    (get_lottery, dict(limit=10, cursor=_encode_cursor("date", 1.6e9, 100, "weapon")), "idx_lottery_weapon_date"),
+    (get_lottery, dict(limit=10, cursor=_encode_cursor("date", 1.6e9, 100, "weapon")), "idx_lottery_armor_date"),
+]
+
+# Partial matches (of 3+ chars) should go through the trigram index
+FTS_CASES = [
+    (get_super_equips, dict(name="leg,oak,heimd"), "super_equips_fts"),
+    (get_super_equips, dict(name="oak", buyer="Amy"), "super_equips_fts"),
+    (get_super_equips, dict(name="oak", min_date=1.6e9), "super_equips_fts"),
+    (get_super_equips, dict(buyer_partial="amy"), "super_equips_fts"),
+    (get_super_equips, dict(seller_partial="amy", complete=True), "super_equips_fts"),
+    (get_kedama_equips, dict(name="leg,oak,heimd"), "kedama_equips_fts"),
+    (get_kedama_equips, dict(name="oak", buyer="Amy"), "kedama_equips_fts"),
+    (get_kedama_equips, dict(name="oak", min_date=1.6e9), "kedama_equips_fts"),
+    (get_kedama_equips, dict(buyer_partial="amy"), "kedama_equips_fts"),
+    (get_kedama_equips, dict(seller_partial="amy"), "kedama_equips_fts"),
+    (get_all_equips, dict(name="leg,oak,heimd"), "all_equips_fts"),
+    (get_all_equips, dict(name="oak", buyer="Amy"), "all_equips_fts"),
+    (get_all_equips, dict(buyer_partial="amy", complete=True), "all_equips_fts"),
+]
+# fmt: on
+
+
+@pytest.mark.parametrize("endpoint, params, index", CASES)
+def test_search_uses_index(
+    manager: ConnectionManager, endpoint: Callable, params: dict, index: str
+):
+    plan = query_plan(manager, endpoint, **params)
+
+    assert any(
+        f"USING INDEX {index} " in step or f"USING COVERING INDEX {index} " in step
+        for step in plan
+    ), plan
+    assert not any(step.startswith("SCAN") for step in plan), plan
+
+
+@pytest.mark.parametrize("endpoint, params, fts", FTS_CASES)
+def test_partial_match_uses_fts(
+    manager: ConnectionManager, endpoint: Callable, params: dict, fts: str
+):
+    plan = query_plan(manager, endpoint, **params)
+
+    assert any(step.startswith(f"SCAN {fts} VIRTUAL TABLE") for step in plan), plan
+    assert not any(
+        step.startswith("SCAN") and "VIRTUAL TABLE" not in step for step in plan
+    ), plan
@@ -0,0 +1,896 @@
+import asyncio
+import statistics
+import threading
+from datetime import datetime, timezone
+from typing import Any, get_args
+
+import msgpack
+import orjson
+import pytest
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from classes.core.server.formats import (
+    MSGPACK_TYPE,
+    Layout,
+    encode,
+    encode_values,
+    to_columns,
+)
+from classes.core.server.server import (
+    _encode_cursor,
+    _iter_json,
+    _project,
+    get_all_equips,
+    get_kedama_equips,
+    get_lottery,
+    get_lottery_user_stats,
+    get_price_stats,
+    get_super_equips,
+    on_sql_budget_exceeded,
+    server,
+)
+from classes.db import (
+    STATEMENT_STATS,
+    ConnectionManager,
+    SqlBudgetExceeded,
+    refresh_price_rollups,
+)
+from classes.db import connection
+from classes.db.migrations import _add_equip_stats, _add_lottery_results
+from test.conftest import NAMES, USERS, search, walk_pages
+from utils.http import from_columns
+from utils.parse import parse_stats
+
+
+def like_search(manager: ConnectionManager, table: str, col: str, text: str) -> set:
+    """What a search did before it was routed through the trigram index"""
+
+    where = " AND ".join(f"{col} LIKE ? COLLATE NOCASE" for _ in text.split(","))
+    data = [f"%{x.strip()}%" for x in text.split(",")]
+    with manager.reader() as DB:
+        rows = DB.execute(f"SELECT id FROM {table} WHERE {where}", data).fetchall()
+    return {r["id"] for r in rows}
+
+
+# fmt: off
+FRAGMENTS = [
+    "leg,oak,heimd", "HEIMD,LEG", "oak", "oa", "k s", "%ee", "e_e", "% eth", "under_",
+    '"quoted"', 'y "q', "ssi", "eth,shade,dancer", "",
+    "amy", "AMY", "마이", "앤 마이", "éléo", "ÉLÉO", "sick", "tide,sick",
+]
+# fmt: on
+
+
+@pytest.mark.parametrize("text", FRAGMENTS)
+@pytest.mark.parametrize("param, col", [("name", "name"), ("buyer_partial", "buyer"), ("seller_partial", "seller")])  # fmt: skip
+def test_partial_match_matches_like(populated, text: str, param: str, col: str):
+    with populated.reader() as DB:
+        super_ids = {r["id"] for r in search(get_super_equips, DB, **{param: text})}
+        kedama_ids = {r["id"] for r in search(get_kedama_equips, DB, **{param: text})}
+
+    assert super_ids == like_search(populated, "super_equips", col, text)
+    assert kedama_ids == like_search(populated, "kedama_equips", col, text)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [dict(name="oak,leg", buyer_partial="amy"), dict(name="ETH", buyer_partial="mA", seller_partial="tide,sick")],
+)  # fmt: skip
+def test_partial_matches_combine(populated, params: dict):
+    cols = dict(name="name", buyer_partial="buyer", seller_partial="seller")
+    for endpoint, table in [(get_super_equips, "super_equips"), (get_kedama_equips, "kedama_equips")]:  # fmt: skip
+        with populated.reader() as DB:
+            ids = {r["id"] for r in search(endpoint, DB, **params)}
+
+        expected = [
+            like_search(populated, table, cols[k], v) for k, v in params.items()
+        ]
+        assert ids == set.intersection(*expected)
+
+
+def test_searches_reuse_statements(priced):
+    # The same filters run the same statements, whatever the number of fragments / page size
+    with priced.reader() as DB:
+        search(get_super_equips, DB, name="oak", buyer_partial="amy", order_by="price", limit=1)  # fmt: skip
+        before = STATEMENT_STATS.stats()
+        search(get_super_equips, DB, name="leg,oak,heimd", buyer_partial="sick,tide", order_by="price", limit=3)  # fmt: skip
+        after = STATEMENT_STATS.stats()
+
+    assert after["misses"] == before["misses"]
+    assert after["hits"] > before["hits"]
+
+
+# Too short to search by themselves
+SHORT_FRAGMENTS = ["o", "%", "_", "é", "%_"]
+
+
+@pytest.mark.parametrize("text", SHORT_FRAGMENTS)
+@pytest.mark.parametrize("param, col, longer", [("name", "name", "eth"), ("buyer_partial", "buyer", "sick"), ("seller_partial", "seller", "sick")])  # fmt: skip
+def test_short_fragments(populated, text: str, param: str, col: str, longer: str):
+    with populated.reader() as DB:
+        for endpoint in [get_super_equips, get_kedama_equips, get_all_equips]:
+            with pytest.raises(HTTPException) as e:
+                search(endpoint, DB, **{param: text})
+            assert e.value.status_code == 400
+
+        # Unless another filter narrows the search
+        text = f"{text},{longer}"
+        super_ids = {r["id"] for r in search(get_super_equips, DB, **{param: text})}
+        kedama_ids = {r["id"] for r in search(get_kedama_equips, DB, **{param: text})}
+
+    assert super_ids == like_search(populated, "super_equips", col, text)
+    assert kedama_ids == like_search(populated, "kedama_equips", col, text)
+
+
+def test_fts_follows_replace(populated):
+    with populated.writer as DB:
+        DB.execute(
+            """
+            INSERT OR REPLACE INTO super_equips (id, id_auction, name, eid, key, is_isekai, stats, next_bid, buyer, seller)
+            VALUES ('Eq00', '1', 'Average Cotton Cap', 0, '', 0, '[]', 0, 'Amy', 'Amy')
+            """
+        )
+        DB.execute("DELETE FROM kedama_equips WHERE id = 'Eq00'")
+        DB.execute(
+            "UPDATE kedama_equips SET name = 'Average Cotton Cap' WHERE id = 'Eq01'"
+        )
+
+    with populated.reader() as DB:
+        assert [r["id"] for r in search(get_super_equips, DB, name="cotton")] == [
+            "Eq00"
+        ]
+        assert [r["id"] for r in search(get_kedama_equips, DB, name="cotton")] == [
+            "Eq01"
+        ]
+        assert "Eq00" not in {
+            r["id"] for r in search(get_super_equips, DB, name="heimd")
+        }
+        assert "Eq00" not in {
+            r["id"] for r in search(get_kedama_equips, DB, name="heimd")
+        }
+
+
+@pytest.mark.parametrize("text", FRAGMENTS)
+@pytest.mark.parametrize("param", ["name", "buyer_partial", "seller_partial"])
+def test_all_equips_matches_sources(populated, text: str, param: str):
+    with populated.reader() as DB:
+        expected = {
+            ("S", r["id"]) for r in search(get_super_equips, DB, **{param: text})
+        }
+        expected |= {
+            ("K", r["id"]) for r in search(get_kedama_equips, DB, **{param: text})
+        }
+        result = search(get_all_equips, DB, **{param: text})
+
+    assert {(r["auction"]["title_short"][0], r["id"]) for r in result} == expected
+
+
+def test_all_equips_format(populated):
+    with populated.writer as DB:
+        DB.execute(
+            "UPDATE super_equips SET price = 5, next_bid = 3, stats = '{}' WHERE id = 'Eq00'"
+        )
+        DB.execute(
+            "UPDATE kedama_equips SET price = 4, start_bid = 2 WHERE id = 'Eq00'"
+        )
+
+    with populated.reader() as DB:
+        result = search(get_all_equips, DB, min_price=1)
+        result.sort(key=lambda r: r["price"], reverse=True)
+
+    assert [r["auction"]["title_short"] for r in result] == ["S001", "K001"]
+    assert [r["min_bid"] for r in result] == [3, 2]
+    assert result[0]["stats"] == []
+    assert result[0]["auction"] == dict(
+        id="1", title="1", title_short="S001", time=0, is_complete=1
+    )
+
+
+@pytest.mark.parametrize(
+    "endpoint, table",
+    [(get_super_equips, "super_equips"), (get_kedama_equips, "kedama_equips")],
+)
+def test_items_have_every_column(populated, endpoint, table: str):
+    # The items are built with json_object(), which lists the columns explicitly
+    with populated.reader() as DB:
+        cols = [r["name"] for r in DB.execute(f"PRAGMA table_info({table})")]
+        item = search(endpoint, DB)[0]
+
+    assert list(item) == cols + ["auction"]
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        "name",
+        "name, price,auction.id",
+        "auction",
+        "auction,auction.id,stats",
+        "stats,id,",
+    ],
+)
+@pytest.mark.parametrize("endpoint", [get_super_equips, get_kedama_equips, get_all_equips])  # fmt: skip
+def test_fields(statted, endpoint, fields: str):
+    with statted.reader() as DB:
+        expected = search(endpoint, DB, order_by="date")
+        result = search(endpoint, DB, order_by="date", fields=fields)
+
+    selected = {x.strip() for x in fields.split(",")} - {""}
+    expected = [_project(item, selected) for item in expected]
+    assert result == expected
+    assert all(result)
+
+
+def test_project():
+    item = dict(id=1, stats=dict(EDB=1), auction=dict(id="a", time=1.5))
+    assert _project(item, {"id", "auction.id"}) == dict(id=1, auction=dict(id="a"))
+    assert _project(item, {"auction", "auction.id"}) == dict(auction=item["auction"])
+    assert _project(item, {"stats"}) == dict(stats=dict(EDB=1))
+
+
+@pytest.mark.parametrize("fields", ["", ",", "nothing", "name,nothing", "auction.nothing", "stats.EDB"])  # fmt: skip
+def test_invalid_fields(populated, fields: str):
+    with populated.reader() as DB:
+        for endpoint in [get_super_equips, get_all_equips, get_lottery]:
+            with pytest.raises(HTTPException) as e:
+                search(endpoint, DB, fields=fields)
+            assert e.value.status_code == 400
+
+
+def test_all_equips_follows_sources(populated):
+    with populated.writer as DB:
+        DB.execute(
+            """
+            INSERT OR REPLACE INTO super_equips (id, id_auction, name, eid, key, is_isekai, stats, next_bid, buyer, seller)
+            VALUES ('Eq00', '1', 'Average Cotton Cap', 0, '', 0, '[]', 0, 'Amy', 'Amy')
+            """
+        )
+        DB.execute("DELETE FROM kedama_equips WHERE id = 'Eq00'")
+        DB.execute("UPDATE kedama_auctions SET start_time = 100 WHERE id = '1'")
+        DB.execute("UPDATE super_auctions SET is_complete = 0 WHERE id = '1'")
+
+    with populated.reader() as DB:
+        assert [r["id"] for r in search(get_all_equips, DB, name="cotton")] == ["Eq00"]
+        assert "Eq00" not in {r["id"] for r in search(get_all_equips, DB, name="heimd")}
+        assert (
+            len(search(get_all_equips, DB, min_date=100)) == len(NAMES) * len(USERS) - 1
+        )
+        assert search(get_all_equips, DB, complete=True) == []
+
+    with populated.writer as DB:
+        DB.execute("DELETE FROM super_auctions")
+
+    with populated.reader() as DB:
+        assert {r["auction"]["title_short"] for r in search(get_all_equips, DB)} == {
+            "K001"
+        }
+
+
+@pytest.fixture
+def statted(populated):
+    with populated.writer as DB:
+        for table in ["super_equips", "kedama_equips"]:
+            DB.execute(
+                f"""
+                UPDATE {table} SET stats = json_array(
+                    IIF(rowid % 2, 'Holy', 'Dark') || ' EDB ' || (rowid * 7 % 100) || '%',
+                    'Prof ' || (rowid % 50) || '.5%',
+                    'Soulbound'
+                )
+                """
+            )
+
+        # The scrapers insert the parsed stats, here the migration's backfill does
+        DB.execute("DELETE FROM equip_stats")
+        _add_equip_stats(DB)
+
+    return populated
+
+
+# fmt: off
+STAT_FILTERS = [
+    ("Holy EDB>=50", lambda s: s.get("Holy EDB", -1) >= 50),
+    ("holy edb > 50%", lambda s: s.get("Holy EDB", -1) > 50),
+    ("Dark EDB<10,Prof=20.5", lambda s: s.get("Dark EDB", 100) < 10 and s.get("Prof") == 20.5),
+    ("Prof<=3, Holy EDB>0", lambda s: s.get("Prof", 100) <= 3 and s.get("Holy EDB", -1) > 0),
+    ("EDB>=0", lambda s: False),
+]
+# fmt: on
+
+
+@pytest.mark.parametrize("stat, check", STAT_FILTERS)
+@pytest.mark.parametrize("endpoint", [get_super_equips, get_kedama_equips, get_all_equips])  # fmt: skip
+def test_stat_filter(statted, endpoint, stat: str, check):
+    def uid(item: dict):
+        return (item["auction"]["id"], item["id"], item["auction"].get("title_short"))
+
+    with statted.reader() as DB:
+        items = search(endpoint, DB)
+        result = search(endpoint, DB, stat=stat)
+
+    expected = [x for x in items if check(dict(parse_stats(x["stats"])))]
+    assert sorted(map(uid, result)) == sorted(map(uid, expected))
+
+
+@pytest.mark.parametrize("stat", ["EDB", "EDB>=", ">=50", "EDB>=50,", "EDB=>50", "EDB>=5O"])  # fmt: skip
+def test_invalid_stat_filter(statted, stat: str):
+    with statted.reader() as DB:
+        with pytest.raises(HTTPException) as e:
+            search(get_all_equips, DB, stat=stat)
+        assert e.value.status_code == 400
+
+
+def test_stats_follow_equips(statted):
+    with statted.writer as DB:
+        DB.execute(
+            """
+            INSERT OR REPLACE INTO super_equips (id, id_auction, name, eid, key, is_isekai, stats, next_bid, buyer, seller)
+            VALUES ('Eq00', '1', 'Average Cotton Cap', 0, '', 0, '[]', 0, 'Amy', 'Amy')
+            """
+        )
+        DB.execute("DELETE FROM kedama_equips WHERE id = 'Eq01'")
+
+        counts = DB.execute(
+            "SELECT source, equip, COUNT(*) FROM equip_stats GROUP BY source, equip"
+        ).fetchall()
+        counts = {(r[0], r[1]): r[2] for r in counts}
+
+    assert ("super", "Eq00") not in counts
+    assert ("kedama", "Eq01") not in counts
+    assert ("kedama", "Eq00") in counts
+    assert set(counts.values()) == {2}
+    assert len(counts) == 2 * len(NAMES) * len(USERS) - 2
+
+
+@pytest.fixture
+def sold(populated):
+    with populated.writer as DB:
+        # Auctions in different months, the last one isn't complete
+        for id, time, is_complete in [(2, 1.6e9, 1), (3, 1.6e9 + 40 * 86400, 1), (4, 1.6e9 + 80 * 86400, 0)]:  # fmt: skip
+            DB.execute(
+                "INSERT INTO super_auctions (id, title, end_time, is_complete) VALUES (?, ?, ?, ?)",
+                (str(id), str(id), time, is_complete),
+            )
+            DB.execute(
+                "INSERT INTO kedama_auctions (id, title_short, title, start_time, is_complete) VALUES (?, ?, ?, ?, ?)",
+                (str(id), str(id), str(id), time, is_complete),
+            )
+
+        for table in ["super_equips", "kedama_equips"]:
+            DB.execute(
+                f"""
+                UPDATE {table}
+                SET price = IIF(rowid % 5 = 0, NULL, rowid * 1000 % 7000), id_auction = CAST(1 + rowid % 4 AS TEXT)
+                """
+            )
+
+        refresh_price_rollups(DB)
+
+    return populated
+
+
+def expected_price_stats(manager: ConnectionManager, name: str) -> dict:
+    """What /equips/price_stats should return, computed from all_equips"""
+
+    def summary(prices: list[int]) -> dict:
+        prices = sorted(prices)
+        if len(prices) < 2:
+            quartiles = [prices[0] if prices else None] * 3
+        else:
+            quartiles = statistics.quantiles(prices, n=4, method="inclusive")
+        return dict(
+            count=len(prices),
+            min=min(prices, default=None),
+            max=max(prices, default=None),
+            median=quartiles[1],
+            p25=quartiles[0],
+            p75=quartiles[2],
+        )
+
+    with manager.reader() as DB:
+        rows = DB.execute(
+            "SELECT name, auction_time, price FROM all_equips WHERE price IS NOT NULL AND auction_is_complete = 1"
+        ).fetchall()
+
+    fragments = [x.strip().lower() for x in name.split(",")]
+    rows = [r for r in rows if all(x in r["name"].lower() for x in fragments)]
+
+    by_month: dict[str, list[int]] = dict()
+    for r in rows:
+        month = datetime.fromtimestamp(r["auction_time"], timezone.utc).strftime(
+            "%Y-%m"
+        )
+        by_month.setdefault(month, []).append(r["price"])
+
+    return dict(
+        **summary([r["price"] for r in rows]),
+        months=[dict(month=k, **summary(v)) for k, v in sorted(by_month.items())],
+        names=sorted({r["name"].lower() for r in rows}),
+    )
+
+
+@pytest.mark.parametrize("name", ["oak", "ETH,shade", "legendary oak staff of heimdall", "nothing"])  # fmt: skip
+def test_price_stats(sold, name: str):
+    with sold.reader() as DB:
+        result = get_price_stats(name, DB=DB)
+    assert result == expected_price_stats(sold, name)
+
+    with sold.reader() as DB:
+        result = get_price_stats(name, min_date=1.6e9 + 30 * 86400, DB=DB)
+    assert result["months"] == [
+        x for x in expected_price_stats(sold, name)["months"] if x["month"] >= "2020-10"
+    ]
+
+
+@pytest.mark.parametrize("name", ["o", "oak,%", "_, "])
+def test_price_stats_short_fragments(sold, name: str):
+    with sold.reader() as DB:
+        with pytest.raises(HTTPException) as e:
+            get_price_stats(name, DB=DB)
+    assert e.value.status_code == 400
+
+
+def test_price_stats_follow_equips(sold):
+    changes = [
+        "UPDATE super_auctions SET is_complete = 1 WHERE id = '4'",
+        "UPDATE kedama_equips SET price = 123456 WHERE rowid = 1",
+        "DELETE FROM super_equips WHERE rowid = 2",
+        "UPDATE super_equips SET name = 'Legendary Oak Staff of Heimdall' WHERE rowid = 8",
+        "DELETE FROM kedama_auctions WHERE id = '3'",
+    ]
+    for sql in changes:
+        with sold.writer as DB:
+            DB.execute(sql)
+            refresh_price_rollups(DB)
+
+        for name in ["oak", ""]:
+            with sold.reader() as DB:
+                result = get_price_stats(name, DB=DB)
+            assert result == expected_price_stats(sold, name), sql
+
+
+@pytest.mark.parametrize("limit", [1, 4, 100])
+@pytest.mark.parametrize("order_by", [None, "price", "date"])
+@pytest.mark.parametrize("endpoint", [get_super_equips, get_kedama_equips, get_all_equips])  # fmt: skip
+def test_pages_cover_results(priced, endpoint, order_by, limit: int):
+    def uid(item: dict):
+        return (item["auction"]["id"], item["id"], item["auction"].get("title_short"))
+
+    with priced.reader() as DB:
+        expected = search(endpoint, DB, order_by=order_by)
+        items = walk_pages(endpoint, DB, order_by=order_by, limit=limit)
+
+    assert len(expected) == len(NAMES) * len(USERS) * (2 if endpoint is get_all_equips else 1)  # fmt: skip
+    if order_by is None:
+        # Unsorted
+        assert sorted(map(uid, items)) == sorted(map(uid, expected))
+    else:
+        assert list(map(uid, items)) == list(map(uid, expected))
+
+    if order_by == "price":
+        prices = [x["price"] for x in items]
+        n = prices.index(None)
+        assert prices[:n] == sorted(prices[:n], reverse=True)
+        assert set(prices[n:]) == {None}
+
+
+def test_count(priced):
+    with priced.reader() as DB:
+        for endpoint in [get_super_equips, get_kedama_equips, get_all_equips]:
+            for params in [dict(), dict(name="oak"), dict(min_price=1)]:
+                expected = len(search(endpoint, DB, **params))
+                result = search(endpoint, DB, **params, count=True)
+                assert result == dict(count=expected)
+
+
+def test_invalid_page(priced):
+    with priced.reader() as DB:
+        response = get_super_equips(order_by="price", limit=1, DB=DB)
+        cursor = response.headers["X-Next-Cursor"]
+
+        for params in [
+            dict(limit=0),
+            dict(cursor="abc"),
+            dict(cursor=cursor, order_by="date"),
+            dict(cursor=cursor.upper(), order_by="price"),
+            dict(cursor=_encode_cursor("date", [1], 2), order_by="date"),
+            dict(cursor=_encode_cursor("date", "1", 2), order_by="date"),
+            dict(cursor=_encode_cursor("date", 1, 2.5), order_by="date"),
+            dict(cursor=_encode_cursor("date", 1, None), order_by="date"),
+            dict(cursor=_encode_cursor("date", True, 2), order_by="date"),
+            dict(cursor=_encode_cursor(None, 1, 2, 3)),
+        ]:
+            with pytest.raises(HTTPException) as e:
+                search(get_super_equips, DB, **params)
+            assert e.value.status_code == 400
+
+
+def test_lottery_pages(manager: ConnectionManager):
+    with manager.writer as DB:
+        for type in ["weapon", "armor"]:
+            for id in range(1, 8):
+                DB.execute(
+                    f"""
+                    INSERT INTO lottery_{type} VALUES (
+                        ?, ?, 0, 'Legendary Oak Staff', 'Amy', 'Core', NULL,
+                        '[1, "Chaos Token"]', 'Amy', '[1, "Chaos Token"]', 'Amy',
+                        '[1, "Chaos Token"]', 'Amy', '[1, "Chaos Token"]', 'Amy'
+                    )
+                    """,
+                    (id, id // 3),
+                )
+
+    with manager.reader() as DB:
+        expected = search(get_lottery, DB, order_by="date")
+        assert search(get_lottery, DB, count=True) == dict(count=14)
+        for limit in [1, 3, 20]:
+            items = walk_pages(get_lottery, DB, limit=limit)
+            assert items == expected
+
+        for cursor in [
+            _encode_cursor("date", 1, 2),
+            _encode_cursor("date", 1, 2, 3),
+            _encode_cursor("date", 1, "2", "weapon"),
+            _encode_cursor("date", {}, 2, "weapon"),
+            _encode_cursor("date", 1, 2, None),
+        ]:
+            with pytest.raises(HTTPException) as e:
+                search(get_lottery, DB, limit=1, cursor=cursor)
+            assert e.value.status_code == 400
+
+        streamed = get_lottery(order_by="date", stream=True, DB=DB)
+        assert read_stream(streamed) == expected
+
+    keys = [(x["date"], x["lottery"]["id"], x["lottery"]["type"]) for x in expected]
+    assert keys == sorted(keys, reverse=True)
+
+
+@pytest.fixture
+def lotteries(manager: ConnectionManager):
+    with manager.writer as DB:
+        for type in ["weapon", "armor"]:
+            for id in range(1, 30):
+                users = [
+                    USERS[(id * place + len(type)) % len(USERS)] for place in range(6)
+                ]
+                DB.execute(
+                    f"""
+                    INSERT INTO lottery_{type} VALUES (
+                        ?, ?, 0, 'Legendary Oak Staff', ?, 'Equip Core', ?,
+                        '[1, "Chaos Token"]', ?, '[2, "Chaos Token"]', ?,
+                        '[3, "Chaos Token"]', ?, '[4, "Chaos Token"]', ?
+                    )
+                    """,
+                    # Only the core winner is nullable
+                    (
+                        id,
+                        id * 1000,
+                        users[0] or "",
+                        users[1],
+                        *(u or "" for u in users[2:]),
+                    ),
+                )
+
+        # The scraper inserts the results, here the migration's backfill does
+        DB.execute("DELETE FROM lottery_results")
+        _add_lottery_results(DB)
+
+    return manager
+
+
+@pytest.mark.parametrize("param", ["user", "user_partial"])
+@pytest.mark.parametrize("text", ["amy", "AMY", "앤 마이어", "마이", "sick,tide", "my", "nobody"])  # fmt: skip
+def test_lottery_user_search(lotteries, param: str, text: str):
+    def matches(user: str | None) -> bool:
+        if user is None:
+            return False
+        if param == "user":
+            return user.lower() == text.lower()
+        return all(x.strip().lower() in user.lower() for x in text.split(","))
+
+    with lotteries.reader() as DB:
+        items = search(get_lottery, DB)
+        result = search(get_lottery, DB, **{param: text})
+
+    expected = [x for x in items if any(matches(user) for _, user in x["prizes"])]
+    assert result == expected
+
+
+def test_lottery_short_fragments(lotteries):
+    with lotteries.reader() as DB:
+        for params in [dict(user_partial="a"), dict(equip="o"), dict(equip="oak,%")]:
+            with pytest.raises(HTTPException) as e:
+                search(get_lottery, DB, **params)
+            assert e.value.status_code == 400
+
+        # Unless there's an exact user
+        result = search(get_lottery, DB, user="amy", equip="o")
+        assert result == search(get_lottery, DB, user="amy")
+        assert len(result) > 0
+
+
+def request_app(app, path: str, query_string: bytes, send_delay: float) -> list[dict]:
+    """Request an ASGI app with a client that takes send_delay seconds to read each message"""
+
+    messages = []
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            # Wait for a disconnect that never comes (the app stops listening once it's done)
+            await asyncio.Event().wait()
+        received = True
+        return dict(type="http.request", body=b"", more_body=False)
+
+    async def send(message):
+        messages.append(message)
+        await asyncio.sleep(send_delay)
+
+    scope = dict(type="http", method="GET", scheme="http", server=("testserver", 80), path=path, query_string=query_string, headers=[])  # fmt: skip
+    asyncio.run(app(scope, receive, send))
+    return messages
+
+
+@pytest.fixture
+def streamed(populated, monkeypatch):
+    """populated with enough rows for several chunks of a stream, and served by the app"""
+
+    with populated.writer as DB:
+        for idx in range(3000):
+            DB.execute(
+                """
+                INSERT INTO super_equips (id, id_auction, name, eid, key, is_isekai, stats, next_bid, buyer, seller)
+                VALUES (?, '1', ?, 0, '', 0, '[]', 0, 'Amy', 'Amy')
+                """,
+                (f"Slow{idx}", NAMES[0] + " " * 100),
+            )
+
+    monkeypatch.setattr(connection, "DB_MANAGER", populated)
+    monkeypatch.setattr("classes.core.server.server.DB_MANAGER", populated)
+    return populated
+
+
+@pytest.mark.parametrize(
+    "path, query_string",
+    [("/super/search_equips", b"stream=true"), ("/export/changes", b"since=0")],
+)
+def test_slow_client_within_budget(streamed, monkeypatch, path: str, query_string: bytes):  # fmt: skip
+    # Reading the stream takes longer than the budget, but the queries don't
+    monkeypatch.setattr(streamed, "request_budget", 0.2)
+    messages = request_app(server, path, query_string, send_delay=0.02)
+
+    assert messages[0]["status"] == 200
+    bodies = [m for m in messages if m["type"] == "http.response.body"]
+    assert len(bodies) > 10
+    assert bodies[-1]["more_body"] is False
+
+    body = b"".join(m["body"] for m in bodies)
+    if path == "/export/changes":
+        lines = [orjson.loads(x) for x in body.splitlines()]
+        assert sum(x.get("table") == "super_equips" for x in lines) == 3025
+    else:
+        assert len(orjson.loads(body)) == 3025
+
+
+def test_stream_over_budget(streamed, monkeypatch):
+    # Runs out once the response has started (ie after the first chunk)
+    started = threading.Event()
+
+    def iter_json(items):
+        for chunk in _iter_json(items, chunk_size=1024):
+            yield chunk
+            started.set()
+
+    def check(self):
+        self.exceeded = self.exceeded or started.is_set()
+        return self.exceeded
+
+    monkeypatch.setattr("classes.core.server.server._iter_json", iter_json)
+    monkeypatch.setattr(connection._SqlBudget, "check", check)
+    monkeypatch.setattr(streamed, "request_budget", 10)
+
+    messages = request_app(server, "/super/search_equips", b"stream=true&name=heimdall", send_delay=0)  # fmt: skip
+    assert messages[0]["status"] == 200
+    bodies = [m for m in messages if m["type"] == "http.response.body"]
+    assert bodies and all(m["more_body"] for m in bodies)
+
+    # Before that, it's a 400 as usual
+    started.set()
+    messages = request_app(server, "/super/search_equips", b"stream=true&name=staff", send_delay=0)  # fmt: skip
+    assert messages[0]["status"] == 400
+    assert "longer than 10s" in orjson.loads(messages[1]["body"])["detail"]
+
+
+def test_sql_budget_response():
+    scope = dict(type="http", method="GET", scheme="http", server=("testserver", 80), path="/equips/search", query_string=b"name=oak", headers=[])  # fmt: skip
+    response = on_sql_budget_exceeded(Request(scope), SqlBudgetExceeded(10))
+    assert response.status_code == 400
+    assert "10" in orjson.loads(response.body)["detail"]
+
+
+def test_lottery_results_follow_lotteries(lotteries):
+    with lotteries.writer as DB:
+        DB.execute(
+            """
+            INSERT OR REPLACE INTO lottery_weapon VALUES (
+                1, 0, 0, NULL, 'Amy', 'Equip Core', NULL,
+                '[1, "Chaos Token"]', 'Amy', '[1, "Chaos Token"]', 'Amy',
+                '[1, "Chaos Token"]', 'Amy', '[1, "Chaos Token"]', 'Amy'
+            )
+            """
+        )
+        DB.execute("DELETE FROM lottery_armor WHERE id = 2")
+
+        counts = DB.execute(
+            "SELECT type, lottery_id, COUNT(*) FROM lottery_results GROUP BY type, lottery_id"
+        ).fetchall()
+        counts = {(r[0], r[1]): r[2] for r in counts}
+
+    # Replaced rows have no results until the scraper inserts them
+    assert ("weapon", 1) not in counts
+    assert ("armor", 2) not in counts
+    assert ("armor", 1) in counts
+    assert len(counts) == 2 * 29 - 2
+
+
+@pytest.mark.parametrize("user", ["Amy", "amy", "앤 마이어", "sickentide", "nobody"])
+@pytest.mark.parametrize("min_date", [None, 10_000])
+def test_lottery_user_stats(lotteries, user: str, min_date):
+    with lotteries.reader() as DB:
+        items = search(get_lottery, DB, user=user, min_date=min_date)
+        result = get_lottery_user_stats(user, min_date=min_date, DB=DB)
+
+    # What !lwinner tallied / listed from the search results
+    categories = ["equips", "cores", "glts", "candies", "chaos_tokens", "chaos_tokens"]
+    places = ["1", "1b", "2", "3", "4", "5"]
+    expected = {k: dict(count=0, wins=0) for k in categories}
+    lotteries = []
+    for item in sorted(items, key=lambda x: (x["date"], x["lottery"]["id"], x["lottery"]["type"]), reverse=True):  # fmt: skip
+        for idx, (prize, winner) in enumerate(item["prizes"]):
+            if (winner or "").lower() == user.lower():
+                expected[categories[idx]]["wins"] += 1
+                expected[categories[idx]]["count"] += 1 if idx < 2 else prize[0]
+
+                lotteries.append(
+                    dict(
+                        date=item["date"],
+                        tickets=item["tickets"],
+                        lottery=item["lottery"],
+                        place=places[idx],
+                        prize=prize,
+                        grand_prize=item["prizes"][0][0],
+                    )
+                )
+                break
+
+    assert result["stats"] == expected
+    assert result["wins"] == len(items)
+    assert result["lotteries"] == lotteries
+    if items:
+        latest = max(items, key=lambda x: x["date"])
+        assert result["user"] in [winner for _, winner in latest["prizes"]]
+        assert result["user"].lower() == user.lower()
+    else:
+        assert result["user"] is None
+
+
+def read_stream(response: StreamingResponse) -> Any:
+    async def read():
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    return orjson.loads(asyncio.run(read()))
+
+
+@pytest.mark.parametrize(
+    "params",
+    [dict(), dict(name="oak"), dict(order_by="price", limit=4), dict(min_price=100)],
+)
+@pytest.mark.parametrize("endpoint", [get_super_equips, get_kedama_equips, get_all_equips])  # fmt: skip
+def test_stream_matches_list(priced, endpoint, params: dict):
+    with priced.reader() as DB:
+        response = endpoint(**params, DB=DB)
+        streamed = endpoint(**params, stream=True, DB=DB)
+
+        assert isinstance(streamed, StreamingResponse)
+        assert read_stream(streamed) == orjson.loads(response.body)
+        assert streamed.headers.get("X-Next-Cursor") == response.headers.get("X-Next-Cursor")  # fmt: skip
+
+
+def check_formats(endpoint, DB, **params):
+    """Check that the other formats have the same items as a json list"""
+
+    expected = endpoint(**params, DB=DB)
+    cursor = expected.headers.get("X-Next-Cursor")
+    expected = orjson.loads(expected.body)
+
+    for accept in [None, MSGPACK_TYPE]:
+        for stream in [False, True]:
+            response = endpoint(**params, format="columns", accept=accept, stream=stream, DB=DB)  # fmt: skip
+            assert from_columns(decode(response)) == expected
+            assert response.headers.get("X-Next-Cursor") == cursor
+
+    response = endpoint(**params, accept=MSGPACK_TYPE, DB=DB)
+    assert response.media_type == MSGPACK_TYPE
+    assert decode(response) == expected
+
+
+def decode(response: Response) -> Any:
+    if response.media_type == MSGPACK_TYPE:
+        return msgpack.unpackb(response.body)
+    return orjson.loads(response.body)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        dict(),
+        dict(name="oak"),
+        dict(order_by="price", limit=2),
+        dict(name="nothing"),
+        dict(fields="name,stats,auction.id"),
+        dict(fields="auction", order_by="date", limit=3),
+    ],
+)
+@pytest.mark.parametrize("endpoint", [get_super_equips, get_kedama_equips, get_all_equips])  # fmt: skip
+def test_formats_match_json(statted, endpoint, params: dict):
+    with statted.reader() as DB:
+        check_formats(endpoint, DB, **params)
+
+
+def test_lottery_formats_match_json(lotteries):
+    with lotteries.reader() as DB:
+        check_formats(get_lottery, DB, order_by="date", limit=10)
+        check_formats(get_lottery, DB, user="nobody")
+        check_formats(get_lottery, DB, order_by="date", fields="date,prizes")
+
+
+def test_lottery_fields(lotteries):
+    with lotteries.reader() as DB:
+        expected = search(get_lottery, DB, order_by="date")
+        for fields in ["date", "lottery.type,prizes", "tickets,lottery"]:
+            selected = set(fields.split(","))
+            result = search(get_lottery, DB, order_by="date", fields=fields)
+            assert result == [_project(item, selected) for item in expected]
+
+
+def test_columns():
+    items = [
+        dict(id=1, stats=dict(EDB=1), auction=dict(id="a", time=1.5), prizes=[]),
+        dict(id=2, stats=dict(Prof=2), auction=dict(id="b", time=None), prizes=[1]),
+    ]
+    columns = to_columns(items)
+    assert columns == dict(
+        id=[1, 2],
+        stats=[dict(EDB=1), dict(Prof=2)],
+        auction=dict(id=["a", "b"], time=[1.5, None]),
+        prizes=[[], [1]],
+    )
+    assert from_columns(columns) == items
+
+    items = [dict(id=1, stats=dict()), dict(id=2, stats=dict())]
+    assert from_columns(to_columns(items)) == items
+    assert from_columns(to_columns([])) == []
+
+
+def test_encode_values():
+    paths = [("id",), ("stats",), ("auction", "id"), ("auction", "time")]
+    rows = [[1, dict(EDB=1), "a", 1.5, "extra"], [2, dict(EDB=2), "b", None, "extra"]]
+    items = [
+        dict(id=1, stats=dict(EDB=1), auction=dict(id="a", time=1.5)),
+        dict(id=2, stats=dict(EDB=2), auction=dict(id="b", time=None)),
+    ]
+    for layout in get_args(Layout):
+        for msgpack_ in [False, True]:
+            expected = encode(map(orjson.dumps, items), layout, msgpack_)
+            assert encode_values(paths, rows, layout, msgpack_) == expected
+            assert encode_values(paths, [], layout, msgpack_) == encode([], layout, msgpack_)  # fmt: skip
+
+
+def test_iter_json_chunks():
+    items = [dict(id=idx, name="앤 마이어", stats=[]) for idx in range(10)]
+    for chunk_size in [1, 50, 10_000]:
+        chunks = list(_iter_json(map(orjson.dumps, items), chunk_size=chunk_size))
+        assert orjson.loads(b"".join(chunks)) == items
+    assert b"".join(_iter_json([])) == b"[]"
@@ -0,0 +1,52 @@
+"""Compare /super/search_equips throughput with and without the pooled connections
+
+Runs against the db at config.paths.DB_FILE, so populate it first (see README).
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 bench_db_pool.py
+"""
+
+import argparse
+import asyncio
+import sqlite3
+
+from classes.core.server.server import server
+from classes.db import get_db
+from config import paths
+from tools.bench_utils import hammer, serve
+
+# Small result sets, so that the per-request overhead isn't drowned out by serialization
+QUERIES = [
+    "/super/search_equips?name=leg,oak,heimd&buyer=user1&complete=true",
+    "/super/search_equips?name=peerl,shade&seller=user2&complete=true",
+    "/super/search_equips?name=shade,slau&min_price=4900000&complete=true",
+    "/super/search_equips?buyer=user3&max_price=100000&complete=true",
+]
+
+
+def connect_per_request() -> sqlite3.Connection:
+    """How get_db() used to behave -- a fresh (and never closed) connection per request"""
+
+    DB = sqlite3.connect(paths.DB_FILE, check_same_thread=False)
+    DB.row_factory = sqlite3.Row
+    return DB
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    with serve(server) as base_url:
+        urls = [base_url + q for q in QUERIES]
+
+        server.dependency_overrides[get_db] = connect_per_request
+        before = asyncio.run(hammer(urls, args.concurrency, args.duration))
+        print(f"connect per request: {before}")
+
+        del server.dependency_overrides[get_db]
+        after = asyncio.run(hammer(urls, args.concurrency, args.duration))
+        print(f"pooled connections:  {after}")
+
+
+if __name__ == "__main__":
+    main()
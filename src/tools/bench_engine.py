@@ -0,0 +1,98 @@
+"""Compare the equip searches when answered by the db vs the in-memory engine (see memory_engine.py)
+
+Calls the endpoints in-process (so it excludes the http / middleware overhead, see bench_middleware.py for that)
+and checks that both return the same results.
+
+Runs against the db at config.paths.DB_FILE, so populate it first (see README).
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 bench_engine.py
+"""
+
+import argparse
+import statistics
+import time
+
+import orjson
+from fastapi import Response
+
+from classes.core.server import server
+from classes.core.server.memory_engine import EquipEngine
+from classes.core.server.server import (
+    KEDAMA_EQUIP_FIELDS,
+    KEDAMA_EQUIPS_QUERY,
+    SUPER_EQUIP_FIELDS,
+    SUPER_EQUIPS_QUERY,
+    _select_item,
+    get_kedama_equips,
+    get_super_equips,
+)
+from classes.db import DB_MANAGER
+
+QUERIES = [
+    dict(name="oak"),
+    dict(name="leg,oak,heimd"),
+    dict(name="ab"),
+    dict(buyer_partial="amy"),
+    dict(seller="Amy"),
+    dict(min_price=100_000),
+    dict(min_date=1.6e9, order_by="date", limit=50),
+    dict(order_by="price", limit=50),
+    dict(name="oak", count=True),
+    dict(),
+]
+
+
+def run(endpoint, params: dict, repeat: int) -> tuple[float, object]:
+    """Median time (and result) of a search"""
+
+    times = []
+    with DB_MANAGER.reader() as DB:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = endpoint(**params, DB=DB)
+            times.append(time.perf_counter() - start)
+
+    if isinstance(result, Response):
+        result = orjson.loads(result.body)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engines = dict(
+        super=EquipEngine(DB_MANAGER, _select_item(SUPER_EQUIPS_QUERY, SUPER_EQUIP_FIELDS), "se.rowid", "se.price", "sa.end_time", "sa.is_complete"),
+        kedama=EquipEngine(DB_MANAGER, _select_item(KEDAMA_EQUIPS_QUERY, KEDAMA_EQUIP_FIELDS), "equip.rowid", "equip.price", "list.start_time"),
+    )  # fmt: skip
+    for source, engine in engines.items():
+        start = time.perf_counter()
+        engine.load()
+        print(f"load {source}: {time.perf_counter() - start:.2f}s")
+
+    ms = lambda x: f"{x * 1000:.2f}ms"
+    for endpoint in [get_super_equips, get_kedama_equips]:
+        print(endpoint.__name__)
+        for params in QUERIES:
+            server.EQUIP_ENGINES = dict()
+            sql_time, expected = run(endpoint, params, args.repeat)
+
+            server.EQUIP_ENGINES = engines
+            memory_time, result = run(endpoint, params, args.repeat)
+
+            # Unordered results can come back in any order
+            same = result == expected
+            if not same and "order_by" not in params and isinstance(result, list):
+                key = lambda item: (item["auction"]["id"], item["id"])
+                same = sorted(result, key=key) == sorted(expected, key=key)
+
+            size = result["count"] if isinstance(result, dict) else len(result)  # type: ignore
+            print(
+                f"  {params}: {size} rows"
+                + f" | sql {ms(sql_time)} memory {ms(memory_time)} ({sql_time / memory_time:.1f}x)"
+                + ("" if same else " | RESULTS DIFFER")
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measure the overhead of the server's middleware stack
+
+Compares the app with and without its middleware on
+    - small responses (per-request overhead)
+    - a large export (time to first byte, total time, and peak memory while downloading)
+
+Runs against the db at config.paths.DB_FILE, so populate it first (see README).
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 bench_middleware.py
+"""
+
+import argparse
+import asyncio
+import resource
+import time
+
+from aiohttp import ClientSession
+from fastapi import FastAPI
+
+from classes.core.server.server import server
+from tools.bench_utils import hammer, serve
+
+SMALL_QUERIES = ["/cache/stats"]
+LARGE_QUERY = "/export/sqlite"
+
+
+async def download(url: str, count: int) -> str:
+    """Fetch url repeatedly, reading the body in chunks like a client would"""
+
+    ttfbs, totals, size = [], [], 0
+    async with ClientSession(auto_decompress=False) as session:
+        for _ in range(count):
+            start = time.perf_counter()
+            # Uncompressed, for the largest body
+            async with session.get(
+                url, headers={"Accept-Encoding": "identity"}
+            ) as resp:
+                first = await resp.content.readany()
+                ttfbs.append(time.perf_counter() - start)
+
+                size = len(first)
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+            totals.append(time.perf_counter() - start)
+
+    ms = lambda xs: f"{min(xs) * 1000:.0f}ms"
+    return f"{size / 1024**2:.1f} MB | ttfb {ms(ttfbs)} total {ms(totals)} (best of {count})"
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--downloads", type=int, default=5)
+    args = parser.parse_args()
+
+    # Same routes, minus the middleware added in server.py
+    bare = FastAPI()
+    bare.router = server.router
+
+    stacks = [("without middleware", bare), ("with middleware", server)]
+    for label, app in stacks:
+        with serve(app) as base_url:
+            # Build the export before measuring
+            asyncio.run(download(base_url + LARGE_QUERY, 1))
+
+            small = asyncio.run(
+                hammer(
+                    [base_url + q for q in SMALL_QUERIES],
+                    args.concurrency,
+                    args.duration,
+                )
+            )
+            print(f"{label} | small:  {small}")
+
+            rss = max_rss_mb()
+            large = asyncio.run(download(base_url + LARGE_QUERY, args.downloads))
+            print(f"{label} | export: {large} | peak rss +{max_rss_mb() - rss:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Helpers for benchmarking the API in-process
+
+Usage from another script (with PYTHONPATH=src):
+    with serve(server) as base_url:
+        result = asyncio.run(hammer([base_url + "/super/search_equips?name=oak"]))
+        print(result)
+"""
+
+import asyncio
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+
+import uvicorn
+from aiohttp import ClientSession, TCPConnector
+
+
+@dataclass
+class BenchResult:
+    elapsed: float
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    bytes: int = 0
+    groups: dict[str, "BenchResult"] = field(default_factory=dict)
+
+    @property
+    def rps(self) -> float:
+        return len(self.latencies) / self.elapsed
+
+    def percentile(self, pct: float) -> float:
+        if not self.latencies:
+            return 0
+        ordered = sorted(self.latencies)
+        idx = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[idx]
+
+    def __str__(self):
+        ms = lambda x: f"{x * 1000:.1f}ms"
+        mean = statistics.mean(self.latencies) if self.latencies else 0
+        return (
+            f"{len(self.latencies)} reqs in {self.elapsed:.1f}s = {self.rps:.1f} req/s"
+            + f" | mean {ms(mean)} p50 {ms(self.percentile(50))} p99 {ms(self.percentile(99))}"
+            + f" | {self.errors} errors"
+        )
+
+
+@contextmanager
+def serve(app, port=4546, **kwargs) -> Iterator[str]:
+    """Run uvicorn in a background thread"""
+
+    config = uvicorn.Config(app, port=port, log_level="warning", **kwargs)
+    server = uvicorn.Server(config)
+
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+async def hammer(
+    urls: list[str],
+    concurrency: int = 8,
+    duration: float = 10,
+    group: Optional[Callable[[str], str]] = None,
+) -> BenchResult:
+    """Have N clients cycle through urls for some duration
+
+    Args:
+        group: Name of the group of a url (eg its path), to also collect results per group in result.groups
+    """
+
+    result = BenchResult(elapsed=0)
+    deadline = time.perf_counter() + duration
+
+    async def client(session: ClientSession, offset: int):
+        idx = offset
+        while time.perf_counter() < deadline:
+            url = urls[idx % len(urls)]
+            idx += 1
+
+            start = time.perf_counter()
+            async with session.get(url) as resp:
+                body = await resp.read()
+            end = time.perf_counter()
+
+            targets = [result]
+            if group is not None:
+                targets.append(result.groups.setdefault(group(url), BenchResult(elapsed=0)))  # fmt: skip
+
+            for target in targets:
+                if resp.status != 200:
+                    target.errors += 1
+                    continue
+                target.latencies.append(end - start)
+                target.bytes += len(body)
+
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[client(session, i) for i in range(concurrency)])
+        result.elapsed = time.perf_counter() - start
+
+    for x in result.groups.values():
+        x.elapsed = result.elapsed
+
+    return result
@@ -0,0 +1,77 @@
+"""Measure how the server's throughput scales with its number of worker processes
+
+Starts run_server.py with each worker count and hammers it with searches over http.
+Each url is distinct (by min_price), so that the searches run instead of being answered by the response cache.
+
+Runs against the db at config.paths.DB_FILE, so populate it first (see README).
+Run it on a host with at least as many cores as the largest worker count, otherwise the workers just share the same cores.
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 bench_workers.py --workers 1 2 4
+"""
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from tools.bench_utils import hammer
+
+RUN_SERVER = Path(__file__).parent.parent / "run_server.py"
+
+SEARCHES = [
+    "/super/search_equips?name=oak&order_by=date&limit=50",
+    "/kedama/search_equips?name=leg,heimd&limit=50",
+    "/equips/search?buyer_partial=amy&order_by=price&limit=50",
+    "/lottery/search?equip=oak&order_by=date&limit=50",
+]
+
+
+def start(workers: int, port: int) -> subprocess.Popen:
+    """Run the server and wait until all of its workers are warmed up"""
+
+    log = tempfile.TemporaryFile("w+")
+    cmd = [sys.executable, str(RUN_SERVER), "--workers", str(workers), "--port", str(port)]  # fmt: skip
+    proc = subprocess.Popen(cmd, cwd=RUN_SERVER.parent, stdout=log, stderr=log)
+
+    while True:
+        if proc.poll() is not None:
+            raise Exception(f"Server exited with {proc.returncode}")
+
+        log.seek(0)
+        if log.read().count("Application startup complete") >= workers:
+            return proc
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=4547)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    urls = [
+        f"{base_url}{search}&min_price={i}"
+        for i in range(10_000)
+        for search in SEARCHES
+    ]
+
+    baseline = None
+    for workers in args.workers:
+        proc = start(workers, args.port)
+        try:
+            result = asyncio.run(hammer(urls, args.concurrency, args.duration))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        baseline = baseline or result.rps
+        print(f"{workers} workers: {result} | {result.rps / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
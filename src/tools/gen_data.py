@@ -0,0 +1,337 @@
+"""Fill a new db with synthetic (but realistically shaped) auction and lottery data, for load tests / benchmarks
+
+Only the scraped tables are filled. The migrations run afterwards, so the tables derived from them
+(the search indexes, all_equips, equip_stats, lottery_results and the price rollups) are built by their backfills,
+like when an old db is upgraded. That's much faster than firing their triggers for each row.
+The shape roughly follows the real data:
+    - a few users do most of the buying / selling / winning (zipf-like weights), and some names aren't ascii
+    - equip names are (quality) (prefix) (type) (suffix), with most of them Legendary / Magnificent
+    - prices are log-normal around a median that depends on the quality, and some equips don't sell
+    - auctions are weekly (Super) / every few days (Kedama), and lotteries are daily
+
+The output is reproducible for a given --seed.
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 gen_data.py ./synthetic.sqlite --equips 100000
+"""
+
+import argparse
+import json
+import math
+import random
+import string
+import time
+from dataclasses import dataclass
+from itertools import accumulate
+from pathlib import Path
+
+from classes.db import ConnectionManager, create_tables, migrate
+
+# (quality, weight, median price)
+QUALITIES = [
+    ("Peerless", 0.005, 60_000_000),
+    ("Legendary", 0.35, 1_500_000),
+    ("Magnificent", 0.45, 150_000),
+    ("Exquisite", 0.15, 30_000),
+    ("Superior", 0.045, 5_000),
+]
+
+PREFIXES = ["Ethereal", "Fiery", "Arctic", "Shocking", "Tempestuous", "Hallowed", "Demonic", "Radiant", "Mystic", "Charged", "Frugal", "Agile", "Savage", "Reinforced"]  # fmt: skip
+
+
+@dataclass
+class Category:
+    code: str  # prefix of the item ids (eg One01)
+    types: list[str]
+    suffixes: list[str]
+    stats: list[tuple[str, int, int]]  # (name, min, max)
+
+
+# fmt: off
+CATEGORIES = [
+    Category("One", ["Rapier", "Club", "Wakizashi", "Axe", "Shortsword"], ["of Slaughter", "of Balance", "of the Nimble", "of Swiftness", "of the Battlecaster"], [("ADB", 20, 90), ("Attack Crit Chance", 2, 12), ("Attack Accuracy", 5, 30), ("Str", 5, 40)]),
+    Category("Two", ["Estoc", "Mace", "Katana", "Longsword", "Scythe"], ["of Slaughter", "of Balance", "of the Nimble", "of Swiftness"], [("ADB", 40, 160), ("Attack Crit Chance", 4, 20), ("Attack Accuracy", 5, 30), ("Str", 10, 60)]),
+    Category("Sta", ["Oak Staff", "Redwood Staff", "Willow Staff", "Katalox Staff"], ["of Heimdall", "of Surtr", "of Niflheim", "of Mjolnir", "of Freyr", "of Destruction", "of Focus", "of the Heaven-sent"], [("MDB", 20, 80), ("Prof", 10, 60), ("Int", 5, 40), ("Wis", 5, 40)]),
+    Category("Clo", ["Phase Robe", "Phase Cap", "Phase Gloves", "Cotton Pants", "Cotton Shoes"], ["of the Arcanist", "of Heimdall", "of Surtr", "of Focus", "of the Elementalist"], [("MDB", 2, 20), ("Prof", 2, 15), ("Evade", 1, 8)]),
+    Category("Lig", ["Shade Breastplate", "Shade Helmet", "Shade Gauntlets", "Leather Leggings", "Leather Boots"], ["of the Shadowdancer", "of the Fleet", "of Negation", "of Protection"], [("ADB", 2, 20), ("Evade", 2, 12), ("Attack Crit Chance", 1, 6)]),
+    Category("Hea", ["Power Armor", "Power Helmet", "Plate Cuirass", "Plate Greaves", "Plate Sabatons"], ["of Slaughter", "of Protection", "of Warding", "of Dampening", "of Stoneskin"], [("ADB", 2, 25), ("Block", 1, 10), ("Parry", 1, 10)]),
+    Category("Shd", ["Force Shield", "Buckler", "Kite Shield", "Tower Shield"], ["of Protection", "of the Barrier", "of Warding", "of Fenrir"], [("Block", 20, 45), ("Parry", 1, 10), ("Mitigation", 1, 10)]),
+]
+
+MATS = [("Legendary Weapon Core", 300_000), ("Legendary Armor Core", 250_000), ("Binding of Slaughter", 500_000), ("Binding of Protection", 100_000), ("Chaos Token", 30_000), ("Energy Drink", 20_000), ("Crystallized Phazon", 15_000)]  # fmt: skip
+
+# (place, quantities, name) of the non-equip lottery prizes
+LOTTERY_PRIZES = [("2", (1, 5), "Golden Lottery Ticket"), ("3", (1, 10), "Chaos Token"), ("4", (10, 50), "Caffeinated Candy"), ("5", (10, 50), "Energy Drink")]  # fmt: skip
+
+SYLLABLES = ["ka", "mi", "ro", "zu", "ne", "to", "shi", "an", "el", "ia", "or", "yu", "ba", "le", "th", "ar", "ion", "de", "ri", "sa"]  # fmt: skip
+UNICODE_NAMES = ["앤 마이어", "프레이 마이어", "éléonore", "Zoë", "Renée", "Ñandú", "ゆき", "Straße"]  # fmt: skip
+# fmt: on
+
+# Seconds
+WEEK = 7 * 24 * 3600
+DAY = 24 * 3600
+SUPER_START = 1_550_000_000  # early 2019
+KEDAMA_START = 1_420_000_000  # early 2015
+
+
+class Generator:
+    def __init__(self, seed: int, users: int, per_auction: int):
+        self.rng = random.Random(seed)
+        self.per_auction = per_auction
+
+        self.users = self._make_users(users)
+        # Zipf-like popularity, so that a few users appear in most of the rows
+        self.user_weights = list(accumulate(1 / (i + 1) ** 0.8 for i in range(len(self.users))))  # fmt: skip
+        self.quality_weights = list(accumulate(w for _, w, _ in QUALITIES))
+
+        self._next_eid = 100_000_000
+
+    def _make_users(self, count: int) -> list[str]:
+        names = set(UNICODE_NAMES[: max(0, count // 100)])
+        while len(names) < count:
+            name = "".join(self.rng.choices(SYLLABLES, k=self.rng.randint(2, 4)))
+            if self.rng.random() < 0.3:
+                name = name.capitalize()
+            if self.rng.random() < 0.1:
+                name += str(self.rng.randint(1, 99))
+            names.add(name)
+
+        result = sorted(names)
+        self.rng.shuffle(result)
+        return result
+
+    def user(self) -> str:
+        return self.rng.choices(self.users, cum_weights=self.user_weights)[0]
+
+    def price(self, median: float) -> int:
+        """Log-normal, rounded to 1k"""
+
+        value = median * math.exp(self.rng.gauss(0, 0.9))
+        return max(1, round(value / 1000)) * 1000
+
+    def equip(self, auction: str) -> dict:
+        """Columns shared by super_equips and kedama_equips (the id is numbered by auction_items)"""
+
+        rng = self.rng
+        quality, _, median = rng.choices(QUALITIES, cum_weights=self.quality_weights)[0]  # fmt: skip
+        category = rng.choice(CATEGORIES)
+
+        words = [quality]
+        if rng.random() < 0.6:
+            words.append(rng.choice(PREFIXES))
+        words.append(rng.choice(category.types))
+        words.append(rng.choice(category.suffixes))
+
+        stats = [
+            f"{name} {rng.randint(lo, hi)}%"
+            for name, lo, hi in rng.sample(category.stats, rng.randint(1, len(category.stats)))
+        ]  # fmt: skip
+
+        self._next_eid += rng.randint(1, 5000)
+        sold = rng.random() < 0.75
+
+        return dict(
+            id=category.code,
+            id_auction=auction,
+            name=" ".join(words),
+            eid=self._next_eid,
+            key="".join(rng.choices(string.hexdigits[:16], k=10)),
+            is_isekai=int(rng.random() < 0.1),
+            level=rng.choice([None, 0, rng.randint(1, 500)]),
+            stats=json.dumps(stats),
+            price=self.price(median) if sold else None,
+            buyer=self.user() if sold else None,
+            seller=self.user(),
+        )
+
+    def mat(self, auction: str, idx: int) -> dict:
+        name, median = self.rng.choice(MATS)
+        quantity = self.rng.choice([1, 1, 1, 5, 10, 50, 100])
+        sold = self.rng.random() < 0.85
+        price = self.price(median * quantity) if sold else None
+
+        return dict(
+            id=f"Mat{idx:02d}",
+            id_auction=auction,
+            name=name,
+            quantity=quantity,
+            unit_price=price / quantity if price else None,
+            price=price,
+            buyer=self.user() if sold else None,
+            seller=self.user(),
+        )
+
+    def auction_items(self, auction: str) -> tuple[list[dict], list[dict]]:
+        """(equips, mats) of an auction, with the item ids numbered per category like the real ones"""
+
+        counts: dict[str, int] = dict()
+        equips = []
+        for _ in range(self.rng.randint(self.per_auction // 2, self.per_auction * 3 // 2)):  # fmt: skip
+            equip = self.equip(auction)
+            code = equip["id"]
+            counts[code] = counts.get(code, 0) + 1
+            equip["id"] = f"{code}{counts[code]:02d}"
+            equips.append(equip)
+
+        mats = [self.mat(auction, i + 1) for i in range(self.rng.randint(0, 10))]
+        return equips, mats
+
+    def lottery(self, type: str, id: int, date: float) -> dict:
+        rng = self.rng
+        quality = "Peerless" if rng.random() < 0.5 else "Legendary"
+        category = rng.choice(
+            [c for c in CATEGORIES if (c.code in ["One", "Two", "Sta"]) == (type == "weapon")]
+        )  # fmt: skip
+
+        row = {
+            "id": id,
+            "date": date,
+            "tickets": round(rng.lognormvariate(math.log(60_000), 0.5)),
+            # Unclaimed equips show up as a missing prize
+            "1_prize": None if rng.random() < 0.02 else f"{quality} {rng.choice(PREFIXES)} {rng.choice(category.types)} {rng.choice(category.suffixes)}",
+            "1_user": self.user(),
+            "1b_prize": f"{quality} {type.capitalize()} Core",
+            "1b_user": None if rng.random() < 0.05 else self.user(),
+        }  # fmt: skip
+        for place, (lo, hi), name in LOTTERY_PRIZES:
+            row[f"{place}_prize"] = json.dumps([rng.randint(lo, hi), name])
+            row[f"{place}_user"] = self.user()
+        return row
+
+
+def fill_super(DB, gen: Generator, count: int) -> None:
+    auction = 0
+    while count > 0:
+        auction += 1
+        id = str(200_000 + auction * 37)
+        end_time = SUPER_START + auction * WEEK
+        equips, mats = gen.auction_items(id)
+        equips = equips[:count]
+        count -= len(equips)
+
+        # The last auction is still running (bids but no final prices)
+        is_complete = int(count > 0)
+        DB.execute(
+            "INSERT INTO super_auctions (id, title, end_time, is_complete, last_fetch_time) VALUES (?, ?, ?, ?, ?)",
+            (id, str(auction), end_time, is_complete, end_time),
+        )
+        for item in equips + mats:
+            item["bid_link"] = None
+            item["next_bid"] = (item["price"] or 0) + 1000
+
+        DB.executemany(
+            """
+            INSERT INTO super_equips
+            (id, id_auction, name, eid, key, is_isekai, level, stats, price, bid_link, next_bid, buyer, seller)
+            VALUES (:id, :id_auction, :name, :eid, :key, :is_isekai, :level, :stats, :price, :bid_link, :next_bid, :buyer, :seller)
+            """,
+            equips,
+        )
+        DB.executemany(
+            """
+            INSERT INTO super_mats
+            (id, id_auction, name, quantity, unit_price, price, bid_link, next_bid, buyer, seller)
+            VALUES (:id, :id_auction, :name, :quantity, :unit_price, :price, :bid_link, :next_bid, :buyer, :seller)
+            """,
+            mats,
+        )
+
+
+def fill_kedama(DB, gen: Generator, count: int) -> None:
+    auction = 0
+    while count > 0:
+        auction += 1
+        id = str(150_000 + auction * 53)
+        start_time = KEDAMA_START + auction * 3 * DAY
+        equips, mats = gen.auction_items(id)
+        equips = equips[:count]
+        count -= len(equips)
+
+        title_short = str(auction)
+        DB.execute(
+            "INSERT INTO kedama_auctions (id, title_short, title, start_time, is_complete) VALUES (?, ?, ?, ?, ?)",
+            (id, title_short, f"[Auction] Kedama's Auction #{title_short}", start_time, 1),
+        )  # fmt: skip
+        for idx, item in enumerate(equips + mats):
+            item["start_bid"] = gen.price(10_000)
+            item["post_index"] = idx // 50 + 1
+
+        DB.executemany(
+            """
+            INSERT INTO kedama_equips
+            (id, id_auction, name, eid, key, is_isekai, level, stats, price, start_bid, post_index, buyer, seller)
+            VALUES (:id, :id_auction, :name, :eid, :key, :is_isekai, :level, :stats, :price, :start_bid, :post_index, :buyer, :seller)
+            """,
+            equips,
+        )
+        DB.executemany(
+            """
+            INSERT INTO kedama_mats
+            (id, id_auction, name, quantity, unit_price, price, start_bid, post_index, buyer, seller)
+            VALUES (:id, :id_auction, :name, :quantity, :unit_price, :price, :start_bid, :post_index, :buyer, :seller)
+            """,
+            mats,
+        )
+
+
+def fill_lotteries(DB, gen: Generator, count: int, end: float) -> None:
+    for type in ["weapon", "armor"]:
+        rows = [
+            gen.lottery(type, id, end - (count - id) * DAY)
+            for id in range(1, count + 1)
+        ]
+
+        DB.executemany(
+            f"""
+            INSERT INTO lottery_{type}
+            (id, date, tickets, "1_prize", "1_user", "1b_prize", "1b_user", "2_prize", "2_user", "3_prize", "3_user", "4_prize", "4_user", "5_prize", "5_user")
+            VALUES (:id, :date, :tickets, :1_prize, :1_user, :1b_prize, :1b_user, :2_prize, :2_user, :3_prize, :3_user, :4_prize, :4_user, :5_prize, :5_user)
+            """,
+            rows,
+        )
+
+
+def generate(
+    fp: Path,
+    equips: int,
+    lotteries: int,
+    users: int = 2000,
+    per_auction: int = 150,
+    seed: int = 0,
+) -> None:
+    """Create a db at fp with this many equips (per source) and lotteries (per type)"""
+
+    if fp.exists():
+        raise Exception(f"{fp} already exists")
+
+    gen = Generator(seed, users, per_auction)
+    manager = ConnectionManager(fp)
+    try:
+        DB = manager.writer
+        create_tables(DB)
+
+        with DB:
+            fill_super(DB, gen, equips)
+            fill_kedama(DB, gen, equips)
+            fill_lotteries(DB, gen, lotteries, end=SUPER_START + equips / per_auction * WEEK)  # fmt: skip
+
+        migrate(DB)
+    finally:
+        manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fp", type=Path)
+    parser.add_argument("--equips", type=int, default=30_000, help="Per source (Super / Kedama)")  # fmt: skip
+    parser.add_argument("--lotteries", type=int, default=3_000, help="Per type (weapon / armor)")  # fmt: skip
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--per-auction", type=int, default=150, help="Average equips per auction")  # fmt: skip
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generate(args.fp, args.equips, args.lotteries, args.users, args.per_auction, args.seed)  # fmt: skip
+    print(f"Generated {args.fp} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Replay a mix of API requests against a db and report the throughput / latency of each endpoint
+
+The requests are generated from the db's own users and from the vocabulary of gen_data.py,
+so pair it with a synthetic db to test at a given scale:
+    export PYTHONPATH=/path/to/AmyBotV2/src
+    python3 gen_data.py /tmp/load.sqlite --equips 100000
+    python3 load_test.py --db /tmp/load.sqlite --save baseline.json
+    (change something)
+    python3 load_test.py --db /tmp/load.sqlite --compare baseline.json
+
+By default the server runs in this process (like bench_middleware.py).
+With --url, an already running server is tested instead (eg run_server.py with several workers),
+in which case --db is only read to generate the requests.
+"""
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlencode, urlparse
+from urllib.request import urlopen
+
+import orjson
+
+from classes.core.server.exports import EXPORTS
+from classes.core.server.server import server
+from classes.db import DB_MANAGER
+from config import paths
+from tools.bench_utils import BenchResult, hammer, serve
+from tools.gen_data import CATEGORIES, PREFIXES, QUALITIES
+
+# (weight, endpoint) of the request mix
+MIX = [
+    (30, "/super/search_equips"),
+    (25, "/kedama/search_equips"),
+    (25, "/lottery/search"),
+    (10, "/equips/search"),
+    (9, "/export/changes"),
+    (1, "/export/sqlite-file"),
+]
+
+
+class Requests:
+    """Random (but reproducible) query strings for each endpoint of MIX"""
+
+    def __init__(self, fp: Path, seed: int):
+        self.rng = random.Random(seed)
+
+        with sqlite3.connect(fp) as DB:
+            self.users = [r[0] for r in DB.execute("SELECT seller FROM super_equips WHERE seller IS NOT NULL GROUP BY seller ORDER BY COUNT(*) DESC LIMIT 200")]  # fmt: skip
+            self.version = DB.execute("SELECT value FROM data_generation").fetchone()[0]  # fmt: skip
+
+        words = [q for q, _, _ in QUALITIES] + PREFIXES
+        for c in CATEGORIES:
+            words += c.types + c.suffixes
+        self.words = [w.lower() for w in words]
+
+    def url(self, endpoint: str) -> str:
+        make = getattr(self, endpoint.strip("/").replace("/", "_").replace("-", "_"))
+        params = {k: v for k, v in make().items() if v is not None}
+        return endpoint + ("?" + urlencode(params) if params else "")
+
+    def fragment(self) -> str:
+        """Part of a name, like what the bot is sent (eg "leg oak" or "heimd")"""
+
+        word = self.rng.choice(self.words).split()[-1]
+        return word[: self.rng.randint(3, len(word))] if len(word) > 3 else word
+
+    def user(self) -> str:
+        # Skewed towards the most active users, like the requests are
+        idx = min(int(self.rng.expovariate(1 / 20)), len(self.users) - 1)
+        return self.users[idx]
+
+    def equip_search(self) -> dict:
+        rng = self.rng
+        return dict(
+            name=",".join(self.fragment() for _ in range(rng.randint(1, 3))),
+            buyer=self.user() if rng.random() < 0.1 else None,
+            seller_partial=self.user()[:4] if rng.random() < 0.1 else None,
+            min_price=rng.choice([None, None, None, 100_000, 1_000_000]),
+            order_by=rng.choice([None, "date", "date", "price"]),
+            limit=rng.choice([None, 50, 50, 200]),
+        )
+
+    def super_search_equips(self) -> dict:
+        return self.equip_search()
+
+    def kedama_search_equips(self) -> dict:
+        return self.equip_search()
+
+    def equips_search(self) -> dict:
+        return self.equip_search()
+
+    def lottery_search(self) -> dict:
+        rng = self.rng
+        by_user = rng.random() < 0.5
+        return dict(
+            equip=None if by_user else self.fragment(),
+            user=self.user() if by_user else None,
+            order_by="date",
+            limit=rng.choice([None, 50]),
+        )
+
+    def export_changes(self) -> dict:
+        # A mirror that's a few changes behind
+        return dict(since=max(0, self.version - self.rng.randint(1, 1000)))
+
+    def export_sqlite_file(self) -> dict:
+        return dict()
+
+
+def make_urls(fp: Path, count: int, seed: int) -> list[str]:
+    requests = Requests(fp, seed)
+    endpoints = [e for _, e in MIX]
+    weights = [w for w, _ in MIX]
+    return [
+        requests.url(endpoint)
+        for endpoint in requests.rng.choices(endpoints, weights, k=count)
+    ]
+
+
+def summarize(result: BenchResult) -> dict:
+    """Numbers that are saved / compared (ms)"""
+
+    return dict(
+        rps=result.rps,
+        p50=result.percentile(50) * 1000,
+        p90=result.percentile(90) * 1000,
+        p99=result.percentile(99) * 1000,
+        errors=result.errors,
+    )
+
+
+def report(result: BenchResult, baseline: Optional[dict]) -> dict:
+    rows = {"all": summarize(result)}
+    for path, group in sorted(result.groups.items()):
+        rows[path] = summarize(group)
+
+    for name, row in rows.items():
+        line = f"{name:22} {row['rps']:7.1f} req/s | p50 {row['p50']:7.1f}ms p90 {row['p90']:7.1f}ms p99 {row['p99']:7.1f}ms | {row['errors']} errors"  # fmt: skip
+
+        old = (baseline or dict()).get(name)
+        if old:
+            change = lambda k: f"{(row[k] - old[k]) / old[k] * 100:+.0f}%" if old[k] else "n/a"  # fmt: skip
+            line += f" | vs baseline: req/s {change('rps')} p50 {change('p50')} p99 {change('p99')}"  # fmt: skip
+        print(line)
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", type=Path, default=paths.DB_FILE)
+    parser.add_argument("--url", help="Test a running server instead (eg http://127.0.0.1:4545)")  # fmt: skip
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--requests", type=int, default=5000, help="Distinct requests to cycle through")  # fmt: skip
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", type=Path, help="Write the results to a json file")
+    parser.add_argument("--compare", type=Path, help="Results saved by an earlier run")
+    args = parser.parse_args()
+
+    urls = make_urls(args.db, args.requests, args.seed)
+    group = lambda url: urlparse(url).path
+    baseline = orjson.loads(args.compare.read_bytes()) if args.compare else None
+
+    def run(base_url: str) -> BenchResult:
+        # Once first, so that the export file is built before measuring
+        if "/export/sqlite-file" in urls:
+            urlopen(base_url + "/export/sqlite-file").read()
+        return asyncio.run(hammer([base_url + x for x in urls], args.concurrency, args.duration, group))  # fmt: skip
+
+    if args.url:
+        result = run(args.url)
+    else:
+        with tempfile.TemporaryDirectory() as export_dir:
+            DB_MANAGER.fp = args.db
+            EXPORTS.fp = args.db
+            EXPORTS.dir = Path(export_dir)
+            with serve(server) as base_url:
+                result = run(base_url)
+
+    rows = report(result, baseline)
+    if args.save:
+        args.save.write_bytes(orjson.dumps(rows, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Keep a local copy of the exported tables in sync with the server
+
+The first run downloads /export/sqlite-file, later runs only apply /export/changes since the previous run.
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 mirror.py ./mirror.sqlite
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import urllib.request
+from pathlib import Path
+from typing import Iterable
+
+DEFAULT_URL = "https://hvdata.gisadan.dev"
+
+
+def apply_changes(DB: sqlite3.Connection, lines: Iterable[bytes]) -> int:
+    """Apply the output of /export/changes in one transaction
+
+    Nothing is applied unless the response ends with its version line (ie it wasn't cut off).
+
+    Returns:
+        The version to request changes since next time
+    """
+
+    with DB:
+        version = None
+        for line in lines:
+            if not line.strip():
+                continue
+
+            if version is not None:
+                raise Exception("Response continues after the version")
+
+            item = json.loads(line)
+            if "version" in item:
+                version = item["version"]
+            elif item["op"] == "upsert":
+                cols = ", ".join(f'"{k}"' for k in item["row"])
+                vals = ", ".join("?" for _ in item["row"])
+                DB.execute(
+                    f"INSERT OR REPLACE INTO {item['table']} ({cols}) VALUES ({vals})",
+                    list(item["row"].values()),
+                )
+            elif item["op"] == "delete":
+                where = " AND ".join(f'"{k}" = ?' for k in item["key"])
+                DB.execute(
+                    f"DELETE FROM {item['table']} WHERE {where}",
+                    list(item["key"].values()),
+                )
+            else:
+                raise Exception(item)
+
+        # The version line comes last, so it's missing if the response was truncated
+        #   (raising here rolls back the changes above)
+        if version is None:
+            raise Exception("Response is missing the version, it may have been cut off")
+        set_version(DB, version)
+
+    return version
+
+
+def get_version(DB: sqlite3.Connection) -> int | None:
+    DB.execute(
+        "CREATE TABLE IF NOT EXISTS mirror_version (version INTEGER NOT NULL) STRICT"
+    )
+    row = DB.execute("SELECT version FROM mirror_version").fetchone()
+    return row[0] if row else None
+
+
+def set_version(DB: sqlite3.Connection, version: int) -> None:
+    DB.execute("DELETE FROM mirror_version")
+    DB.execute("INSERT INTO mirror_version (version) VALUES (?)", (version,))
+
+
+def download_snapshot(url: str, fp: Path) -> None:
+    tmp = fp.with_name(fp.name + ".tmp")
+    with urllib.request.urlopen(f"{url}/export/sqlite-file") as resp, open(tmp, "wb") as file:  # fmt: skip
+        shutil.copyfileobj(resp, file)
+        version = int(resp.headers["X-Data-Generation"])
+
+    DB = sqlite3.connect(tmp)
+    with DB:
+        get_version(DB)
+        set_version(DB, version)
+    DB.close()
+
+    os.replace(tmp, fp)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db", type=Path)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    args = parser.parse_args()
+
+    if not args.db.exists():
+        print(f"Downloading snapshot to {args.db}")
+        download_snapshot(args.url, args.db)
+
+    DB = sqlite3.connect(args.db)
+    since = get_version(DB)
+    if since is None:
+        raise Exception(f"{args.db} wasn't created by this script")
+
+    with urllib.request.urlopen(f"{args.url}/export/changes?since={since}") as resp:
+        version = apply_changes(DB, resp)
+    print(f"Updated {args.db} from version {since} to {version}")
+
+
+if __name__ == "__main__":
+    main()
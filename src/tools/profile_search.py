@@ -0,0 +1,67 @@
+"""CPU profile of a search, from the query to the encoded response body
+
+Calls the endpoint in-process (on this thread, so that cProfile sees it) and then encodes its result
+the way FastAPI would, which for anything other than a Response is jsonable_encoder + JSONResponse.
+
+Runs against the db at config.paths.DB_FILE, so populate it first (see README).
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 profile_search.py --limit 10000
+"""
+
+import argparse
+import cProfile
+import pstats
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from classes.core.server import server
+from classes.db import DB_MANAGER
+
+ENDPOINTS = dict(
+    super=server.get_super_equips,
+    kedama=server.get_kedama_equips,
+    all=server.get_all_equips,
+    lottery=server.get_lottery,
+)
+
+
+def search(endpoint, params: dict) -> int:
+    """Run a search and return the size of its body"""
+
+    with DB_MANAGER.reader() as DB:
+        result = endpoint(**params, DB=DB)
+
+    if not isinstance(result, Response):
+        result = JSONResponse(jsonable_encoder(result))
+    return len(result.body)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoint", choices=list(ENDPOINTS), default="super")
+    parser.add_argument("--limit", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    endpoint = ENDPOINTS[args.endpoint]
+    params = dict(order_by="date", limit=args.limit)
+    search(endpoint, params)  # warm up the page cache
+
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        size = search(endpoint, params)
+        times.append(time.perf_counter() - start)
+    print(
+        f"{size / 1024:.0f} KiB body | best of {args.repeat}: {min(times) * 1000:.1f}ms"
+    )
+
+    profile = cProfile.Profile()
+    profile.runcall(search, endpoint, params)
+    pstats.Stats(profile).sort_stats("tottime").print_stats(args.top)
+
+
+if __name__ == "__main__":
+    main()
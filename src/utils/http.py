@@ -1,16 +1,19 @@
 from typing import Any, Literal
 
+import msgpack
 from aiohttp import ClientSession
 from bs4 import BeautifulSoup
 from yarl import URL
 
 from config import logger
 
+MSGPACK_TYPE = "application/msgpack"
+
 
 async def do_get(
     url: str | URL,
     session: ClientSession | None = None,
-    content_type: Literal["html", "text", "json"] = "html",
+    content_type: Literal["html", "text", "json", "msgpack"] = "html",
 ) -> Any:
     """Perform a GET
 
@@ -18,6 +21,7 @@ async def do_get(
         url:
         session: For accumulating cookies
         content_type: Whether to return a BeautifulSoup instance, str, or list / dict
+            For "msgpack", MessagePack is requested (with the Accept header), but json is also accepted
 
     Raises:
         Exception:
@@ -25,8 +29,10 @@ async def do_get(
     """
     session_ = session or create_session()
 
+    headers = {"Accept": MSGPACK_TYPE} if content_type == "msgpack" else None
+
     logger.info(f"GET {url}")
-    resp = await session_.get(url)
+    resp = await session_.get(url, headers=headers)
     if resp.status != 200:
         raise Exception(resp.status)
 
@@ -38,6 +44,10 @@ async def do_get(
             result = await resp.text(encoding="utf-8")
         case "json":
             result = await resp.json(encoding="utf-8")
+        case "msgpack" if resp.content_type == MSGPACK_TYPE:
+            result = msgpack.unpackb(await resp.read())
+        case "msgpack":
+            result = await resp.json(encoding="utf-8")
         case default:
             raise Exception(content_type)
 
@@ -47,6 +57,20 @@ async def do_get(
     return result
 
 
+def from_columns(columns: dict) -> list[dict]:
+    """Turn a response with format=columns back into a list of items
+
+    eg dict(id=[1, 2], auction=dict(id=[3, 4])) becomes [dict(id=1, auction=dict(id=3)), dict(id=2, auction=dict(id=4))]
+    """
+
+    if not columns:
+        return []
+
+    keys = list(columns)
+    values = [from_columns(v) if isinstance(v, dict) else v for v in columns.values()]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+
 async def do_post(
     url: URL,
     data: Any = None,
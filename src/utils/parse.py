@@ -1,7 +1,8 @@
 from datetime import datetime
 from decimal import Decimal
+import json
 import re
-from typing import Any, Generator
+from typing import Any, Generator, Iterable, Mapping
 from bs4 import NavigableString, Tag
 
 from yarl import URL
@@ -95,6 +96,48 @@ def parse_equip_link(text: str) -> tuple[int, str, bool] | None:
     return None
 
 
+def parse_stats(stats: Iterable[str]) -> list[tuple[str, float]]:
+    """Split equip stats into (name, value) pairs
+
+    eg ["Holy EDB 73%", "Prof 41%"] becomes [("Holy EDB", 73.0), ("Prof", 41.0)]
+    Stats without a trailing number are skipped.
+    """
+
+    result = []
+    for text in stats:
+        if m := re.fullmatch(r"\s*(.*\S)\s+([+-]?\d+(?:\.\d+)?)\s*%?\s*", text):
+            result.append((m.group(1), float(m.group(2))))
+    return result
+
+
+# Prize columns of the lottery tables, in order
+LOTTERY_PLACES = ["1", "1b", "2", "3", "4", "5"]
+
+
+def parse_lottery_prizes(
+    row: Mapping[str, Any]
+) -> list[tuple[str, str, int, str | None]]:
+    """Split a row of lottery_weapon / lottery_armor into (place, user, prize_qty, prize_name)
+
+    eg {"2_prize": '[10, "Chaos Tokens"]', "2_user": "Amy", ...} becomes [..., ("2", "Amy", 10, "Chaos Tokens"), ...]
+    The equip and core prizes have a quantity of 1. Places without a winner are skipped.
+    """
+
+    result = []
+    for place in LOTTERY_PLACES:
+        user = row[f"{place}_user"]
+        if user is None:
+            continue
+
+        prize = row[f"{place}_prize"]
+        if place in ["1", "1b"]:
+            qty, name = 1, prize
+        else:
+            qty, name = json.loads(prize)
+        result.append((place, user, qty, name))
+    return result
+
+
 def create_equip_link(eid: int, key: str, is_isekai=False) -> URL:
     url = URL("https://hentaiverse.org/")
     if is_isekai:
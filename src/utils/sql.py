@@ -6,7 +6,7 @@ from typing import Any, Literal
 class WhereBuilder:
     mode: Literal["OR", "AND"] = "AND"
     ignore_case: bool = True
-    fragments: list["Condition | WhereBuilder"] = field(default_factory=list)
+    fragments: list["Condition | Subquery | WhereBuilder"] = field(default_factory=list)
 
     def add(self, expr: str, data: Any = None):
         self.fragments.append(Condition(expr, data))
@@ -14,6 +14,15 @@ class WhereBuilder:
     def add_builder(self, builder: "WhereBuilder"):
         self.fragments.append(builder)
 
+    def add_subquery(self, expr: str, builder: "WhereBuilder"):
+        """Add a condition containing its own WHERE clause
+
+        Args:
+            expr: Condition with a {where} placeholder (eg "x IN (SELECT x FROM y {where})")
+            builder:
+        """
+        self.fragments.append(Subquery(expr, builder))
+
     def print(self, root=True) -> tuple[str, list[Any]]:
         if len(self.fragments) == 0:
             return ("", [])
@@ -24,12 +33,22 @@ class WhereBuilder:
             for frag in self.fragments:
                 if isinstance(frag, Condition):
                     ex = frag.expr
-                    if self.ignore_case:
+                    # Only for text, a collation on numeric comparisons prevents index use
+                    if self.ignore_case and isinstance(frag.data, str):
                         ex += " COLLATE NOCASE"
                     exprs.append(ex)
 
-                    if frag.data is not None:
-                        data.append(str(frag.data))
+                    # Values are bound as-is (not as text), so that comparisons with expressions
+                    # that have no type affinity (eg strftime(), a view's computed column) are numeric
+                    if isinstance(frag.data, tuple):
+                        # Multiple placeholders (eg a row value comparison)
+                        data.extend(frag.data)
+                    elif frag.data is not None:
+                        data.append(frag.data)
+                elif isinstance(frag, Subquery):
+                    e, d = frag.builder.print()
+                    exprs.append(frag.expr.format(where=e))
+                    data.extend(d)
                 elif isinstance(frag, WhereBuilder):
                     e, d = frag.print(root=False)
                     exprs.append(e)
@@ -50,3 +69,9 @@ class WhereBuilder:
 class Condition:
     expr: str
     data: Any = None
+
+
+@dataclass
+class Subquery:
+    expr: str
+    builder: WhereBuilder